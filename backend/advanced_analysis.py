@@ -1,99 +1,152 @@
 # advanced_analysis.py
 from collections import defaultdict
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 import chess
 import chess.pgn
 import numpy as np
 from scipy import stats
 
+from analysis_engine import ENDGAME_MATERIAL, material
+from config import config
+from openings import get_opening_book
+
 class TimePressureAnalyzer:
+    TIME_BINS = [0, 30, 60, 120, 300, float('inf')]
+    BIN_LABELS = ["<30s", "30-60s", "1-2m", "2-5m", "5m+"]
+    # Remaining-clock bin edges (seconds) by game speed, so a bullet game's
+    # time trouble is not lumped into the same bin as a classical game's.
+    # config.TIME_PRESSURE_BINS can override them per speed or per exact
+    # time control as returned by utils.calculate_time_control (e.g. "3+2").
+    SPEED_BINS = {
+        "bullet": [0, 5, 10, 20, 40, float('inf')],
+        "blitz": [0, 10, 30, 60, 120, float('inf')],
+        "rapid": TIME_BINS,
+        "classical": [0, 60, 300, 600, 1200, float('inf')]
+    }
+    
     @staticmethod
     def analyze_time_mistakes(mistakes: List[Dict]) -> Dict:
-        """Analyze mistakes correlation with remaining time"""
+        """Mistake counts by remaining clock time, from mistake dicts with a
+        ``clock_time``. Per-game aggregates use bin_counts directly."""
         if not mistakes:
             return {}
-            
-        time_bins = [0, 30, 60, 120, 300, float('inf')]
-        bin_labels = ["<30s", "30-60s", "1-2m", "2-5m", "5m+"]
-        mistake_counts = [0] * (len(time_bins) - 1)
-        total_moves = [0] * (len(time_bins) - 1)
         
-        for mistake in mistakes:
-            if mistake['clock_time'] is None:
-                continue
-                
-            for i in range(len(time_bins) - 1):
-                if time_bins[i] <= mistake['clock_time'] < time_bins[i + 1]:
-                    mistake_counts[i] += 1
-                    break
+        clock_times = [
+            np.nan if mistake['clock_time'] is None else mistake['clock_time']
+            for mistake in mistakes
+        ]
+        mistake_counts, _ = TimePressureAnalyzer.bin_counts(
+            clock_times, np.ones(len(clock_times), dtype=bool), TimePressureAnalyzer.TIME_BINS
+        )
+        return {
+            "time_bins": TimePressureAnalyzer.BIN_LABELS,
+            "mistake_counts": mistake_counts.tolist(),
+            # Mistakes alone don't give the moves played per bin
+            "mistake_rates": [0] * len(mistake_counts)
+        }
+    
+    @staticmethod
+    def speed(time_control: Optional[str]) -> Optional[str]:
+        """Game speed of a calculate_time_control string, estimated like lichess
+        does from the initial time plus 40 increments"""
+        if not time_control or time_control == "Correspondence":
+            return "classical" if time_control else None
+        initial, _, increment = time_control.replace(" min", "").partition("+")
+        try:
+            seconds = int(initial) * 60 + 40 * int(increment or 0)
+        except ValueError:
+            return None
+        if seconds < 180:
+            return "bullet"
+        if seconds < 480:
+            return "blitz"
+        if seconds < 1500:
+            return "rapid"
+        return "classical"
+    
+    @staticmethod
+    def bins_for(time_control: Optional[str]) -> List[float]:
+        """Bin edges for a time control, falling back to TIME_BINS"""
+        overrides = config.TIME_PRESSURE_BINS
+        if time_control in overrides:
+            return overrides[time_control] + [float('inf')]
+        speed = TimePressureAnalyzer.speed(time_control)
+        if speed in overrides:
+            return overrides[speed] + [float('inf')]
+        return TimePressureAnalyzer.SPEED_BINS.get(speed, TimePressureAnalyzer.TIME_BINS)
+    
+    @staticmethod
+    def bin_labels(edges: List[float]) -> List[str]:
+        """Readable labels like BIN_LABELS for arbitrary bin edges"""
+        def fmt(value: float, minutes: bool) -> str:
+            return f"{value / 60:g}" if minutes else f"{value:g}"
         
-        # Calculate mistake rates per time bin
-        mistake_rates = []
-        for i in range(len(mistake_counts)):
-            if total_moves[i] > 0:
-                rate = (mistake_counts[i] / total_moves[i]) * 100
+        labels = []
+        for low, high in zip(edges[:-1], edges[1:]):
+            if high == float('inf'):
+                minutes = low >= 60 and low % 60 == 0
+                labels.append(f"{fmt(low, minutes)}{'m' if minutes else 's'}+")
+            elif low == 0:
+                minutes = high > 60 and high % 60 == 0
+                labels.append(f"<{fmt(high, minutes)}{'m' if minutes else 's'}")
             else:
-                rate = 0
-            mistake_rates.append(rate)
+                minutes = high > 60 and low % 60 == 0 and high % 60 == 0
+                labels.append(f"{fmt(low, minutes)}-{fmt(high, minutes)}{'m' if minutes else 's'}")
+        return labels
+    
+    @staticmethod
+    def bin_counts(clock_times: np.ndarray, mistake_flags: np.ndarray,
+                   edges: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-bin (mistake counts, move totals) for aligned per-ply arrays.
         
-        return {
-            "time_bins": bin_labels,
-            "mistake_counts": mistake_counts,
-            "mistake_rates": mistake_rates
-        }
+        ``clock_times`` holds the mover's remaining time after each ply (NaN
+        when unknown) and ``mistake_flags`` whether that ply was a mistake.
+        """
+        clock_times = np.asarray(clock_times, dtype=np.float64)
+        mistake_flags = np.asarray(mistake_flags, dtype=bool)
+        known = ~np.isnan(clock_times)
+        n_bins = len(edges) - 1
+        
+        # Against the inner edges digitize gives 0-based bin indices, 0..n_bins-1
+        bins = np.digitize(clock_times[known], edges[1:-1])
+        move_totals = np.bincount(bins, minlength=n_bins)
+        mistake_counts = np.bincount(bins[mistake_flags[known]], minlength=n_bins)
+        return mistake_counts, move_totals
+    
+    @staticmethod
+    def player_plies(clocks: List[Optional[float]], mistake_plies: List[int],
+                     first_ply: int) -> Tuple[np.ndarray, np.ndarray]:
+        """One player's clock times and mistake flags from a game's per-ply lists.
+        
+        ``first_ply`` is the index of the player's first move (0 or 1) and
+        ``mistake_plies`` the indices of their mistakes in the whole game.
+        """
+        own_clocks = np.array(clocks[first_ply::2], dtype=np.float64)
+        flags = np.zeros(len(own_clocks), dtype=bool)
+        if mistake_plies:
+            flags[(np.asarray(mistake_plies) - first_ply) // 2] = True
+        return own_clocks, flags
 
 class OpeningAnalyzer:
     def __init__(self):
-        self.opening_db = {
-            "Sicilian Defense": ["e4 c5"],
-            "Ruy Lopez": ["e4 e5 Nf3 Nc6 Bb5"],
-            "Queen's Gambit": ["d4 d5 c4"],
-            # Add more openings as needed
-        }
+        self.book = get_opening_book()
     
-    def classify_opening(self, moves: List[str]) -> str:
-        """Classify the opening based on move sequence"""
-        move_str = " ".join(moves)
-        for opening, patterns in self.opening_db.items():
-            for pattern in patterns:
-                if move_str.startswith(pattern):
-                    return opening
-        return "Unknown Opening"
+    def classify_moves(self, board: chess.Board, moves: List[chess.Move]) -> str:
+        """Name of the deepest ECO line reached by playing ``moves`` from ``board``"""
+        opening = self.book.classify(board, moves)
+        return opening.name if opening else "Unknown Opening"
     
-    def analyze_opening_mistakes(self, games: List[Dict]) -> Dict:
-        """Analyze mistakes by opening"""
-        opening_stats = defaultdict(lambda: {
-            "count": 0,
-            "mistakes": 0,
-            "avg_rating_diff": 0
-        })
-        
-        for game in games:
-            pgn = game['pgn']
-            game_obj = chess.pgn.read_game(pgn)
-            
-            # Get first 10 moves
-            moves = []
-            board = game_obj.board()
-            for node in game_obj.mainline():
-                moves.append(board.san(node.move))
-                board.push(node.move)
-                if len(moves) >= 10:
-                    break
-            
-            opening = self.classify_opening(moves)
-            stats = opening_stats[opening]
-            stats["count"] += 1
-            
-            if game['analysis']:
-                stats["mistakes"] += len(game['analysis']['mistakes'])
-        
-        # Calculate averages
-        for opening, data in opening_stats.items():
-            if data["count"] > 0:
-                data["avg_mistakes"] = data["mistakes"] / data["count"]
-        
-        return dict(opening_stats)
+    def classify_opening(self, moves: List[str]) -> str:
+        """Classify the opening based on a SAN move sequence"""
+        board = chess.Board()
+        parsed = []
+        for san in moves:
+            try:
+                move = board.push_san(san)
+            except ValueError:
+                break
+            parsed.append(move)
+        return self.classify_moves(chess.Board(), parsed)
 
 class RatingTrendAnalyzer:
     @staticmethod
@@ -130,75 +183,40 @@ class RatingTrendAnalyzer:
             "trend_strength": abs(slope),
             "r_squared": r_value**2
         }
-
-class EndgameAnalyzer:
-    @staticmethod
-    def analyze_endgame_performance(games: List[Dict]) -> Dict:
-        """Analyze performance in endgames"""
-        endgame_stats = {
-            "won": 0,
-            "lost": 0,
-            "drawn": 0,
-            "mistakes": 0,
-            "total": 0
-        }
-        
-        for game in games:
-            if not game['analysis']:
-                continue
-                
-            pgn = game['pgn']
-            game_obj = chess.pgn.read_game(pgn)
-            board = game_obj.board()
-            
-            # Find when endgame started (arbitrarily defined as when both sides have <= 10 points)
-            endgame_start = None
-            for node in game_obj.mainline():
-                board.push(node.move)
-                material = EndgameAnalyzer._calculate_material(board)
-                if material['white'] <= 10 and material['black'] <= 10:
-                    endgame_start = board.fullmove_number
-                    break
-            
-            if endgame_start:
-                endgame_stats["total"] += 1
-                result = game['headers']['Result']
-                
-                if result == '1-0' and game['headers']['White'] == username:
-                    endgame_stats["won"] += 1
-                elif result == '0-1' and game['headers']['Black'] == username:
-                    endgame_stats["won"] += 1
-                elif result == '1/2-1/2':
-                    endgame_stats["drawn"] += 1
-                else:
-                    endgame_stats["lost"] += 1
-                
-                # Count endgame mistakes
-                for mistake in game['analysis']['mistakes']:
-                    if mistake['move_number'] >= endgame_start:
-                        endgame_stats["mistakes"] += 1
-        
-        return endgame_stats
     
     @staticmethod
-    def _calculate_material(board: chess.Board) -> Dict[str, int]:
-        """Calculate material count for both sides"""
-        material = {'white': 0, 'black': 0}
-        piece_values = {
-            chess.PAWN: 1,
-            chess.KNIGHT: 3,
-            chess.BISHOP: 3,
-            chess.ROOK: 5,
-            chess.QUEEN: 9
-        }
+    def trend_from_sums(sums: Dict) -> Dict:
+        """Same linear regression as calculate_rating_trend, computed from
+        running sums (n, sx, sy, sxx, sxy, syy) so it can be kept up to date
+        one game at a time"""
+        n = sums.get("n", 0)
+        if n < 2:
+            return {}
         
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if piece:
-                value = piece_values.get(piece.piece_type, 0)
-                if piece.color == chess.WHITE:
-                    material['white'] += value
-                else:
-                    material['black'] += value
+        sxx = n * sums["sxx"] - sums["sx"] ** 2
+        sxy = n * sums["sxy"] - sums["sx"] * sums["sy"]
+        syy = n * sums["syy"] - sums["sy"] ** 2
+        if sxx <= 0:
+            return {}
         
-        return material
\ No newline at end of file
+        slope = sxy / sxx
+        r_squared = sxy ** 2 / (sxx * syy) if syy > 0 else 0.0
+        return {
+            "current_rating": sums["last_rating"],
+            "trend": "up" if slope > 0 else "down",
+            "trend_strength": abs(slope),
+            "r_squared": r_squared
+        }
+
+class EndgameAnalyzer:
+    @staticmethod
+    def find_endgame_start(board: chess.Board, moves: List[chess.Move]) -> Optional[int]:
+        """Move number at which the endgame started, or None if it never did"""
+        board = board.copy(stack=False)
+        # Find when endgame started (when both sides have <= ENDGAME_MATERIAL points)
+        for move in moves:
+            board.push(move)
+            white, black = material(board)
+            if white <= ENDGAME_MATERIAL and black <= ENDGAME_MATERIAL:
+                return board.fullmove_number
+        return None
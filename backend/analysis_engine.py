@@ -1,18 +1,44 @@
 # analysis_engine.py
+import asyncio
+import functools
 import chess
 import chess.engine
 import chess.pgn
-from typing import List, Dict, Any, Tuple
+import io
+from typing import (
+    List, Dict, Any, Tuple, Optional, Iterator, Iterable, AsyncIterator, Awaitable, Callable,
+    TypeVar, Union
+)
 import statistics
 from dataclasses import dataclass
 from enum import Enum
 import time
 
+from engine_pool import get_engine_pool
+from config import config
+from eval_cache import EvalCache, GameEvals, mainline_keys
+
+T = TypeVar("T")
+
+# Centipawn swings above which a move is classified
+BLUNDER_THRESHOLD = 200
+MISTAKE_THRESHOLD = 100
+INACCURACY_THRESHOLD = 50
+
 class MistakeType(Enum):
     BLUNDER = "blunder"
     MISTAKE = "mistake"
     INACCURACY = "inaccuracy"
 
+def classify_eval_diff(eval_diff: float) -> Optional[MistakeType]:
+    if eval_diff > BLUNDER_THRESHOLD:
+        return MistakeType.BLUNDER
+    if eval_diff > MISTAKE_THRESHOLD:
+        return MistakeType.MISTAKE
+    if eval_diff > INACCURACY_THRESHOLD:
+        return MistakeType.INACCURACY
+    return None
+
 @dataclass
 class Mistake:
     move_number: int
@@ -31,46 +57,458 @@ class GamePhase(Enum):
     MIDDLEGAME = "middlegame"
     ENDGAME = "endgame"
 
+# Material (pawn = 1) at or below which a side counts as being in the endgame
+PIECE_VALUES = {
+    chess.PAWN: 1,
+    chess.KNIGHT: 3,
+    chess.BISHOP: 3,
+    chess.ROOK: 5,
+    chess.QUEEN: 9
+}
+ENDGAME_MATERIAL = 10
+# Full moves treated as the opening unless the endgame is reached first
+OPENING_MOVES = 10
+
+_PHASE_ORDER = [GamePhase.OPENING, GamePhase.MIDDLEGAME, GamePhase.ENDGAME]
+
+def material(board: chess.Board) -> Tuple[int, int]:
+    """(white, black) material from piece bitboard popcounts"""
+    white = black = 0
+    for piece_type, value in PIECE_VALUES.items():
+        pieces = board.pieces_mask(piece_type, chess.WHITE)
+        white += value * chess.popcount(pieces)
+        pieces = board.pieces_mask(piece_type, chess.BLACK)
+        black += value * chess.popcount(pieces)
+    return white, black
+
+def game_phase(board: chess.Board) -> GamePhase:
+    white, black = material(board)
+    if white <= ENDGAME_MATERIAL and black <= ENDGAME_MATERIAL:
+        return GamePhase.ENDGAME
+    if board.fullmove_number <= OPENING_MOVES:
+        return GamePhase.OPENING
+    return GamePhase.MIDDLEGAME
+
+def phase_timeline(board: chess.Board, moves: List[chess.Move]) -> Dict[str, Any]:
+    """Material and phase of every position along a mainline.
+
+    Like the eval timeline, entry i is the position before ply i. Phases never
+    go backwards, so a game that trades into an endgame and promotes stays in
+    the endgame. ``endgame_start`` is the move number the endgame began at.
+    """
+    board = board.copy(stack=False)
+    timeline = {"material": [], "phases": [], "endgame_start": None}
+    phase_index = 0
+    for ply in range(len(moves) + 1):
+        if ply:
+            board.push(moves[ply - 1])
+        phase_index = max(phase_index, _PHASE_ORDER.index(game_phase(board)))
+        phase = _PHASE_ORDER[phase_index]
+        if (ply and phase is GamePhase.ENDGAME
+                and timeline["endgame_start"] is None):
+            timeline["endgame_start"] = board.fullmove_number
+        timeline["material"].append(list(material(board)))
+        timeline["phases"].append(phase.value)
+    return timeline
+
 class CriticalityAnalyzer:
+    # Plies per sliding window, and what makes a window critical: the share of
+    # its plies whose swing classify_eval_diff counts as a mistake of any kind
+    # (at least MIN_DENSITY), and the mean swing
+    WINDOW_PLIES = 10
+    MIN_DENSITY = 0.6
+    MIN_AVG_SWING = 100
+    # Mate scores are +-10000; cap swings so one mate flip cannot make a
+    # whole window look critical on its own
+    SWING_CAP = 1000
+
     @staticmethod
-    def calculate_criticality(mistakes: List[Mistake]) -> List[Dict]:
-        """Identify critical phases of the game"""
-        if not mistakes:
+    def calculate_criticality(evals: List[float], start_fullmove: int = 1,
+                              black_first: bool = False) -> List[Dict]:
+        """Identify critical phases of the game from its eval timeline.
+
+        Slides one window over the per-ply eval swings keeping running sums,
+        so a game costs O(plies). Overlapping or touching critical windows are
+        merged into a single phase.
+        """
+        window = CriticalityAnalyzer.WINDOW_PLIES
+        cap = CriticalityAnalyzer.SWING_CAP
+        swings = [min(abs(after - before), cap) for before, after in zip(evals, evals[1:])]
+        if len(swings) < window:
             return []
-            
-        move_numbers = [m.move_number for m in mistakes]
-        avg = statistics.mean(move_numbers)
-        stdev = statistics.stdev(move_numbers) if len(move_numbers) > 1 else 0
+
+        significant = [classify_eval_diff(swing) is not None for swing in swings]
+        min_count = CriticalityAnalyzer.MIN_DENSITY * window
+        min_total = CriticalityAnalyzer.MIN_AVG_SWING * window
+
+        # Critical windows as [start, end) ply ranges, merged as they are found
+        spans: List[List[int]] = []
+        total = sum(swings[:window])
+        count = sum(significant[:window])
+        for start in range(len(swings) - window + 1):
+            if start:
+                total += swings[start + window - 1] - swings[start - 1]
+                count += significant[start + window - 1] - significant[start - 1]
+            if count >= min_count and total > min_total:
+                if spans and start <= spans[-1][1]:
+                    spans[-1][1] = start + window
+                else:
+                    spans.append([start, start + window])
+
+        def move_number(ply: int) -> int:
+            return start_fullmove + (ply + black_first) // 2
+
+        critical_phases = []
+        for start, end in spans:
+            # Trim quiet plies the window dragged in at either edge
+            while not significant[start]:
+                start += 1
+            while not significant[end - 1]:
+                end -= 1
+            phase_swings = swings[start:end]
+            critical_phases.append({
+                "start_move": move_number(start),
+                "end_move": move_number(end - 1),
+                "start_ply": start,
+                "end_ply": end - 1,
+                "avg_eval_diff": sum(phase_swings) / len(phase_swings),
+                "mistake_count": sum(significant[start:end])
+            })
+        return critical_phases
+
+class BlockingEngine:
+    """A blocking engine (``SimpleEngine``, ``EngineLease``) behind the
+    coroutine interface of the async analysis functions.
+    
+    Its ``analyse`` coroutine finishes without ever suspending, so the async
+    functions over it can be driven to completion on the calling thread by
+    ``run_sync``. That is how the blocking entry points below share one
+    implementation with the asyncio backend.
+    """
+    
+    def __init__(self, engine):
+        self.engine = engine
+    
+    async def analyse(self, board: chess.Board, limit: chess.engine.Limit, **kwargs):
+        return self.engine.analyse(board, limit, **kwargs)
+
+class BlockingEvalCache:
+    """An EvalCache or GameEvals behind the coroutine ``lookup``/``store``
+    interface the async analysis functions use.
+    
+    Like BlockingEngine, its coroutines finish without suspending, so the
+    blocking entry points can pass it in place of the cache.
+    """
+    
+    def __init__(self, cache: Union[EvalCache, GameEvals]):
+        self.cache = cache
+    
+    async def lookup(self, keys: Iterable[int], depth: int) -> Dict[int, float]:
+        return self.cache.lookup(keys, depth)
+    
+    async def store(self, entries: List[Tuple[int, int, float]]):
+        self.cache.store(entries)
+
+class ThreadedEvalCache(BlockingEvalCache):
+    """BlockingEvalCache for the event loop: lookups and stores run on a
+    worker thread, since waiting on the SQLite write lock there would stall
+    every other job and stream on the loop"""
+    
+    async def lookup(self, keys: Iterable[int], depth: int) -> Dict[int, float]:
+        return await run_in_thread(self.cache.lookup, list(keys), depth)
+    
+    async def store(self, entries: List[Tuple[int, int, float]]):
+        await run_in_thread(self.cache.store, entries)
+
+def blocking_cache(cache: Optional[Union[EvalCache, GameEvals]]) -> Optional[BlockingEvalCache]:
+    return BlockingEvalCache(cache) if cache is not None else None
+
+async def run_in_thread(func: Callable[..., T], *args) -> T:
+    """Run a blocking call on the loop's default executor (asyncio.to_thread
+    needs Python 3.9)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+def run_sync(awaitable: Awaitable[T]) -> T:
+    """Result of an awaitable that never suspends, e.g. one over a BlockingEngine"""
+    steps = awaitable.__await__()
+    try:
+        steps.send(None)
+    except StopIteration as done:
+        return done.value
+    steps.close()
+    raise RuntimeError("Awaited a non-blocking engine outside an event loop")
+
+def iter_sync(items: AsyncIterator[T]) -> Iterator[T]:
+    """Blocking iterator over an async iterator that never suspends"""
+    try:
+        while True:
+            try:
+                item = run_sync(items.__anext__())
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        run_sync(items.aclose())
+
+async def iter_async(items: Iterable[T]) -> AsyncIterator[T]:
+    for item in items:
+        yield item
+
+async def iter_mainline_evals_async(engine, board: chess.Board, moves: List[chess.Move],
+                                    depth: int,
+                                    cache: Optional[BlockingEvalCache] = None) -> AsyncIterator[float]:
+    """Evaluate every position along a mainline exactly once.
+
+    Yields len(moves) + 1 centipawn scores from white's perspective, where
+    entry i is the position before ply i (and after ply i - 1), as soon as
+    each one is known. Positions found in ``cache`` at >= ``depth`` are not
+    searched again; new results are written back once the line is exhausted.
+    """
+    board = board.copy(stack=False)
+    limit = chess.engine.Limit(depth=depth)
+    keys = mainline_keys(board, moves)
+    
+    cached = await cache.lookup(keys, depth) if cache else {}
+    searched = {}
+    for ply, key in enumerate(keys):
+        if ply:
+            board.push(moves[ply - 1])
+        if key in cached:
+            yield cached[key]
+        elif key in searched:
+            yield searched[key]
+        else:
+            info = await engine.analyse(board, limit)
+            score = info["score"].white().score(mate_score=10000)
+            searched[key] = score
+            yield score
+    
+    if cache:
+        await cache.store([(key, depth, score) for key, score in searched.items()])
+
+def iter_mainline_evals(engine, board: chess.Board, moves: List[chess.Move],
+                        depth: int, cache: Optional[EvalCache] = None) -> Iterator[float]:
+    """Blocking iter_mainline_evals_async"""
+    return iter_sync(iter_mainline_evals_async(
+        BlockingEngine(engine), board, moves, depth, blocking_cache(cache)
+    ))
+
+async def evaluate_mainline_async(engine, board: chess.Board, moves: List[chess.Move],
+                                  depth: int, cache: Optional[BlockingEvalCache] = None) -> List[float]:
+    """Eval timeline of a mainline as a list, see iter_mainline_evals_async"""
+    return [score async for score in iter_mainline_evals_async(engine, board, moves, depth, cache)]
+
+def evaluate_mainline(engine, board: chess.Board, moves: List[chess.Move],
+                      depth: int, cache: Optional[EvalCache] = None) -> List[float]:
+    """Eval timeline of a mainline as a list, see iter_mainline_evals_async"""
+    return run_sync(evaluate_mainline_async(
+        BlockingEngine(engine), board, moves, depth, blocking_cache(cache)
+    ))
+
+async def evaluate_positions_async(engine, board: chess.Board, moves: List[chess.Move],
+                                   indices: Iterable[int], depth: int,
+                                   cache: Optional[BlockingEvalCache] = None) -> Dict[int, float]:
+    """Evaluate a subset of the positions along a mainline, by timeline index"""
+    wanted = set(indices)
+    if not wanted:
+        return {}
+    
+    board = board.copy(stack=False)
+    limit = chess.engine.Limit(depth=depth)
+    keys = mainline_keys(board, moves)
+    
+    cached = await cache.lookup([keys[i] for i in wanted], depth) if cache else {}
+    searched = {}
+    scores = {}
+    for index in range(max(wanted) + 1):
+        if index:
+            board.push(moves[index - 1])
+        if index not in wanted:
+            continue
+        key = keys[index]
+        if key in cached:
+            scores[index] = cached[key]
+        elif key in searched:
+            scores[index] = searched[key]
+        else:
+            info = await engine.analyse(board, limit)
+            score = info["score"].white().score(mate_score=10000)
+            searched[key] = scores[index] = score
+    
+    if cache:
+        await cache.store([(key, depth, score) for key, score in searched.items()])
+    
+    return scores
+
+def evaluate_positions(engine, board: chess.Board, moves: List[chess.Move],
+                       indices: Iterable[int], depth: int,
+                       cache: Optional[EvalCache] = None) -> Dict[int, float]:
+    """Blocking evaluate_positions_async"""
+    return run_sync(evaluate_positions_async(
+        BlockingEngine(engine), board, moves, indices, depth, blocking_cache(cache)
+    ))
+
+async def adaptive_mainline_evals_async(engine, board: chess.Board, moves: List[chess.Move],
+                                        depth: int, shallow_depth: Optional[int] = None,
+                                        margin: Optional[float] = None,
+                                        cache: Optional[BlockingEvalCache] = None
+                                        ) -> Tuple[List[float], int]:
+    """Two-pass eval timeline: a shallow sweep, then full depth where it matters.
+    
+    Every position is first searched at ``shallow_depth``. Plies whose shallow
+    swing reaches ``margin`` times the inaccuracy threshold get both of their
+    positions re-searched at ``depth``. Deepening a position changes the swing
+    of the neighbouring ply too, so this repeats until no new ply qualifies.
+    Returns the timeline and the number of plies that were deepened.
+    """
+    shallow_depth = shallow_depth or config.ADAPTIVE_SHALLOW_DEPTH
+    margin = config.ADAPTIVE_MARGIN if margin is None else margin
+    threshold = INACCURACY_THRESHOLD * margin
+    
+    if shallow_depth >= depth:
+        # Nothing to gain from a second pass
+        return await evaluate_mainline_async(engine, board, moves, depth, cache), 0
+    
+    evals = await evaluate_mainline_async(engine, board, moves, shallow_depth, cache)
+    deep = set()
+    deepened_plies = set()
+    candidates = range(len(moves))
+    while True:
+        suspicious = [
+            ply for ply in candidates
+            if ply not in deepened_plies and abs(evals[ply + 1] - evals[ply]) >= threshold
+        ]
+        if not suspicious:
+            break
         
-        critical_moments = []
-        window_size = 5
+        deepened_plies.update(suspicious)
+        positions = {i for ply in suspicious for i in (ply, ply + 1)} - deep
+        deepened = await evaluate_positions_async(engine, board, moves, positions, depth, cache)
+        for index, score in deepened.items():
+            evals[index] = score
+        deep |= positions
         
-        for i in range(len(mistakes) - window_size + 1):
-            window = mistakes[i:i+window_size]
-            density = len(window) / window_size
-            avg_eval_diff = statistics.mean(m.eval_diff for m in window)
-            
-            if density > 0.6 and avg_eval_diff > 100:
-                critical_moments.append({
-                    "start_move": window[0].move_number,
-                    "end_move": window[-1].move_number,
-                    "avg_eval_diff": avg_eval_diff,
-                    "mistake_count": len(window)
-                })
+        # Only plies touching a freshly deepened position can have changed
+        candidates = sorted({
+            ply for i in positions for ply in (i - 1, i) if 0 <= ply < len(moves)
+        })
+    
+    return evals, len(deepened_plies)
+
+def adaptive_mainline_evals(engine, board: chess.Board, moves: List[chess.Move],
+                            depth: int, shallow_depth: Optional[int] = None,
+                            margin: Optional[float] = None,
+                            cache: Optional[EvalCache] = None) -> Tuple[List[float], int]:
+    """Blocking adaptive_mainline_evals_async"""
+    return run_sync(adaptive_mainline_evals_async(
+        BlockingEngine(engine), board, moves, depth, shallow_depth, margin, blocking_cache(cache)
+    ))
+
+async def timeline_plies_async(timeline: AsyncIterator[float], evals: List[float]
+                               ) -> AsyncIterator[Tuple[float, float, Optional[chess.Move]]]:
+    """Per-ply ``(eval_before, eval_after, best_move)`` from an eval timeline.
+    
+    A timeline knows no best moves, so that is always None. Timeline entries
+    are appended to ``evals`` as they are consumed.
+    """
+    evals.append(await timeline.__anext__())
+    async for score in timeline:
+        yield evals[-1], score, None
+        evals.append(score)
+
+def timeline_plies(timeline: Iterator[float],
+                   evals: List[float]) -> Iterator[Tuple[float, float, Optional[chess.Move]]]:
+    """Blocking timeline_plies_async"""
+    evals.append(next(timeline))
+    for score in timeline:
+        yield evals[-1], score, None
+        evals.append(score)
+
+async def iter_multipv_plies_async(engine, board: chess.Board, moves: List[chess.Move],
+                                   depth: int, lines: int, evals: List[float],
+                                   cache: Optional[BlockingEvalCache] = None
+                                   ) -> AsyncIterator[Tuple[float, float, chess.Move]]:
+    """Judge every ply from one MultiPV search of the position before it.
+    
+    Yields ``(eval_before, eval_after, best_move)`` per ply, in centipawns
+    from white's perspective: the best line's score, the played move's line
+    score and the best line's first move. When the played move is outside the
+    top ``lines``, its score is the best score of the next position, whose
+    search is needed anyway; only a last move outside them costs an extra
+    search. The timeline of best scores (and the final position's score) is
+    appended to ``evals``. Those positions are written to ``cache``, but not
+    read from it, since a cached score has no lines.
+    """
+    board = board.copy(stack=False)
+    limit = chess.engine.Limit(depth=depth)
+    keys = mainline_keys(board, moves)
+    
+    searched = {}
+    # (eval_before, best_move) of a ply waiting for the next position's score
+    pending = None
+    for ply, move in enumerate(moves):
+        infos = await engine.analyse(board, limit, multipv=lines)
+        scores = {
+            info["pv"][0]: info["score"].white().score(mate_score=10000)
+            for info in infos if info.get("pv")
+        }
+        best_move = infos[0]["pv"][0]
+        eval_before = searched[keys[ply]] = scores[best_move]
+        evals.append(eval_before)
+        if pending:
+            yield pending[0], eval_before, pending[1]
         
-        return critical_moments
+        board.push(move)
+        if move in scores:
+            pending = None
+            yield eval_before, scores[move], best_move
+        else:
+            pending = (eval_before, best_move)
+    
+    if pending:
+        key = keys[-1]
+        cached = await cache.lookup([key], depth) if cache and key not in searched else {}
+        if key in searched:
+            score = searched[key]
+        elif key in cached:
+            score = cached[key]
+        else:
+            info = await engine.analyse(board, limit)
+            score = searched[key] = info["score"].white().score(mate_score=10000)
+        evals.append(score)
+        yield pending[0], score, pending[1]
+    elif moves:
+        # Scored one ply shallower, as part of the last search
+        evals.append(scores[moves[-1]])
+    
+    if cache:
+        await cache.store([(key, depth, score) for key, score in searched.items()])
+
+def iter_multipv_plies(engine, board: chess.Board, moves: List[chess.Move], depth: int,
+                       lines: int, evals: List[float],
+                       cache: Optional[EvalCache] = None
+                       ) -> Iterator[Tuple[float, float, chess.Move]]:
+    """Blocking iter_multipv_plies_async"""
+    return iter_sync(iter_multipv_plies_async(
+        BlockingEngine(engine), board, moves, depth, lines, evals, blocking_cache(cache)
+    ))
 
 class GameAnalyzer:
-    def __init__(self, engine_path: str):
+    def __init__(self, engine_path: str, eval_cache: Optional[EvalCache] = None):
         self.engine_path = engine_path
+        self.engine_pool = get_engine_pool(engine_path)
+        self.eval_cache = eval_cache
     
-    def analyze_game(self, pgn_text: str, depth: int = 18) -> Dict[str, Any]:
-        game = chess.pgn.read_game(pgn_text)
+    def analyze_game(self, pgn_text: str, depth: int = 18,
+                     adaptive: bool = False) -> Dict[str, Any]:
+        game = chess.pgn.read_game(io.StringIO(pgn_text))
         board = game.board()
+        nodes = list(game.mainline())
         
-        engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
         analysis = {
             "mistakes": [],
+            "evals": [],
             "summary": {
                 "white_mistakes": 0,
                 "black_mistakes": 0,
@@ -79,32 +517,41 @@ class GameAnalyzer:
             }
         }
         
-        for node in game.mainline():
+        # One search per position; ply i is judged on evals[i] -> evals[i + 1]
+        moves = [n.move for n in nodes]
+        with self.engine_pool.engine() as engine:
+            if adaptive:
+                evals, deepened = adaptive_mainline_evals(
+                    engine, board, moves, depth, cache=self.eval_cache
+                )
+                analysis["summary"]["deepened_plies"] = deepened
+            else:
+                evals = evaluate_mainline(engine, board, moves, depth, self.eval_cache)
+        analysis["evals"] = evals
+        
+        for ply, node in enumerate(nodes):
             move = node.move
             player = "white" if board.turn == chess.WHITE else "black"
             clock_time = node.clock() if hasattr(node, "clock") else None
             
-            # Evaluate position before move
-            info_before = engine.analyse(board, chess.engine.Limit(depth=depth))
-            eval_before = self._normalize_eval(info_before["score"])
-            
+            move_number = board.fullmove_number
+            fen_before = board.fen()
+            move_san = board.san(move)
             board.push(move)
             
-            # Evaluate position after move
-            info_after = engine.analyse(board, chess.engine.Limit(depth=depth))
-            eval_after = self._normalize_eval(info_after["score"])
-            
+            eval_before = evals[ply]
+            eval_after = evals[ply + 1]
             eval_diff = abs(eval_after - eval_before)
             mistake = self._classify_mistake(
-                move_number=board.fullmove_number,
+                move_number=move_number,
                 player=player,
-                fen_before=board.fen(),
+                fen_before=fen_before,
                 fen_after=board.fen(),
                 eval_before=eval_before,
                 eval_after=eval_after,
                 eval_diff=eval_diff,
                 clock_time=clock_time,
-                move_san=board.san(move)
+                move_san=move_san
             )
             
             if mistake:
@@ -115,15 +562,15 @@ class GameAnalyzer:
                 else:
                     analysis["summary"]["black_mistakes"] += 1
         
-        engine.quit()
-        
         if analysis["mistakes"]:
             analysis["summary"]["worst_mistake"] = max(
                 analysis["mistakes"], key=lambda m: m.eval_diff
             )
-            analysis["summary"]["critical_moments"] = (
-                CriticalityAnalyzer.calculate_criticality(analysis["mistakes"])
-            )
+        
+        start = game.board()
+        analysis["summary"]["critical_moments"] = CriticalityAnalyzer.calculate_criticality(
+            evals, start.fullmove_number, start.turn == chess.BLACK
+        )
         
         return analysis
     
@@ -132,15 +579,9 @@ class GameAnalyzer:
         return score.white().score(mate_score=10000)
     
     def _classify_mistake(self, **kwargs) -> Optional[Mistake]:
-        eval_diff = kwargs["eval_diff"]
-        
-        if eval_diff > 200:
-            kwargs["type"] = MistakeType.BLUNDER
-        elif eval_diff > 100:
-            kwargs["type"] = MistakeType.MISTAKE
-        elif eval_diff > 50:
-            kwargs["type"] = MistakeType.INACCURACY
-        else:
+        mistake_type = classify_eval_diff(kwargs["eval_diff"])
+        if mistake_type is None:
             return None
         
+        kwargs["type"] = mistake_type
         return Mistake(**kwargs)
\ No newline at end of file
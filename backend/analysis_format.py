@@ -0,0 +1,258 @@
+# analysis_format.py
+"""Compact binary storage for analysis results.
+
+An encoded analysis is a small header, a table of sections and the sections
+themselves, each zlib-compressed on its own::
+
+    magic (3s) | version (B) | section count (B)
+    per section: name (8s) | encoding (B) | compressed length (I)
+    section payloads, in table order
+
+The per-ply timelines (evals and their search depths, material, phases) and
+the mistakes are packed as fixed-width arrays; everything else (summary,
+engine, future keys) goes in a JSON ``meta`` section. Any section whose values do not fit the packed layout is
+stored as JSON instead, so unusual analyses still round-trip exactly.
+
+``StoredAnalysis`` only decompresses a section when it is first read, so a
+review that needs the summary and mistakes never touches the eval timeline.
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from analysis_engine import GamePhase, MistakeType
+
+# 2: mistakes carry best_move as a fourth string
+FORMAT_VERSION = 2
+_READABLE_VERSIONS = (1, 2)
+
+# The leading NUL keeps blobs from ever being mistaken for JSON text
+_MAGIC = b"\x00CA"
+_HEADER = struct.Struct("<3sBB")
+# Section names are the analysis keys, at most 8 bytes
+_ENTRY = struct.Struct("<8sBI")
+
+_JSON = 0
+_PACKED = 1
+
+_ZLIB_LEVEL = 6
+_SWAP = sys.byteorder != "little"
+
+_PHASES = [phase.value for phase in GamePhase]
+_MISTAKE_TYPES = [kind.value for kind in MistakeType]
+_PLAYERS = ["white", "black"]
+
+# move_number, player, eval_before, eval_after, eval_diff, type, clock, phase;
+# NaN clock means none was recorded
+_MISTAKE_ROW = struct.Struct("<HBiiiBdB")
+_MISTAKE_FIELDS = frozenset((
+    "move_number", "player", "fen_before", "fen_after", "eval_before", "eval_after",
+    "eval_diff", "mistake_type", "clock_time", "move_san", "best_move", "phase"
+))
+# Strings per mistake after the rows: fen_before, fen_after, move_san and,
+# from version 2, best_move ("" for none)
+_MISTAKE_TEXT = 4
+
+
+def _to_bytes(values: array) -> bytes:
+    if _SWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if _SWAP:
+        values.byteswap()
+    return values
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _pack_evals(evals: List[int]) -> bytes:
+    if not all(_is_int(value) for value in evals):
+        raise ValueError("non-integer eval")
+    return _to_bytes(array("i", evals))
+
+
+def _unpack_evals(data: bytes) -> List[int]:
+    return _from_bytes("i", data).tolist()
+
+
+def _pack_material(material: List[List[int]]) -> bytes:
+    if not all(len(pair) == 2 for pair in material):
+        raise ValueError("material is not per-side pairs")
+    return bytes(value for pair in material for value in pair)
+
+
+def _unpack_material(data: bytes) -> List[List[int]]:
+    return [[data[i], data[i + 1]] for i in range(0, len(data), 2)]
+
+
+def _pack_phases(phases: List[str]) -> bytes:
+    return bytes(_PHASES.index(phase) for phase in phases)
+
+
+def _unpack_phases(data: bytes) -> List[str]:
+    return [_PHASES[index] for index in data]
+
+
+def _pack_mistakes(mistakes: List[Dict[str, Any]]) -> bytes:
+    rows = bytearray(_MISTAKE_ROW.size * len(mistakes))
+    text = []
+    for i, m in enumerate(mistakes):
+        if m.keys() != _MISTAKE_FIELDS:
+            raise ValueError("mistake fields differ from the packed layout")
+        if not all(_is_int(m[name]) for name in ("eval_before", "eval_after", "eval_diff")):
+            raise ValueError("non-integer eval")
+        clock = m["clock_time"]
+        _MISTAKE_ROW.pack_into(
+            rows, i * _MISTAKE_ROW.size, m["move_number"], _PLAYERS.index(m["player"]),
+            m["eval_before"], m["eval_after"], m["eval_diff"],
+            _MISTAKE_TYPES.index(m["mistake_type"]),
+            float("nan") if clock is None else clock, _PHASES.index(m["phase"])
+        )
+        text.extend((m["fen_before"], m["fen_after"], m["move_san"], m["best_move"] or ""))
+    if any("\n" in value for value in text):
+        raise ValueError("newline in mistake text")
+    return struct.pack("<I", len(mistakes)) + bytes(rows) + "\n".join(text).encode()
+
+
+def _unpack_mistakes(data: bytes, version: int = FORMAT_VERSION) -> List[Dict[str, Any]]:
+    count, = struct.unpack_from("<I", data)
+    text_start = 4 + count * _MISTAKE_ROW.size
+    text = bytes(data[text_start:]).decode().split("\n") if count else []
+    # Version 1 had no best moves
+    fields = 3 if version == 1 else _MISTAKE_TEXT
+    if len(text) != fields * count:
+        raise ValueError("Corrupt mistakes section")
+    mistakes = []
+    for i, row in enumerate(_MISTAKE_ROW.iter_unpack(data[4:text_start])):
+        move_number, player, eval_before, eval_after, eval_diff, kind, clock, phase = row
+        strings = text[fields * i:fields * (i + 1)]
+        mistakes.append({
+            "move_number": move_number,
+            "player": _PLAYERS[player],
+            "fen_before": strings[0],
+            "fen_after": strings[1],
+            "eval_before": eval_before,
+            "eval_after": eval_after,
+            "eval_diff": eval_diff,
+            "mistake_type": _MISTAKE_TYPES[kind],
+            # NaN is the only value not equal to itself
+            "clock_time": clock if clock == clock else None,
+            "move_san": strings[2],
+            "best_move": (strings[3] or None) if fields == _MISTAKE_TEXT else None,
+            "phase": _PHASES[phase]
+        })
+    return mistakes
+
+
+_PACKERS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    "evals": (_pack_evals, _unpack_evals),
+    "depths": (bytes, list),
+    "material": (_pack_material, _unpack_material),
+    "phases": (_pack_phases, _unpack_phases),
+    "mistakes": (_pack_mistakes, _unpack_mistakes),
+}
+
+
+def _encode_section(name: str, value: Any) -> Tuple[int, bytes]:
+    try:
+        encoding, payload = _PACKED, _PACKERS[name][0](value)
+    except (KeyError, ValueError, TypeError, AttributeError, struct.error, OverflowError):
+        encoding, payload = _JSON, json.dumps(value, separators=(",", ":")).encode()
+    return encoding, zlib.compress(payload, _ZLIB_LEVEL)
+
+
+def encode_analysis(analysis: Mapping[str, Any]) -> bytes:
+    """Pack an analysis dict into the current binary format"""
+    sections = [
+        (name, *_encode_section(name, analysis[name]))
+        for name in _PACKERS if name in analysis
+    ]
+    meta = {key: value for key, value in analysis.items() if key not in _PACKERS}
+    sections.append(("meta", *_encode_section("meta", meta)))
+
+    parts = [_HEADER.pack(_MAGIC, FORMAT_VERSION, len(sections))]
+    parts.extend(
+        _ENTRY.pack(name.encode(), encoding, len(payload))
+        for name, encoding, payload in sections
+    )
+    parts.extend(payload for _, _, payload in sections)
+    return b"".join(parts)
+
+
+class StoredAnalysis(Mapping[str, Any]):
+    """Read-only analysis backed by an encoded blob, decoding sections lazily"""
+
+    def __init__(self, blob: bytes):
+        view = memoryview(blob)
+        magic, version, count = _HEADER.unpack_from(view)
+        if magic != _MAGIC:
+            raise ValueError("Not an encoded analysis")
+        if version not in _READABLE_VERSIONS:
+            raise ValueError(f"Unsupported analysis format version {version}")
+        self._version = version
+
+        self._sections: Dict[str, Tuple[int, memoryview]] = {}
+        offset = _HEADER.size + count * _ENTRY.size
+        for i in range(count):
+            name, encoding, length = _ENTRY.unpack_from(view, _HEADER.size + i * _ENTRY.size)
+            self._sections[name.rstrip(b"\0").decode()] = (encoding, view[offset:offset + length])
+            offset += length
+        self._decoded: Dict[str, Any] = {}
+
+    def _section(self, name: str) -> Any:
+        if name not in self._decoded:
+            encoding, payload = self._sections[name]
+            data = zlib.decompress(payload)
+            if encoding == _JSON:
+                self._decoded[name] = json.loads(data)
+            elif name == "mistakes":
+                # The only section whose packed layout differs between versions
+                self._decoded[name] = _unpack_mistakes(data, self._version)
+            else:
+                self._decoded[name] = _PACKERS[name][1](data)
+        return self._decoded[name]
+
+    def _meta(self) -> Dict[str, Any]:
+        return self._section("meta") if "meta" in self._sections else {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _PACKERS and key in self._sections:
+            return self._section(key)
+        return self._meta()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from (name for name in self._sections if name in _PACKERS)
+        yield from self._meta()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Fully decoded plain dict, e.g. for JSON responses"""
+        return dict(self)
+
+
+def decode_analysis(blob: bytes) -> StoredAnalysis:
+    return StoredAnalysis(blob)
+
+
+def load_analysis(blob: Optional[bytes],
+                  legacy_json: Optional[str]) -> Optional[Mapping[str, Any]]:
+    """Analysis from a games row, accepting rows still holding JSON text
+    (see ``init_db.py --compress-analyses``)"""
+    if blob is not None:
+        return decode_analysis(blob)
+    if legacy_json:
+        return json.loads(legacy_json)
+    return None
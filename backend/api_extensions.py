@@ -1,103 +1,104 @@
 # api_extensions.py
 from flask import Blueprint, jsonify, request
 from typing import List, Dict
+from collections import defaultdict
 import json
-from datetime import datetime
-from .models import GameModel, MistakeModel
-from .advanced_analysis import (
-    TimePressureAnalyzer,
-    OpeningAnalyzer,
-    RatingTrendAnalyzer,
-    EndgameAnalyzer
-)
+from config import config
+from models import GameModel, MistakeModel
+from pagination import fetch_size, page_args, page_response
+from batch_analysis import analyze_games_parallel
+from player_stats import PlayerStatsStore
+from response_cache import versioned_json
+from utils import json_flag
 
 api = Blueprint('api', __name__)
 game_model = GameModel('./chess_games.db')
 mistake_model = MistakeModel('./chess_games.db')
+player_stats = PlayerStatsStore('./chess_games.db')
 
 
 @api.route('/stats/<username>')
 def get_player_stats(username: str):
-    games = game_model.get_all_games(username)
-    analyzed_games = [g for g in games if g['analyzed']]
-    
-    if not analyzed_games:
+    # Aggregates are maintained as games are imported and analyzed, and
+    # versioned so repeat requests skip reading and shaping them
+    state = player_stats.get_version(username)
+    if not state or not state['analyzed_games']:
         return jsonify({"error": "No analyzed games found"}), 404
     
-    # Basic mistake statistics
-    all_mistakes = mistake_model.get_mistakes_by_player(username)
-    mistake_counts = {
-        "blunder": 0,
-        "mistake": 0,
-        "inaccuracy": 0
-    }
-    
-    for mistake in all_mistakes:
-        if mistake['mistake_type'] == 'blunder':
-            mistake_counts['blunder'] += 1
-        elif mistake['mistake_type'] == 'mistake':
-            mistake_counts['mistake'] += 1
-        elif mistake['mistake_type'] == 'inaccuracy':
-            mistake_counts['inaccuracy'] += 1
-    
-    # Time pressure analysis
-    time_stats = TimePressureAnalyzer.analyze_time_mistakes(all_mistakes)
-    
-    # Opening analysis
-    opening_stats = OpeningAnalyzer().analyze_opening_mistakes(analyzed_games)
-    
-    # Rating trend
-    rating_trend = RatingTrendAnalyzer.calculate_rating_trend(games)
-    
-    # Endgame performance
-    endgame_stats = EndgameAnalyzer.analyze_endgame_performance(analyzed_games)
-    
-    return jsonify({
-        "username": username,
-        "total_games": len(games),
-        "analyzed_games": len(analyzed_games),
-        "mistakeDistribution": mistake_counts,
-        "timePressureStats": time_stats,
-        "openingStats": opening_stats,
-        "ratingTrend": rating_trend,
-        "endgamePerformance": endgame_stats,
-        "lastUpdated": datetime.now().isoformat()
-    })
+    return versioned_json(
+        ("stats", username), state['version'], state['updated_at'],
+        lambda: PlayerStatsStore.to_response(username, player_stats.get(username))
+    )
 
 @api.route('/games/batch-analyze', methods=['POST'])
 def batch_analyze():
     data = request.json
     game_ids = data.get('game_ids', [])
     depth = data.get('depth', 18)
+    try:
+        adaptive = json_flag(data, 'adaptive', config.ADAPTIVE_ANALYSIS)
+        multipv = json_flag(data, 'multipv', config.MULTIPV_ANALYSIS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     username = data.get('username')
     
     if not game_ids:
         return jsonify({"error": "No game IDs provided"}), 400
     
     results = []
+    pending = []
     for game_id in game_ids:
         game = game_model.get_game(game_id)
-        if not game['analyzed']:
-            analysis = analyzer.analyze_game(game_id, depth)
+        if game is None:
             results.append({
                 "game_id": game_id,
-                "status": "analyzed",
-                "mistakes": len(analysis['mistakes'])
+                "status": "not_found"
             })
-        else:
+        elif game['analyzed']:
             results.append({
                 "game_id": game_id,
                 "status": "already_analyzed"
             })
+        else:
+            pending.append(game_id)
     
-    # Update player stats after batch analysis
-    stats = get_player_stats(username)
+    # Fan out over the worker processes and collect games as they finish
+    results.extend(analyze_games_parallel(pending, depth, adaptive, multipv))
+    
+    # Player stats were updated as each game was analyzed
+    row = player_stats.get(username) if username else None
     
     return jsonify({
         "results": results,
-        "updated_stats": stats.json
+        "updated_stats": PlayerStatsStore.to_response(username, row) if row else None
     })
 
+@api.route('/api/games', methods=['GET'])
+def list_games():
+    username = request.args.get('username')
+    try:
+        after, limit, ndjson = page_args(key_length=2)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    games = game_model.iter_games(username, after, fetch_size(limit, ndjson))
+    return page_response(games, GameModel.game_key, "games", limit, ndjson)
+
+@api.route('/api/mistakes', methods=['GET'])
+def list_mistakes():
+    username = request.args.get('username')
+    if not username:
+        return jsonify({"error": "Username required"}), 400
+    try:
+        after, limit, ndjson = page_args(key_length=3)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    mistakes = mistake_model.iter_mistakes_by_player(
+        username, after, fetch_size(limit, ndjson)
+    )
+    return page_response(mistakes, MistakeModel.mistake_key, "mistakes", limit, ndjson)
+
 @api.route('/mistakes/common', methods=['GET'])
 def get_common_mistakes():
     username = request.args.get('username')
@@ -106,44 +107,24 @@ def get_common_mistakes():
     if not username:
         return jsonify({"error": "Username required"}), 400
     
-    mistakes = mistake_model.get_mistakes_by_player(username)
-    
-    # Group similar mistakes by position
-    position_groups = defaultdict(list)
-    for mistake in mistakes:
-        # Use FEN before move (without move counters) to group similar positions
-        simplified_fen = " ".join(mistake['fen_before'].split(" ")[:4])
-        position_groups[simplified_fen].append(mistake)
-    
-    # Get most frequent mistake positions
-    common_positions = sorted(
-        position_groups.items(),
-        key=lambda x: len(x[1]),
-        reverse=True
-    )[:limit]
-    
-    result = []
-    for fen, mistakes in common_positions:
-        result.append({
-            "fen": fen,
-            "count": len(mistakes),
-            "average_eval_diff": sum(m['eval_diff'] for m in mistakes) / len(mistakes),
-            "example_mistake": mistakes[0]  # Include one example
-        })
-    
-    return jsonify(result)
+    # Grouped and limited in SQL on the indexed position key
+    return jsonify(mistake_model.get_common_mistakes(username, limit))
 
 @api.route('/games/<game_id>/review', methods=['GET'])
 def get_game_review(game_id: str):
-    game = game_model.get_game(game_id)
-    if not game:
+    state = game_model.get_version(game_id)
+    if not state:
         return jsonify({"error": "Game not found"}), 404
     
-    if not game['analyzed']:
+    if not state['analyzed']:
         return jsonify({"error": "Game not analyzed"}), 400
     
-    analysis = json.loads(game['analysis_json'])
-    
+    return versioned_json(
+        ("review", game_id), state['version'], state['updated_at'],
+        lambda: _build_review(game_model.get_game(game_id)['analysis'])
+    )
+
+def _build_review(analysis) -> Dict:
     # Enhanced review with additional insights
     review = {
         "summary": analysis['summary'],
@@ -175,4 +156,4 @@ def get_game_review(game_id: str):
                 "examples": mistakes[:2]
             })
     
-    return jsonify(review)
\ No newline at end of file
+    return review
@@ -1,204 +1,172 @@
+import io
 import json
-from flask import Flask, jsonify, request
-import chess.pgn
-import chess.engine
-import sqlite3
-from datetime import datetime
+from flask import Flask, Response, g, jsonify, request
 import time
-import os
-import statistics
-from typing import List, Dict, Any, Optional
-import multiprocessing
-import threading
+from typing import Dict
 from flask_cors import CORS
 
+from chess_analyzer import ChessAnalyzer
+from config import config
+from db import get_connection
+from job_queue import JobQueue
+from jobs import JobManager
+import metrics
+from pagination import fetch_size, page_args, page_response
+from queue_api import queue_blueprint
+from response_cache import response_cache
+from utils import json_flag
+
 
 app = Flask(__name__)
 
 CORS(app)  # Add this right after creating your Flask app
 
-class ChessAnalyzer:
-    def __init__(self):
-        self.engine_path = "./stockfish"
-        self.db_path = "./chess_games.db"
-        self._init_db()
-        
-    def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS games (
-                    id TEXT PRIMARY KEY,
-                    pgn TEXT NOT NULL,
-                    white TEXT,
-                    black TEXT,
-                    date TEXT,
-                    result TEXT,
-                    analyzed BOOLEAN DEFAULT 0,
-                    analysis_json TEXT
-                )
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS mistakes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    game_id TEXT,
-                    move_number INTEGER,
-                    fen_before TEXT,
-                    fen_after TEXT,
-                    player_color TEXT,
-                    eval_before REAL,
-                    eval_after REAL,
-                    eval_diff REAL,
-                    mistake_type TEXT,
-                    clock_time REAL,
-                    FOREIGN KEY(game_id) REFERENCES games(id)
-                )
-            """)
-    
-    def import_pgn(self, pgn_text: str) -> Dict[str, Any]:
-        game = chess.pgn.read_game(pgn_text)
-        game_id = self._generate_game_id(game)
-        
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "INSERT OR IGNORE INTO games VALUES (?, ?, ?, ?, ?, ?, 0, NULL)",
-                (game_id, pgn_text, game.headers.get("White"), 
-                 game.headers.get("Black"), game.headers.get("Date"),
-                 game.headers.get("Result"))
-            )
-        return {"status": "success", "game_id": game_id}
-    
-    def analyze_game(self, game_id: str, depth: int = 18) -> Dict[str, Any]:
-        with sqlite3.connect(self.db_path) as conn:
-            pgn = conn.execute(
-                "SELECT pgn FROM games WHERE id = ?", (game_id,)
-            ).fetchone()[0]
-        
-        game = chess.pgn.read_game(pgn)
-        board = game.board()
-        
-        engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
-        analysis = {
-            "mistakes": [],
-            "summary": {
-                "white_mistakes": 0,
-                "black_mistakes": 0,
-                "worst_mistake": None,
-                "critical_moments": []
-            }
-        }
-        
-        max_eval_diff = 0
-        worst_mistake = None
-        
-        for node in game.mainline():
-            move = node.move
-            player = "white" if board.turn == chess.WHITE else "black"
-            
-            # Get clock time if available
-            clock_time = node.clock() if hasattr(node, "clock") else None
-            
-            # Evaluate position before move
-            info_before = engine.analyse(board, chess.engine.Limit(depth=depth))
-            eval_before = info_before["score"].white().score(mate_score=10000)
-            
-            board.push(move)
-            
-            # Evaluate position after move
-            info_after = engine.analyse(board, chess.engine.Limit(depth=depth))
-            eval_after = info_after["score"].white().score(mate_score=10000)
-            
-            eval_diff = abs(eval_after - eval_before)
-            
-            # Classify mistake
-            mistake_type = None
-            if eval_diff > 200:
-                mistake_type = "blunder"
-            elif eval_diff > 100:
-                mistake_type = "mistake"
-            elif eval_diff > 50:
-                mistake_type = "inaccuracy"
-            
-            if mistake_type:
-                mistake = {
-                    "move_number": board.fullmove_number,
-                    "player": player,
-                    "fen_before": board.fen(),
-                    "fen_after": board.fen(),
-                    "eval_before": eval_before,
-                    "eval_after": eval_after,
-                    "eval_diff": eval_diff,
-                    "mistake_type": mistake_type,
-                    "clock_time": clock_time,
-                    "move_san": board.san(move)
-                }
-                
-                analysis["mistakes"].append(mistake)
-                
-                if player == "white":
-                    analysis["summary"]["white_mistakes"] += 1
-                else:
-                    analysis["summary"]["black_mistakes"] += 1
-                
-                if eval_diff > max_eval_diff:
-                    max_eval_diff = eval_diff
-                    worst_mistake = mistake
-        
-        engine.quit()
-        
-        analysis["summary"]["worst_mistake"] = worst_mistake
-        analysis["summary"]["critical_moments"] = self._find_critical_moments(analysis["mistakes"])
-        
-        # Save analysis to DB
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "UPDATE games SET analyzed = 1, analysis_json = ? WHERE id = ?",
-                (json.dumps(analysis), game_id)
-            )
-        
-        return analysis
-    
-    def _find_critical_moments(self, mistakes: List[Dict]) -> List[Dict]:
-        # Implement logic to find game phases with most mistakes
-        pass
-    
-    def get_player_stats(self, username: str) -> Dict[str, Any]:
-        # Implement player statistics aggregation
-        pass
-
 analyzer = ChessAnalyzer()
+# Migrate rows stored before player stats and position keys were kept;
+# both are no-ops once everything is migrated
+analyzer.fill_player_stats()
+analyzer.fill_position_keys()
+# With JOB_QUEUE=db analyses are only queued here and run by worker.py processes
+job_manager = JobQueue(analyzer) if config.JOB_QUEUE == "db" else JobManager(analyzer)
+
+def _eval_cache_requests() -> Dict[str, int]:
+    stats = analyzer.eval_cache.stats()
+    return {"hit": stats["hits"], "miss": stats["misses"]}
+
+def _response_cache_requests() -> Dict[str, int]:
+    stats = response_cache.stats()
+    return {"hit": stats["hits"], "miss": stats["misses"]}
+
+# Read from the live objects only when /metrics is scraped
+metrics.CallbackMetric(
+    "chess_analysis_jobs", "Analysis jobs held by the job manager, by status",
+    job_manager.counts, labels=("status",)
+)
+metrics.CallbackMetric(
+    "chess_eval_cache_requests_total", "Eval cache lookups, by outcome",
+    _eval_cache_requests,
+    labels=("result",), kind="counter"
+)
+metrics.CallbackMetric(
+    "chess_eval_cache_hit_ratio", "Share of eval cache lookups that hit",
+    lambda: {(): analyzer.eval_cache.stats()["hit_rate"]}
+)
+metrics.CallbackMetric(
+    "chess_response_cache_requests_total", "Stats/review response cache lookups, by outcome",
+    _response_cache_requests,
+    labels=("result",), kind="counter"
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # The rule, not the path, so /jobs/<job_id> stays a single series
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method, route=route, status=response.status_code
+        )
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/players', methods=['GET'])
 def get_players():
     try:
-        with sqlite3.connect(analyzer.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Get all unique white and black players
-            cursor.execute("SELECT white FROM games UNION SELECT black FROM games")
-            players = [row[0] for row in cursor.fetchall() if row[0]]
-            
-            return jsonify({
-                "status": "success",
-                "players": players,
-                "count": len(players)
-            })
-    except Exception as e:
-        return jsonify({
-            "status": "error",
-            "message": str(e)
-        }), 500
+        after, limit, ndjson = page_args(key_length=1)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    batch_size = fetch_size(limit, ndjson)
+    
+    def players():
+        name = after[0] if after else ""
+        while True:
+            # Alphabetical merge of the white and black indexes, a batch at a time
+            with get_connection(analyzer.db_path) as conn:
+                rows = conn.execute("""
+                    SELECT white AS name FROM games WHERE white > ?
+                    UNION
+                    SELECT black FROM games WHERE black > ?
+                    ORDER BY name LIMIT ?
+                """, (name, name, batch_size)).fetchall()
+            for (name,) in rows:
+                yield name
+            if len(rows) < batch_size:
+                return
+    
+    return page_response(players(), lambda name: [name], "players", limit, ndjson,
+                         extra={"status": "success"})
+    
+@app.route('/api/eval-cache', methods=['GET'])
+def get_eval_cache_stats():
+    return jsonify(analyzer.eval_cache.stats())
     
 @app.route('/analyze', methods=['POST'])
 def analyze():
     data = request.json
     game_id = data.get('game_id')
     depth = data.get('depth', 18)
-    return jsonify(analyzer.analyze_game(game_id, depth))
+    try:
+        adaptive = json_flag(data, 'adaptive', config.ADAPTIVE_ANALYSIS)
+        multipv = json_flag(data, 'multipv', config.MULTIPV_ANALYSIS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not game_id:
+        return jsonify({"error": "game_id required"}), 400
+    
+    # Analysis runs in the background; poll /jobs/<id> or stream its events
+    job = job_manager.submit(game_id, depth, adaptive=adaptive, multipv=multipv)
+    return jsonify(job_manager.snapshot(job)), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_manager.snapshot(job))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    
+    def events():
+        version = -1
+        while True:
+            version = job_manager.wait_for_update(job, version)
+            snapshot = job_manager.snapshot(job)
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot["status"] in ("done", "failed"):
+                break
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 @app.route('/import', methods=['POST'])
 def import_game():
-    pgn_text = request.data.decode('utf-8')
-    return jsonify(analyzer.import_pgn(pgn_text))
+    # Read the body as a stream so large multi-game uploads are never held in memory
+    handle = io.TextIOWrapper(request.stream, encoding='utf-8-sig', errors='replace')
+    return jsonify(analyzer.import_pgn_stream(handle))
+
+@app.route('/import/pgn-dir', methods=['POST'])
+def import_pgn_dir():
+    return jsonify(analyzer.import_pgn_dir())
+
+from api_extensions import api
+app.register_blueprint(api)
+
+if isinstance(job_manager, JobQueue):
+    # Lets worker.py --server processes on other machines take the jobs
+    app.register_blueprint(queue_blueprint(job_manager))
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,198 @@
+# asgi.py
+"""ASGI serving mode for the analysis routes::
+
+    uvicorn asgi:app --port 5001
+
+Serves ``POST /analyze``, ``GET /jobs/<id>``, ``GET /jobs/<id>/events`` and
+``/metrics`` with the same requests and responses as the Flask app. Jobs
+are handled as there: with ``JOB_QUEUE=db`` they are only queued for
+worker.py processes (see ``AsyncJobQueue``), otherwise they run on the event
+loop (see ``AsyncJobManager``), so hundreds of queued or running analyses
+and open event streams need no thread each. The rest of the API stays on
+the Flask app; a proxy in front sends these paths here.
+"""
+import inspect
+import json
+import re
+import time
+from typing import Any, Dict, Optional, Union
+
+import metrics
+from analysis_engine import run_in_thread
+from app import analyzer, job_manager as app_job_manager
+from async_engine_pool import close_async_engine_pools
+from config import config
+from job_queue import AsyncJobQueue, JobQueue
+from jobs import AsyncJobManager
+from utils import json_flag
+
+_JOB_PATH = re.compile(r"^/jobs/(?P<job_id>[^/]+)(?P<events>/events)?$")
+
+_CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type"),
+]
+
+# Created on first use, since it belongs to the server's event loop
+_job_manager: Optional[Union[AsyncJobManager, AsyncJobQueue]] = None
+
+
+def get_job_manager() -> Union[AsyncJobManager, AsyncJobQueue]:
+    global _job_manager
+    if _job_manager is None:
+        # Same choice as the Flask app, which made the queue from config.JOB_QUEUE
+        if isinstance(app_job_manager, JobQueue):
+            _job_manager = AsyncJobQueue(app_job_manager)
+        else:
+            _job_manager = AsyncJobManager(analyzer)
+    return _job_manager
+
+
+async def _resolve(value):
+    # AsyncJobQueue reads the database in a thread, so its methods are
+    # coroutines; AsyncJobManager answers from memory
+    return await value if inspect.isawaitable(value) else value
+
+
+metrics.CallbackMetric(
+    "chess_async_analysis_jobs", "Analysis jobs held by the ASGI job manager, by status",
+    # Queued jobs are already counted by the Flask app's chess_analysis_jobs
+    lambda: _job_manager.counts() if isinstance(_job_manager, AsyncJobManager) else {},
+    labels=("status",)
+)
+
+
+async def _start(send, status: int, content_type: str, extra=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), *_CORS_HEADERS, *extra],
+    })
+
+
+async def _send_json(send, status: int, payload: Any):
+    await _start(send, status, "application/json")
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+
+async def _read_json(receive) -> Any:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return json.loads(body) if body else None
+
+
+async def _analyze(receive, send):
+    try:
+        data = await _read_json(receive) or {}
+    except ValueError:
+        await _send_json(send, 400, {"error": "Invalid JSON body"})
+        return
+    game_id = data.get('game_id')
+    depth = data.get('depth', 18)
+    try:
+        adaptive = json_flag(data, 'adaptive', config.ADAPTIVE_ANALYSIS)
+        multipv = json_flag(data, 'multipv', config.MULTIPV_ANALYSIS)
+    except ValueError as e:
+        await _send_json(send, 400, {"error": str(e)})
+        return
+    if not game_id:
+        await _send_json(send, 400, {"error": "game_id required"})
+        return
+
+    # Analysis runs as a task; poll /jobs/<id> or stream its events
+    job_manager = get_job_manager()
+    job = await _resolve(job_manager.submit(game_id, depth, adaptive=adaptive, multipv=multipv))
+    await _send_json(send, 202, await _resolve(job_manager.snapshot(job)))
+
+
+async def _stream_job(send, job):
+    job_manager = get_job_manager()
+    await _start(send, 200, "text/event-stream", [(b"cache-control", b"no-cache")])
+    version = -1
+    while True:
+        version = await job_manager.wait_for_update(job, version)
+        snapshot = await _resolve(job_manager.snapshot(job))
+        done = snapshot["status"] in ("done", "failed")
+        await send({
+            "type": "http.response.body",
+            "body": f"data: {json.dumps(snapshot)}\n\n".encode(),
+            "more_body": not done,
+        })
+        if done:
+            break
+
+
+async def _route(scope, receive, send) -> str:
+    """Handle one request; returns its route for the metrics"""
+    method, path = scope["method"], scope["path"]
+    if method == "OPTIONS":
+        await _start(send, 204, "text/plain")
+        await send({"type": "http.response.body", "body": b""})
+        return "preflight"
+
+    if path == "/analyze" and method == "POST":
+        await _analyze(receive, send)
+        return "/analyze"
+
+    if path == "/metrics" and method == "GET":
+        await _start(send, 200, "text/plain; version=0.0.4")
+        # Rendering reads the queue counts from the database with JOB_QUEUE=db
+        body = await run_in_thread(metrics.render)
+        await send({"type": "http.response.body", "body": body.encode()})
+        return "/metrics"
+
+    match = _JOB_PATH.match(path)
+    if match and method == "GET":
+        route = "/jobs/<job_id>" + (match["events"] or "")
+        job = await _resolve(get_job_manager().get(match["job_id"]))
+        if not job:
+            await _send_json(send, 404, {"error": "Job not found"})
+        elif match["events"]:
+            await _stream_job(send, job)
+        else:
+            await _send_json(send, 200, await _resolve(get_job_manager().snapshot(job)))
+        return route
+
+    await _send_json(send, 404, {"error": "Not found"})
+    return "unmatched"
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            get_job_manager()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _job_manager is not None:
+                await _job_manager.close()
+            await close_async_engine_pools()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Dict[str, Any], receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    status = None
+
+    async def send_and_record(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    start = time.perf_counter()
+    route = await _route(scope, receive, send_and_record)
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start, method=scope["method"], route=route, status=status
+    )
@@ -0,0 +1,190 @@
+# async_engine_pool.py
+"""asyncio counterpart of engine_pool, for the ASGI serving mode.
+
+Engines are ``chess.engine.popen_uci`` protocols driven by the event loop
+itself. ``SimpleEngine`` runs a thread per engine and blocks its caller for
+every search; here any number of analyses can wait for, or talk to, engines
+from one thread.
+"""
+import asyncio
+import contextlib
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import chess
+import chess.engine
+
+from config import config
+from engine_pool import record_search
+
+# How long a pooled engine gets to answer the health check on checkout
+_PING_TIMEOUT = 10.0
+
+
+class AsyncEngineLease:
+    """An engine checked out of the async pool for the analysis of one game"""
+
+    def __init__(self, protocol: chess.engine.UciProtocol):
+        self.protocol = protocol
+        # A fresh game key per checkout makes python-chess send ``ucinewgame``
+        self.game = object()
+
+    async def analyse(self, board: chess.Board, limit: chess.engine.Limit, **kwargs):
+        kwargs.setdefault("game", self.game)
+        start = time.perf_counter()
+        info = await self.protocol.analyse(board, limit, **kwargs)
+        record_search(info, time.perf_counter() - start)
+        return info
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.protocol, name)
+
+
+class AsyncEnginePool:
+    """Bounded pool of long-lived UCI engine processes on the running loop"""
+
+    def __init__(self, engine_path: str, size: Optional[int] = None,
+                 options: Optional[Dict[str, Any]] = None):
+        self.engine_path = engine_path
+        self.size = size or config.ENGINE_POOL_SIZE
+        self.options = options if options is not None else {
+            "Threads": config.ENGINE_THREADS,
+            "Hash": config.ENGINE_HASH
+        }
+        # Used as a stack, so the most recently used (warmest) engine is handed out first
+        self._idle: List[chess.engine.UciProtocol] = []
+        self._created = 0
+        # Notified whenever an engine is returned or a slot frees up
+        self._available = asyncio.Condition()
+        self._closed = False
+        self.engine_name: Optional[str] = None
+
+    async def _spawn(self) -> chess.engine.UciProtocol:
+        _, protocol = await chess.engine.popen_uci(self.engine_path)
+        self.engine_name = protocol.id.get("name")
+        supported = {
+            name: value for name, value in self.options.items()
+            if name in protocol.options
+        }
+        if supported:
+            await protocol.configure(supported)
+        return protocol
+
+    async def _free_slot(self):
+        async with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    async def _spawn_into_slot(self) -> chess.engine.UciProtocol:
+        try:
+            return await self._spawn()
+        except BaseException:
+            await self._free_slot()
+            raise
+
+    async def _discard(self, protocol: chess.engine.UciProtocol):
+        await self._free_slot()
+        try:
+            await asyncio.wait_for(protocol.quit(), _PING_TIMEOUT)
+        except Exception:
+            protocol.transport.close()
+
+    @staticmethod
+    async def _is_healthy(protocol: chess.engine.UciProtocol) -> bool:
+        try:
+            await asyncio.wait_for(protocol.ping(), _PING_TIMEOUT)
+            return True
+        except (chess.engine.EngineError, asyncio.TimeoutError):
+            return False
+
+    async def acquire(self, timeout: Optional[float] = None) -> chess.engine.UciProtocol:
+        """Check out an engine, spawning one if the pool is not yet full"""
+        if timeout is None:
+            timeout = config.ENGINE_ACQUIRE_TIMEOUT
+
+        deadline = time.monotonic() + timeout
+        while True:
+            async with self._available:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Engine pool is closed")
+                    if self._idle:
+                        protocol = self._idle.pop()
+                        break
+                    if self._created < self.size:
+                        # Reserve the slot; the engine is spawned outside the lock
+                        self._created += 1
+                        protocol = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No engine became available within {timeout}s")
+                    try:
+                        await asyncio.wait_for(self._available.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+
+            if protocol is None:
+                return await self._spawn_into_slot()
+
+            if await self._is_healthy(protocol):
+                return protocol
+
+            # Crashed or hung engine: drop it and let the loop spawn a replacement
+            await self._discard(protocol)
+
+    async def release(self, protocol: chess.engine.UciProtocol, healthy: bool = True):
+        """Return an engine to the pool, discarding it if it is unusable"""
+        async with self._available:
+            if not self._closed and healthy:
+                self._idle.append(protocol)
+                self._available.notify()
+                return
+        await self._discard(protocol)
+
+    @contextlib.asynccontextmanager
+    async def engine(self, timeout: Optional[float] = None) -> AsyncIterator[AsyncEngineLease]:
+        protocol = await self.acquire(timeout)
+        healthy = True
+        try:
+            yield AsyncEngineLease(protocol)
+        except (chess.engine.EngineError, asyncio.CancelledError):
+            # A cancelled search may leave the engine mid-command
+            healthy = False
+            raise
+        finally:
+            await self.release(protocol, healthy)
+
+    async def identify(self) -> Optional[str]:
+        """Engine name and version, starting an engine if none has run yet"""
+        if self.engine_name is None:
+            async with self.engine():
+                pass
+        return self.engine_name
+
+    async def close(self):
+        async with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            # Waiters fail fast instead of sitting out their timeout
+            self._available.notify_all()
+        for protocol in idle:
+            await self._discard(protocol)
+
+
+# One pool per engine binary; pools belong to the loop that first used them
+_pools: Dict[str, AsyncEnginePool] = {}
+
+
+def get_async_engine_pool(engine_path: str) -> AsyncEnginePool:
+    """Return the shared async pool for an engine binary, creating it on first use"""
+    pool = _pools.get(engine_path)
+    if pool is None:
+        pool = _pools[engine_path] = AsyncEnginePool(engine_path)
+    return pool
+
+
+async def close_async_engine_pools():
+    while _pools:
+        _, pool = _pools.popitem()
+        await pool.close()
@@ -0,0 +1,97 @@
+# batch_analysis.py
+import atexit
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from config import config
+
+# Set in each worker process by _init_worker
+_worker_analyzer = None
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker(engine_threads: int, engine_hash: int):
+    """Give each worker process a single engine with its share of the cores"""
+    global _worker_analyzer
+    # Only the analyzer: importing app would build the whole web app per worker
+    from chess_analyzer import ChessAnalyzer
+
+    analyzer = ChessAnalyzer(config.ENGINE_PATH)
+    # The pool is lazy, so nothing has been spawned yet in a fresh worker
+    analyzer.engine_pool.size = 1
+    analyzer.engine_pool.options = {"Threads": engine_threads, "Hash": engine_hash}
+    _worker_analyzer = analyzer
+
+
+def _analyze_in_worker(game_id: str, depth: int, adaptive: bool,
+                       multipv: bool) -> Dict[str, Any]:
+    try:
+        analysis = _worker_analyzer.analyze_game(
+            game_id, depth, adaptive=adaptive, multipv=multipv
+        )
+    except Exception as e:
+        return {"game_id": game_id, "status": "error", "message": str(e)}
+    return {
+        "game_id": game_id,
+        "status": "analyzed",
+        "mistakes": len(analysis["mistakes"])
+    }
+
+
+def get_batch_executor() -> ProcessPoolExecutor:
+    """Long-lived worker pool, so engines stay warm between batch requests"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = config.BATCH_WORKERS
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            # Split the hash budget too, otherwise N workers use N times the memory
+            engine_hash = max(16, config.ENGINE_HASH // workers)
+            # Always spawn: forked children would inherit the parent's engine
+            # pool and SQLite handles, and Windows cannot fork anyway
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads, engine_hash)
+            )
+        return _executor
+
+
+def analyze_games_parallel(game_ids: Iterable[str], depth: int,
+                           adaptive: bool = False,
+                           multipv: bool = False) -> Iterator[Dict[str, Any]]:
+    """Analyze games across the worker processes, yielding results as they finish"""
+    executor = get_batch_executor()
+    futures = [
+        executor.submit(_analyze_in_worker, game_id, depth, adaptive, multipv)
+        for game_id in game_ids
+    ]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # The client went away: don't keep the workers busy with the rest
+        for future in futures:
+            future.cancel()
+
+
+def shutdown_batch_executor():
+    """Stop the worker processes, dropping analyses that have not started"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            if sys.version_info >= (3, 9):
+                _executor.shutdown(cancel_futures=True)
+            else:
+                _executor.shutdown()
+            _executor = None
+
+
+atexit.register(shutdown_batch_executor)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# fake_engine.py
+"""Deterministic stand-in for Stockfish, speaking just enough UCI for python-chess.
+
+Scores are a hash of the position, so repeated runs produce identical
+analyses. ``--latency-ms`` adds a fixed delay per search to mimic a real
+engine's cost; the default of 0 measures everything except the engine.
+
+    python fake_engine.py --latency-ms 5
+"""
+import argparse
+import hashlib
+import sys
+import time
+
+import chess
+
+
+def _score(board: chess.Board) -> int:
+    """Centipawns for the side to move, in [-300, 300)"""
+    digest = hashlib.md5(board.board_fen().encode()).digest()
+    return int.from_bytes(digest[:2], "little") % 600 - 300
+
+
+def _search(board: chess.Board, depth: int, multipv: int, latency: float):
+    if latency:
+        time.sleep(latency)
+
+    if not any(board.generate_legal_moves()):
+        score = "mate 0" if board.is_check() else "cp 0"
+        _out(f"info depth 0 score {score}")
+        _out("bestmove (none)")
+        return
+
+    if multipv == 1:
+        # Scoring every reply is only needed to rank several lines
+        move = min(board.legal_moves, key=lambda move: move.uci())
+        results = [(_score(board), move.uci())]
+    else:
+        results = []
+        for move in board.legal_moves:
+            board.push(move)
+            results.append((-_score(board), move.uci()))
+            board.pop()
+        results.sort(key=lambda result: (-result[0], result[1]))
+
+    nodes = 1000 * depth
+    elapsed_ms = max(1, int(latency * 1000))
+    for rank, (score, uci) in enumerate(results[:multipv], 1):
+        _out(f"info depth {depth} seldepth {depth} multipv {rank} score cp {score} "
+             f"nodes {nodes} nps {nodes * 1000 // elapsed_ms} time {elapsed_ms} pv {uci}")
+    _out(f"bestmove {results[0][1]}")
+
+
+def _out(line: str):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="delay added to every search")
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+
+    board = chess.Board()
+    multipv = 1
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+
+        if command == "uci":
+            _out("id name FakeFish 1.0")
+            _out("id author benchmarks")
+            _out("option name Threads type spin default 1 min 1 max 512")
+            _out("option name Hash type spin default 16 min 1 max 33554432")
+            _out("option name MultiPV type spin default 1 min 1 max 500")
+            _out("uciok")
+        elif command == "isready":
+            _out("readyok")
+        elif command == "setoption" and "name" in tokens and "value" in tokens:
+            name = " ".join(tokens[tokens.index("name") + 1:tokens.index("value")])
+            if name == "MultiPV":
+                multipv = int(tokens[tokens.index("value") + 1])
+        elif command == "ucinewgame":
+            board = chess.Board()
+        elif command == "position":
+            moves_at = tokens.index("moves") if "moves" in tokens else len(tokens)
+            if tokens[1] == "startpos":
+                board = chess.Board()
+            else:
+                board = chess.Board(" ".join(tokens[2:moves_at]))
+            # python-chess resends the whole game every search; trust it
+            # rather than validating each move again
+            for uci in tokens[moves_at + 1:]:
+                board.push(chess.Move.from_uci(uci))
+        elif command == "go":
+            depth = int(tokens[tokens.index("depth") + 1]) if "depth" in tokens else 10
+            _search(board, depth, multipv, latency)
+        elif command == "quit":
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+# run_benchmarks.py
+"""Benchmark suite for the analysis, import and stats paths.
+
+Runs entirely in a temporary directory against benchmarks/fake_engine.py, so
+no Stockfish binary or existing database is needed. Results are written as
+JSON for comparing runs across releases:
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --sizes 1000,10000 --latency-ms 2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent
+
+BENCH_PLAYER = "bench_player"
+# Player games that are really analyzed; the rest reuse their analyses
+TEMPLATE_GAMES = 20
+
+
+def _random_game(rng: random.Random) -> "chess.pgn.Game":
+    """A random legal game of 40-120 plies with %clk comments"""
+    import chess
+    import chess.pgn
+
+    board = chess.Board()
+    clocks = [300.0, 300.0]
+    game = chess.pgn.Game()
+    node = game
+    for ply in range(rng.randint(40, 120)):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        move = rng.choice(moves)
+        board.push(move)
+        side = ply % 2
+        clocks[side] = max(0.0, clocks[side] - rng.uniform(0.5, 12.0) + 2)
+        node = node.add_variation(move)
+        node.set_clock(round(clocks[side]))
+    game.headers["Result"] = board.result(claim_draw=True) if board.is_game_over() else "*"
+    return game
+
+
+def _movetexts(count: int, seed: int) -> List[Dict[str, Any]]:
+    """Distinct game bodies to stamp headers onto (generating moves is slow)"""
+    import io
+
+    import chess.pgn
+
+    from move_encoding import read_game_record
+
+    rng = random.Random(seed)
+    bodies = []
+    for _ in range(count):
+        game = _random_game(rng)
+        movetext = game.accept(chess.pgn.StringExporter(headers=False))
+        record = read_game_record(io.StringIO(movetext))
+        _, moves, clocks = record.encode()
+        bodies.append({
+            "result": game.headers["Result"], "movetext": movetext,
+            "moves": moves, "clocks": clocks
+        })
+    return bodies
+
+
+def _headers(index: int, body: Dict[str, Any], white: str, black: str) -> Dict[str, str]:
+    day = date(2020, 1, 1) + timedelta(days=index // 500)
+    return {
+        "Event": "Benchmark", "White": white, "Black": black,
+        "Date": f"{day:%Y.%m.%d}", "Result": body["result"],
+        "WhiteElo": str(1500 + index % 300), "BlackElo": str(1600 - index % 300),
+        "TimeControl": "300+2"
+    }
+
+
+def _pgn(headers: Dict[str, str], body: Dict[str, Any]) -> str:
+    tags = "".join(f'[{name} "{value}"]\n' for name, value in headers.items())
+    return f"{tags}\n{body['movetext']}\n\n"
+
+
+def _latency(call: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    for _ in range(3):
+        call()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "requests": repeat,
+        "mean_ms": statistics.mean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max_ms": samples[-1]
+    }
+
+
+def bench_import(analyzer, bodies: List[Dict[str, Any]], games: int) -> Dict[str, Any]:
+    path = Path("import.pgn")
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(games):
+            body = bodies[i % len(bodies)]
+            f.write(_pgn(_headers(i, body, f"importer_{i % 500}", f"opponent_{i % 499}"), body))
+
+    start = time.perf_counter()
+    with open(path, encoding="utf-8") as handle:
+        result = analyzer.import_pgn_stream(handle)
+    elapsed = time.perf_counter() - start
+    return {
+        "games": result["imported"],
+        "megabytes": path.stat().st_size / 1e6,
+        "seconds": elapsed,
+        "games_per_sec": result["imported"] / elapsed
+    }
+
+
+def bench_analyze(analyzer, games: int, depth: int) -> Dict[str, Any]:
+    from db import get_connection
+
+    with get_connection(analyzer.db_path) as conn:
+        game_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM games WHERE white LIKE 'importer_%' ORDER BY id LIMIT ?", (games,)
+        )]
+
+    # Measure searching, not cache hits
+    analyzer.eval_cache.max_entries = 0
+    plies = 0
+    start = time.perf_counter()
+    for game_id in game_ids:
+        plies += len(analyzer.analyze_game(game_id, depth)["evals"]) - 1
+    elapsed = time.perf_counter() - start
+    return {
+        "games": len(game_ids),
+        "plies": plies,
+        "depth": depth,
+        "seconds": elapsed,
+        "plies_per_sec": plies / elapsed
+    }
+
+
+def _add_player_games(analyzer, bodies: List[Dict[str, Any]],
+                      templates: Optional[List[Dict]], first: int, last: int):
+    """Insert games for BENCH_PLAYER directly, as analyzed copies of the
+    template analyses (body i has analysis i) or unanalyzed without them"""
+    from analysis_format import encode_analysis
+    from db import get_connection
+    from utils import game_id_from_headers
+
+    blobs = [encode_analysis(analysis) for analysis in templates] if templates else None
+    with get_connection(analyzer.db_path) as conn:
+        for i in range(first, last):
+            white, black = (BENCH_PLAYER, f"rival_{i % 997}")
+            if i % 2:
+                white, black = black, white
+            body = bodies[i % len(bodies)]
+            headers = _headers(i, body, white, black)
+            game_id = game_id_from_headers(headers, body["moves"])
+            analysis = templates[i % len(bodies)] if templates else None
+            blob = blobs[i % len(bodies)] if blobs else None
+            conn.execute("""
+                INSERT INTO games (
+                    id, pgn, white, black, date, result, analyzed, analysis,
+                    headers_json, moves, clocks
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (game_id, _pgn(headers, body), white, black, headers["Date"],
+                  headers["Result"], analysis is not None, blob,
+                  json.dumps(headers), body["moves"], body["clocks"]))
+            if analysis:
+                analyzer._replace_mistakes(conn, game_id, analysis["mistakes"])
+
+
+def bench_stats(analyzer, client, bodies: List[Dict[str, Any]], sizes: List[int],
+                depth: int, repeat: int) -> Dict[str, Any]:
+    from db import get_connection
+
+    # Really analyze the player's first game on each body, then stamp those
+    # analyses onto the bulk of the games
+    bodies = bodies[:TEMPLATE_GAMES]
+    _add_player_games(analyzer, bodies, None, 0, len(bodies))
+    with get_connection(analyzer.db_path) as conn:
+        first_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM games WHERE white = ? OR black = ? ORDER BY rowid",
+            (BENCH_PLAYER, BENCH_PLAYER)
+        )]
+    templates = [analyzer.analyze_game(game_id, depth) for game_id in first_ids]
+
+    results = {}
+    have = len(bodies)
+    for size in sorted(sizes):
+        build_start = time.perf_counter()
+        _add_player_games(analyzer, bodies, templates, have, size)
+        have = max(have, size)
+        analyzer.rebuild_player_stats()
+        build_seconds = time.perf_counter() - build_start
+
+        stats_url = f"/stats/{BENCH_PLAYER}"
+        mistakes_url = f"/mistakes/common?username={BENCH_PLAYER}&limit=5"
+        assert client.get(stats_url).status_code == 200
+        results[str(size)] = {
+            "games": size,
+            "fixture_seconds": build_seconds,
+            "stats": _latency(lambda: client.get(stats_url), repeat),
+            "mistakes_common": _latency(lambda: client.get(mistakes_url), max(1, repeat // 5))
+        }
+    return results
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend benchmarks")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="simulated engine time per search")
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--import-games", type=int, default=5000)
+    parser.add_argument("--analyze-games", type=int, default=20)
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="player game counts for the /stats benchmarks")
+    parser.add_argument("--repeat", type=int, default=50, help="requests per latency sample")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    output = Path(args.output).resolve() if args.output else None
+
+    workdir = tempfile.mkdtemp(prefix="chess-bench-")
+    os.chdir(workdir)
+    # Keep config from creating its default data directories
+    os.environ.setdefault("CHESS_DATA_DIR", os.path.join(workdir, "data"))
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    import chess
+
+    from app import analyzer, app
+    from engine_pool import EnginePool
+
+    analyzer.engine_pool = EnginePool(
+        [sys.executable, str(BENCH_DIR / "fake_engine.py"), "--latency-ms", str(args.latency_ms)],
+        size=1
+    )
+    client = app.test_client()
+
+    try:
+        bodies = _movetexts(200, args.seed)
+        results = {
+            "import": bench_import(analyzer, bodies, args.import_games),
+            "analyze": bench_analyze(analyzer, args.analyze_games, args.depth),
+            "stats": bench_stats(analyzer, client, bodies, sizes, args.depth, args.repeat)
+        }
+    finally:
+        # Not in the shared registry, so nothing else would stop the engine
+        analyzer.engine_pool.close()
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "python_chess": chess.__version__,
+            "platform": platform.platform(),
+            "workdir": workdir,
+            "args": vars(args)
+        },
+        "results": results
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
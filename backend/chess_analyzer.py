@@ -0,0 +1,772 @@
+# chess_analyzer.py
+import contextlib
+import io
+import json
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, TextIO, Tuple
+
+import chess
+import chess.pgn
+
+from analysis_format import encode_analysis, load_analysis
+from analysis_engine import (
+    BlockingEngine,
+    BlockingEvalCache,
+    CriticalityAnalyzer,
+    ThreadedEvalCache,
+    adaptive_mainline_evals_async,
+    classify_eval_diff,
+    iter_async,
+    iter_mainline_evals_async,
+    iter_multipv_plies_async,
+    phase_timeline,
+    run_in_thread,
+    run_sync,
+    timeline_plies_async
+)
+from async_engine_pool import get_async_engine_pool
+from config import config
+from db import get_connection
+from engine_pool import get_engine_pool
+from eval_cache import EvalCache, GameEvals, fen_position_key, mainline_keys
+import metrics
+from move_encoding import GameRecord, load_game_record, read_game_record
+from player_stats import PlayerStatsStore, game_facts, import_facts
+from response_cache import response_cache
+from utils import game_id_from_headers, iter_pgn_chunks, legacy_game_id
+
+
+@dataclass
+class _LoadedGame:
+    """A stored game as read for analysis, with its previous evals"""
+    record: GameRecord
+    keys: List[int]
+    engine_name: Optional[str]
+    evals: GameEvals
+
+
+@contextlib.asynccontextmanager
+async def _no_engine():
+    """Stands in for an engine lease when stored evals cover the analysis"""
+    yield None
+
+
+class ChessAnalyzer:
+    def __init__(self, engine_path: Optional[str] = None):
+        self.engine_path = engine_path or config.ENGINE_PATH
+        self.db_path = "./chess_games.db"
+        self.engine_pool = get_engine_pool(self.engine_path)
+        self.eval_cache = EvalCache(self.db_path)
+        self.player_stats = PlayerStatsStore(self.db_path)
+        self._init_db()
+        
+    def _init_db(self):
+        with get_connection(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS games (
+                    id TEXT PRIMARY KEY,
+                    pgn TEXT NOT NULL,
+                    white TEXT,
+                    black TEXT,
+                    date TEXT,
+                    result TEXT,
+                    analyzed BOOLEAN DEFAULT 0,
+                    analysis_json TEXT,
+                    headers_json TEXT,
+                    moves BLOB,
+                    clocks BLOB,
+                    analysis BLOB,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT,
+                    stats_counted INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            # Databases created before moves and analyses were stored encoded,
+            # or before games carried a data version
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(games)")}
+            # Without per-game flags the existing aggregates can't be trusted;
+            # they are recounted by fill_player_stats
+            recount_stats = "stats_counted" not in columns
+            for column, kind in (("headers_json", "TEXT"), ("moves", "BLOB"),
+                                 ("clocks", "BLOB"), ("analysis", "BLOB"),
+                                 ("version", "INTEGER NOT NULL DEFAULT 0"),
+                                 ("updated_at", "TEXT"),
+                                 ("stats_counted", "INTEGER NOT NULL DEFAULT 0")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE games ADD COLUMN {column} {kind}")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS mistakes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    game_id TEXT,
+                    move_number INTEGER,
+                    fen_before TEXT,
+                    fen_after TEXT,
+                    player_color TEXT,
+                    eval_before REAL,
+                    eval_after REAL,
+                    eval_diff REAL,
+                    mistake_type TEXT,
+                    clock_time REAL,
+                    best_move TEXT,
+                    position_key INTEGER,
+                    FOREIGN KEY(game_id) REFERENCES games(id)
+                )
+            """)
+            # Mistake tables created before best moves and position keys
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(mistakes)")}
+            if "best_move" not in columns:
+                conn.execute("ALTER TABLE mistakes ADD COLUMN best_move TEXT")
+            if "position_key" not in columns:
+                # Keyed in batches by fill_position_keys when the web app starts
+                conn.execute("ALTER TABLE mistakes ADD COLUMN position_key INTEGER")
+            # Player, then newest first: keyset pages of a player's games are
+            # a merge of two index scans (see models._iter_game_rows)
+            for name, column in (("white", "white"), ("black", "black"), ("date", None)):
+                conn.execute(f"DROP INDEX IF EXISTS idx_games_{name}")
+                prefix = f"{column}, " if column else ""
+                conn.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_games_{name}_date
+                    ON games({prefix}IFNULL(date, ''), id)
+                """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_mistakes_game_id ON mistakes(game_id)")
+            # Only the games fill_player_stats still has to count
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_games_stats_uncounted
+                ON games(stats_counted) WHERE stats_counted = 0
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_mistakes_position_key ON mistakes(position_key)"
+            )
+            # Covers the per-player grouping of /mistakes/common without
+            # reading the mistake rows themselves
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_mistakes_game_position
+                ON mistakes(game_id, position_key, eval_diff)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS player_stats (
+                    username TEXT PRIMARY KEY,
+                    total_games INTEGER NOT NULL DEFAULT 0,
+                    analyzed_games INTEGER NOT NULL DEFAULT 0,
+                    stats_json TEXT NOT NULL,
+                    updated_at TEXT,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(player_stats)")}
+            if "version" not in columns:
+                conn.execute(
+                    "ALTER TABLE player_stats ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+                )
+            if recount_stats:
+                self.player_stats.reset(conn)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS position_evals (
+                    position_hash INTEGER PRIMARY KEY,
+                    depth INTEGER NOT NULL,
+                    score INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_position_evals_last_used
+                ON position_evals(last_used)
+            """)
+            # Durable queue for JOB_QUEUE=db (see job_queue.py)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_jobs (
+                    id TEXT PRIMARY KEY,
+                    game_id TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    adaptive BOOLEAN NOT NULL DEFAULT 0,
+                    multipv BOOLEAN NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    plies_done INTEGER NOT NULL DEFAULT 0,
+                    plies_total INTEGER NOT NULL DEFAULT 0,
+                    mistakes_json TEXT NOT NULL DEFAULT '[]',
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    result BLOB
+                )
+            """)
+            # Job tables created before jobs kept their own result
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(analysis_jobs)")}
+            if "result" not in columns:
+                conn.execute("ALTER TABLE analysis_jobs ADD COLUMN result BLOB")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status
+                ON analysis_jobs(status, created_at)
+            """)
+    
+    def import_pgn(self, pgn_text: str) -> Dict[str, Any]:
+        return self.import_pgn_stream(io.StringIO(pgn_text))
+    
+    def import_pgn_stream(self, handle: TextIO, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Import every game of a PGN stream in large batched transactions"""
+        batch_size = batch_size or config.IMPORT_BATCH_SIZE
+        counts = {"imported": 0, "duplicates": 0, "failed": 0}
+        first_game_id = None
+        batch = []
+        
+        def stored_moves(ids: List[str]) -> Dict[str, Optional[bytes]]:
+            found = {}
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                found.update(conn.execute(
+                    f"SELECT id, moves FROM games WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ))
+            return found
+        
+        def flush():
+            # Find the genuinely new games first so player totals count each once
+            unique = {row[0]: (row, elos, legacy_id) for row, elos, legacy_id in batch}
+            existing = stored_moves(list(unique))
+            # Games imported before ids covered the moves are stored under their
+            # legacy id; they are duplicates unless their moves differ (a rematch)
+            legacy = stored_moves(list({
+                legacy_id for game_id, (_, _, legacy_id) in unique.items()
+                if game_id not in existing
+            }))
+            
+            def is_new(game_id: str, moves: bytes, legacy_id: str) -> bool:
+                nonlocal first_game_id
+                if game_id in existing:
+                    return False
+                if legacy_id not in legacy:
+                    return True
+                # Unencoded legacy rows can't be compared; keep treating them as the same game
+                if legacy[legacy_id] not in (None, moves):
+                    return True
+                if game_id == first_game_id:
+                    # Point the response at the row that is actually stored
+                    first_game_id = legacy_id
+                return False
+            
+            new_games = [
+                (row, elos) for game_id, (row, elos, legacy_id) in unique.items()
+                if is_new(game_id, row[7], legacy_id)
+            ]
+            
+            conn.executemany("""
+                INSERT OR IGNORE INTO games (
+                    id, pgn, white, black, date, result, headers_json, moves, clocks,
+                    stats_counted
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            """, [row for row, _ in new_games])
+            self.player_stats.record_imports(conn, [
+                {"white": row[2], "black": row[3], "date": row[4],
+                 "white_elo": elos[0], "black_elo": elos[1]}
+                for row, elos in new_games
+            ])
+            conn.commit()
+            response_cache.invalidate(*{
+                ("stats", name) for row, _ in new_games for name in (row[2], row[3]) if name
+            })
+            counts["imported"] += len(new_games)
+            counts["duplicates"] += len(batch) - len(new_games)
+            batch.clear()
+        
+        with get_connection(self.db_path) as conn:
+            for pgn_text in iter_pgn_chunks(handle):
+                # Parse the mainline once here so nothing else has to parse PGN
+                record = read_game_record(io.StringIO(pgn_text))
+                if record is None:
+                    counts["failed"] += 1
+                    continue
+                
+                headers = record.headers
+                headers_json, moves, clocks = record.encode()
+                game_id = game_id_from_headers(headers, moves)
+                first_game_id = first_game_id or game_id
+                batch.append(((
+                    game_id, pgn_text, headers.get("White"), headers.get("Black"),
+                    headers.get("Date"), headers.get("Result"), headers_json, moves, clocks
+                ), (headers.get("WhiteElo"), headers.get("BlackElo")), legacy_game_id(headers)))
+                if len(batch) >= batch_size:
+                    flush()
+            
+            if batch:
+                flush()
+        
+        return {"status": "success", "game_id": first_game_id, **counts}
+    
+    def import_pgn_dir(self, pgn_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """Import every .pgn file dropped into the PGN directory.
+        
+        Imported files are moved to an ``imported`` subdirectory so they are
+        not read again on the next scan.
+        """
+        pgn_dir = Path(pgn_dir or config.PGN_DIR)
+        done_dir = pgn_dir / "imported"
+        done_dir.mkdir(exist_ok=True)
+        
+        totals = {"files": 0, "imported": 0, "duplicates": 0, "failed": 0}
+        for path in sorted(pgn_dir.glob("*.pgn")):
+            with open(path, encoding="utf-8-sig", errors="replace") as handle:
+                result = self.import_pgn_stream(handle)
+            path.replace(done_dir / path.name)
+            
+            totals["files"] += 1
+            for key in ("imported", "duplicates", "failed"):
+                totals[key] += result[key]
+        
+        return {"status": "success", **totals}
+    
+    @metrics.timed(metrics.ANALYSIS_SECONDS)
+    @metrics.tracked(metrics.ANALYSES_IN_PROGRESS)
+    def analyze_game(self, game_id: str, depth: int = 18,
+                     progress: Optional[Callable[[int, int, Optional[Dict]], None]] = None,
+                     adaptive: bool = False, multipv: bool = False) -> Dict[str, Any]:
+        """Analyze a stored game.
+
+        ``progress`` is called after every ply as (plies_done, plies_total,
+        mistake_or_None) so callers can report partial results. With
+        ``adaptive`` the game is swept at a shallow depth first and only
+        suspicious plies are searched at ``depth``. With ``multipv`` each ply
+        is judged from one MultiPV search of the position before it, which
+        also gives the best move of every mistake.
+        """
+        game = self._load_for_analysis(game_id, self.engine_pool.identify())
+        analysis = self._analyze_blocking(game, depth, progress, adaptive, multipv)
+        self._store_analysis(game_id, game.record, analysis)
+        return analysis
+    
+    def analyze_record(self, record: GameRecord, previous: Optional[Mapping[str, Any]],
+                       depth: int = 18,
+                       progress: Optional[Callable[[int, int, Optional[Dict]], None]] = None,
+                       adaptive: bool = False, multipv: bool = False) -> Dict[str, Any]:
+        """analyze_game for a game read elsewhere (e.g. sent by a remote job
+        queue), seeded from its ``previous`` analysis. Nothing is stored."""
+        game = self._prepare(record, previous, self.engine_pool.identify())
+        return self._analyze_blocking(game, depth, progress, adaptive, multipv)
+    
+    def _analyze_blocking(self, game: _LoadedGame, depth: int,
+                          progress: Optional[Callable[[int, int, Optional[Dict]], None]],
+                          adaptive: bool, multipv: bool) -> Dict[str, Any]:
+        if self._needs_engine(game, depth, multipv):
+            engine_context = self.engine_pool.engine()
+        else:
+            engine_context = contextlib.nullcontext()
+        with engine_context as engine:
+            # The analysis core is async; over a blocking engine it never
+            # suspends, so it runs to completion on this thread
+            return run_sync(self._analyze_loaded(
+                BlockingEngine(engine), BlockingEvalCache(game.evals), game, depth,
+                progress, adaptive, multipv
+            ))
+    
+    @metrics.timed(metrics.ANALYSIS_SECONDS)
+    @metrics.tracked(metrics.ANALYSES_IN_PROGRESS)
+    async def analyze_game_async(self, game_id: str, depth: int = 18,
+                                 progress: Optional[Callable[[int, int, Optional[Dict]], None]] = None,
+                                 adaptive: bool = False, multipv: bool = False) -> Dict[str, Any]:
+        """analyze_game on the running event loop.
+        
+        Searches go through the loop's AsyncEnginePool, so an analysis that is
+        waiting for an engine or a search holds no thread; only the database
+        reads and writes (loading, eval cache, storing) are handed to threads.
+        """
+        pool = get_async_engine_pool(self.engine_path)
+        game = await run_in_thread(self._load_for_analysis, game_id, await pool.identify())
+        if self._needs_engine(game, depth, multipv):
+            engine_context = pool.engine()
+        else:
+            # contextlib.nullcontext only supports async with from Python 3.10
+            engine_context = _no_engine()
+        async with engine_context as engine:
+            analysis = await self._analyze_loaded(
+                engine, ThreadedEvalCache(game.evals), game, depth, progress, adaptive, multipv
+            )
+        
+        await run_in_thread(self._store_analysis, game_id, game.record, analysis)
+        return analysis
+    
+    def read_game(self, game_id: str) -> Tuple[GameRecord, Optional[Mapping[str, Any]]]:
+        """A stored game and its current analysis (None if not analyzed yet)"""
+        with get_connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT pgn, headers_json, moves, clocks, analysis, analysis_json "
+                "FROM games WHERE id = ?", (game_id,)
+            ).fetchone()
+        if row is None:
+            raise ValueError(f"Game {game_id} not found")
+        return load_game_record(*row[:4]), load_analysis(row[4], row[5])
+    
+    def _load_for_analysis(self, game_id: str, engine_name: Optional[str]) -> _LoadedGame:
+        return self._prepare(*self.read_game(game_id), engine_name)
+    
+    def _prepare(self, record: GameRecord, previous: Optional[Mapping[str, Any]],
+                 engine_name: Optional[str]) -> _LoadedGame:
+        # Re-analysis only searches positions the last run did not reach
+        # ``depth`` on, and needs no engine at all when it reached it everywhere
+        keys = mainline_keys(record.board(), record.moves)
+        game_evals = self._game_evals(previous, keys, engine_name)
+        return _LoadedGame(record, keys, engine_name, game_evals)
+    
+    @staticmethod
+    def _needs_engine(game: _LoadedGame, depth: int, multipv: bool) -> bool:
+        # MultiPV needs the lines of every position, which are never stored
+        if multipv and game.record.moves:
+            return True
+        return not game.evals.covers(game.keys, depth)
+    
+    async def _analyze_loaded(self, engine, cache: BlockingEvalCache, game: _LoadedGame,
+                              depth: int,
+                              progress: Optional[Callable[[int, int, Optional[Dict]], None]],
+                              adaptive: bool, multipv: bool) -> Dict[str, Any]:
+        """The analysis of a loaded game, searching with ``engine``'s
+        ``analyse`` coroutine (an AsyncEngineLease or a BlockingEngine) and
+        reading and writing evals through ``cache``, an adapter over
+        ``game.evals``"""
+        record = game.record
+        game_evals = game.evals
+        board = record.board()
+        moves = record.moves
+        
+        # Material and phase per position, so stats never replay the game
+        phases = phase_timeline(board, moves)
+        analysis = {
+            "engine": game.engine_name,
+            "mistakes": [],
+            "evals": [],
+            "depths": [],
+            "material": phases["material"],
+            "phases": phases["phases"],
+            "summary": {
+                "endgame_start": phases["endgame_start"],
+                "white_mistakes": 0,
+                "black_mistakes": 0,
+                "worst_mistake": None,
+                "critical_moments": []
+            }
+        }
+        
+        max_eval_diff = 0
+        worst_mistake = None
+        
+        # Evaluate each position once; the position after ply N is the
+        # position before ply N + 1, so the timeline has len(nodes) + 1 entries.
+        # Plies are classified as soon as the position after them is known.
+        evals = []
+        if multipv and moves:
+            plies = iter_multipv_plies_async(
+                engine, board, moves, depth, config.MULTIPV_LINES, evals, cache
+            )
+        elif adaptive:
+            adaptive_evals, deepened = await adaptive_mainline_evals_async(
+                engine, board, moves, depth, cache=cache
+            )
+            analysis["summary"]["deepened_plies"] = deepened
+            plies = timeline_plies_async(iter_async(adaptive_evals), evals)
+        else:
+            plies = timeline_plies_async(
+                iter_mainline_evals_async(engine, board, moves, depth, cache), evals
+            )
+        for ply, move in enumerate(moves):
+            eval_before, eval_after, best_move = await plies.__anext__()
+            player = "white" if board.turn == chess.WHITE else "black"
+            clock_time = record.clocks[ply]
+            
+            move_number = board.fullmove_number
+            fen_before = board.fen()
+            move_san = board.san(move)
+            best_san = board.san(best_move) if best_move else None
+            board.push(move)
+            
+            eval_diff = abs(eval_after - eval_before)
+            
+            # Classify mistake
+            mistake_type = classify_eval_diff(eval_diff)
+            
+            mistake = None
+            if mistake_type:
+                mistake = {
+                    "move_number": move_number,
+                    "player": player,
+                    "fen_before": fen_before,
+                    "fen_after": board.fen(),
+                    "eval_before": eval_before,
+                    "eval_after": eval_after,
+                    "eval_diff": eval_diff,
+                    "mistake_type": mistake_type.value,
+                    "clock_time": clock_time,
+                    "move_san": move_san,
+                    "best_move": best_san,
+                    "phase": phases["phases"][ply]
+                }
+                
+                analysis["mistakes"].append(mistake)
+                
+                if player == "white":
+                    analysis["summary"]["white_mistakes"] += 1
+                else:
+                    analysis["summary"]["black_mistakes"] += 1
+                
+                if eval_diff > max_eval_diff:
+                    max_eval_diff = eval_diff
+                    worst_mistake = mistake
+            
+            if progress:
+                progress(ply + 1, len(moves), mistake)
+        
+        # Exhaust the evals so newly searched positions reach the cache
+        async for _ in plies:
+            pass
+        analysis["evals"] = evals
+        analysis["depths"] = [game_evals.depths.get(key, 0) for key in game.keys]
+        analysis["summary"]["reused_evals"] = len(game_evals.reused)
+        
+        analysis["summary"]["worst_mistake"] = worst_mistake
+        analysis["summary"]["critical_moments"] = self._find_critical_moments(
+            evals, record.board()
+        )
+        return analysis
+    
+    def store_analysis(self, game_id: str, analysis: Dict[str, Any]):
+        """Save an analysis made by analyze_record as the game's current one"""
+        record, _ = self.read_game(game_id)
+        self._store_analysis(game_id, record, analysis)
+    
+    def _store_analysis(self, game_id: str, record: GameRecord, analysis: Dict[str, Any]):
+        facts = game_facts(record, self.player_stats.opening_analyzer, analysis)
+        
+        # Save analysis, its mistake rows and the players' aggregates to DB in
+        # one transaction. IMMEDIATE takes the write lock before we read the
+        # previous analysis, so concurrent analyses cannot lose stat updates.
+        with get_connection(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            previous = conn.execute(
+                "SELECT analyzed, analysis, analysis_json, stats_counted FROM games WHERE id = ?",
+                (game_id,)
+            ).fetchone()
+            old_analysis = load_analysis(previous[1], previous[2]) if previous[0] else None
+            if not previous[3]:
+                # Not yet counted by fill_player_stats: count the game itself
+                # now, and there is no previous analysis to take back out
+                self.player_stats.record_imports(conn, [import_facts(record.headers)])
+                old_analysis = None
+            
+            conn.execute("""
+                UPDATE games SET analyzed = 1, analysis = ?, analysis_json = NULL,
+                                 version = version + 1, updated_at = ?, stats_counted = 1
+                WHERE id = ?
+            """, (encode_analysis(analysis), datetime.now().isoformat(), game_id))
+            self._replace_mistakes(conn, game_id, analysis["mistakes"])
+            self.player_stats.apply_analysis(conn, facts, old_analysis, analysis)
+        
+        response_cache.invalidate(
+            ("review", game_id),
+            *(("stats", name) for name in (facts["white"], facts["black"]) if name)
+        )
+    
+    def _game_evals(self, previous: Optional[Mapping[str, Any]], keys: List[int],
+                    engine_name: Optional[str]) -> GameEvals:
+        """Eval source for a (re-)analysis, seeded with the evals and depths of
+        the game's previous analysis when the same engine produced them"""
+        if (previous is not None and previous.get("engine") == engine_name
+                and len(previous.get("depths", ())) == len(keys)):
+            return GameEvals(keys, previous["evals"], previous["depths"], self.eval_cache)
+        return GameEvals(keys, [], [], self.eval_cache)
+    
+    @staticmethod
+    def _replace_mistakes(conn: sqlite3.Connection, game_id: str, mistakes: List[Dict]):
+        """Rewrite the mistakes rows of a game (re-analysis replaces old rows)"""
+        conn.execute("DELETE FROM mistakes WHERE game_id = ?", (game_id,))
+        conn.executemany("""
+            INSERT INTO mistakes (
+                game_id, move_number, fen_before, fen_after, player_color,
+                eval_before, eval_after, eval_diff, mistake_type, clock_time, best_move,
+                position_key
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (game_id, m["move_number"], m["fen_before"], m["fen_after"], m["player"],
+             m["eval_before"], m["eval_after"], m["eval_diff"], m["mistake_type"],
+             m["clock_time"], m.get("best_move"), fen_position_key(m["fen_before"]))
+            for m in mistakes
+        ])
+    
+    def fill_position_keys(self, batch_size: int = 5000) -> Dict[str, int]:
+        """Key the mistakes rows stored before position keys existed"""
+        mistakes = 0
+        last_id = 0
+        while True:
+            # One transaction per batch keeps the write lock short
+            with get_connection(self.db_path) as conn:
+                rows = conn.execute("""
+                    SELECT id, fen_before FROM mistakes
+                    WHERE id > ? AND position_key IS NULL
+                    ORDER BY id LIMIT ?
+                """, (last_id, batch_size)).fetchall()
+                conn.executemany(
+                    "UPDATE mistakes SET position_key = ? WHERE id = ?",
+                    [(fen_position_key(fen), mistake_id) for mistake_id, fen in rows if fen]
+                )
+                mistakes += sum(1 for _, fen in rows if fen)
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1][0]
+        
+        return {"mistakes": mistakes}
+    
+    def backfill_mistakes(self, batch_size: int = 500) -> Dict[str, int]:
+        """Populate mistakes rows from stored analyses for games analyzed
+        before mistakes were written at analysis time"""
+        games = mistakes = 0
+        last_rowid = 0
+        while True:
+            # One transaction per batch keeps the write lock short
+            with get_connection(self.db_path) as conn:
+                rows = conn.execute("""
+                    SELECT rowid, id, analysis, analysis_json FROM games
+                    WHERE rowid > ? AND analyzed = 1
+                    AND (analysis IS NOT NULL OR analysis_json IS NOT NULL)
+                    AND NOT EXISTS (SELECT 1 FROM mistakes m WHERE m.game_id = games.id)
+                    ORDER BY rowid LIMIT ?
+                """, (last_rowid, batch_size)).fetchall()
+                for _, game_id, blob, analysis_json in rows:
+                    analysis = load_analysis(blob, analysis_json)
+                    if not analysis.get("mistakes"):
+                        continue
+                    self._replace_mistakes(conn, game_id, analysis["mistakes"])
+                    games += 1
+                    mistakes += len(analysis["mistakes"])
+            if len(rows) < batch_size:
+                break
+            last_rowid = rows[-1][0]
+        
+        return {"games": games, "mistakes": mistakes}
+    
+    def encode_stored_games(self, batch_size: int = 500) -> Dict[str, int]:
+        """Store the pre-parsed headers, moves and clocks of games imported
+        before they were written at import time"""
+        games = failed = 0
+        last_rowid = 0
+        while True:
+            # One transaction per batch keeps the write lock short
+            with get_connection(self.db_path) as conn:
+                rows = conn.execute("""
+                    SELECT rowid, pgn FROM games
+                    WHERE rowid > ? AND (moves IS NULL OR headers_json IS NULL)
+                    ORDER BY rowid LIMIT ?
+                """, (last_rowid, batch_size)).fetchall()
+                for rowid, pgn in rows:
+                    record = read_game_record(io.StringIO(pgn))
+                    if record is None:
+                        failed += 1
+                        continue
+                    conn.execute(
+                        "UPDATE games SET headers_json = ?, moves = ?, clocks = ? WHERE rowid = ?",
+                        (*record.encode(), rowid)
+                    )
+                    games += 1
+            if len(rows) < batch_size:
+                break
+            last_rowid = rows[-1][0]
+        
+        return {"games": games, "failed": failed}
+    
+    def compress_analyses(self, batch_size: int = 500) -> Dict[str, int]:
+        """Re-store analyses saved as JSON text in the binary format"""
+        games = json_bytes = encoded_bytes = 0
+        last_rowid = 0
+        while True:
+            # One transaction per batch keeps the write lock short and the
+            # JSON of a large database out of memory
+            with get_connection(self.db_path) as conn:
+                rows = conn.execute("""
+                    SELECT rowid, analysis_json FROM games
+                    WHERE rowid > ? AND analysis_json IS NOT NULL
+                    ORDER BY rowid LIMIT ?
+                """, (last_rowid, batch_size)).fetchall()
+                for rowid, analysis_json in rows:
+                    blob = encode_analysis(json.loads(analysis_json))
+                    conn.execute(
+                        "UPDATE games SET analysis = ?, analysis_json = NULL WHERE rowid = ?",
+                        (blob, rowid)
+                    )
+                    games += 1
+                    json_bytes += len(analysis_json.encode())
+                    encoded_bytes += len(blob)
+            if len(rows) < batch_size:
+                break
+            last_rowid = rows[-1][0]
+        
+        return {"games": games, "json_bytes": json_bytes, "encoded_bytes": encoded_bytes}
+    
+    def fill_player_stats(self, batch_size: int = 500) -> Dict[str, int]:
+        """Count the games not yet in the player_stats table: those stored
+        before it existed, or after a reset by rebuild_player_stats"""
+        games = analyzed = 0
+        last_rowid = 0
+        while True:
+            # IMMEDIATE so a game analyzed meanwhile is counted once, either
+            # here or by _store_analysis, and concurrent fills never overlap
+            with get_connection(self.db_path) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute("""
+                    SELECT rowid, pgn, headers_json, moves, clocks, analyzed,
+                           analysis, analysis_json
+                    FROM games WHERE stats_counted = 0 AND rowid > ?
+                    ORDER BY rowid LIMIT ?
+                """, (last_rowid, batch_size)).fetchall()
+                imports = []
+                for (_, pgn, headers_json, moves, clocks, is_analyzed,
+                     blob, analysis_json) in rows:
+                    record = load_game_record(pgn, headers_json, moves, clocks)
+                    if record is None:
+                        continue
+                    imports.append(import_facts(record.headers))
+                    analysis = load_analysis(blob, analysis_json) if is_analyzed else None
+                    if analysis is not None:
+                        facts = game_facts(record, self.player_stats.opening_analyzer, analysis)
+                        self.player_stats.apply_analysis(conn, facts, None, analysis)
+                        analyzed += 1
+                self.player_stats.record_imports(conn, imports)
+                games += len(imports)
+                conn.executemany(
+                    "UPDATE games SET stats_counted = 1 WHERE rowid = ?",
+                    [(row[0],) for row in rows]
+                )
+            if len(rows) < batch_size:
+                break
+            last_rowid = rows[-1][0]
+        
+        if games:
+            response_cache.clear()
+        return {"games": games, "analyzed": analyzed}
+    
+    def rebuild_player_stats(self, batch_size: int = 500) -> Dict[str, int]:
+        """Recompute the player_stats table from scratch from all stored games.
+        
+        Players read as partly counted until the last batch is in.
+        """
+        with get_connection(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self.player_stats.reset(conn)
+            conn.execute("UPDATE games SET stats_counted = 0")
+        
+        result = self.fill_player_stats(batch_size)
+        with get_connection(self.db_path) as conn:
+            conn.execute("DELETE FROM player_stats WHERE total_games = 0")
+        
+        response_cache.clear()
+        return result
+    
+    def _find_critical_moments(self, evals: List[float], start: chess.Board) -> List[Dict]:
+        """Game phases with sustained eval swings, from the per-ply eval timeline"""
+        return CriticalityAnalyzer.calculate_criticality(
+            evals, start.fullmove_number, start.turn == chess.BLACK
+        )
+    
+    def get_player_stats(self, username: str) -> Dict[str, Any]:
+        # Implement player statistics aggregation
+        pass
@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 from typing import Optional
@@ -16,9 +17,70 @@ class Config:
         self.ENGINE_DEPTH = int(os.getenv("ANALYSIS_DEPTH", 18))
         self.ENGINE_THREADS = int(os.getenv("ENGINE_THREADS", 2))
         self.ENGINE_HASH = int(os.getenv("ENGINE_HASH", 256))  # MB
+        self.ENGINE_POOL_SIZE = int(os.getenv("ENGINE_POOL_SIZE", 2))
+        self.ENGINE_ACQUIRE_TIMEOUT = float(os.getenv("ENGINE_ACQUIRE_TIMEOUT", 300))  # seconds
+        
+        # Adaptive analysis: shallow sweep, full depth only on suspicious plies.
+        # A ply is re-searched when its shallow swing reaches
+        # ADAPTIVE_MARGIN x the inaccuracy threshold.
+        self.ADAPTIVE_ANALYSIS = os.getenv("ADAPTIVE_ANALYSIS", "0") == "1"
+        self.ADAPTIVE_SHALLOW_DEPTH = int(os.getenv("ADAPTIVE_SHALLOW_DEPTH", 10))
+        self.ADAPTIVE_MARGIN = float(os.getenv("ADAPTIVE_MARGIN", 0.6))
+        
+        # MultiPV analysis: one search of MULTIPV_LINES lines per position
+        # scores both the best and the played move, and names the best move
+        self.MULTIPV_ANALYSIS = os.getenv("MULTIPV_ANALYSIS", "0") == "1"
+        self.MULTIPV_LINES = int(os.getenv("MULTIPV_LINES", 4))
+        
+        # Batch analysis worker processes (each runs one engine)
+        self.BATCH_WORKERS = int(os.getenv(
+            "BATCH_WORKERS", max(1, (os.cpu_count() or 1) // self.ENGINE_THREADS)
+        ))
+        
+        # Finished analysis jobs kept in memory for polling
+        self.JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", 1000))
+        
+        # "local" runs analysis jobs in the web process; "db" only queues them in
+        # the analysis_jobs table for worker.py processes to claim, either on the
+        # database directly or, from any machine, through the web app's /queue
+        # API (worker.py --server), which requires JOB_API_TOKEN when it is set.
+        # Workers heartbeat every JOB_HEARTBEAT_SECONDS; a job whose lease lapses
+        # is claimed again, up to JOB_MAX_ATTEMPTS claims in all.
+        self.JOB_QUEUE = os.getenv("JOB_QUEUE", "local")
+        self.JOB_API_TOKEN = os.getenv("JOB_API_TOKEN", "")
+        self.JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+        self.JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 5))
+        self.JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+        self.JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))  # seconds
+        
+        # Position evaluation cache (max rows in position_evals, 0 disables)
+        self.EVAL_CACHE_SIZE = int(os.getenv("EVAL_CACHE_SIZE", 1_000_000))
+        
+        # Rendered stats/review responses kept in memory (entries, total bytes; 0 disables)
+        self.RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+        self.RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", 32 * 1024 * 1024))
+        
+        # Rows per page of the list endpoints, unless ?limit= asks otherwise
+        self.PAGE_SIZE = int(os.getenv("PAGE_SIZE", 50))
+        self.MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 1000))
+        
+        # Games per transaction when importing PGN files
+        self.IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 5000))
+        
+        # Time-pressure bin edges in seconds, as JSON keyed by speed (bullet,
+        # blitz, rapid, classical) or exact time control (e.g. {"3+2": [0, 15, 45]})
+        # Aggregated stats keep their bins until init_db.py --rebuild-player-stats
+        self.TIME_PRESSURE_BINS = json.loads(os.getenv("TIME_PRESSURE_BINS", "{}"))
+        
+        # ECO opening table: a .tsv file or a directory of them (eco, name, pgn columns)
+        self.ECO_PATH = Path(os.getenv("ECO_PATH", Path(__file__).parent / "data"))
         
         # Database configuration
         self.DATABASE_URL = f"sqlite:///{self.DATA_DIR}/chess_games.db"
+        self.DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", 10))  # seconds
+        self.DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", 65536))
+        self.DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024))  # bytes
+        self.DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", 256))
         
         # Create directories if they don't exist
         self._create_directories()
@@ -33,7 +95,8 @@ class Config:
         return {
             "depth": self.ENGINE_DEPTH,
             "threads": self.ENGINE_THREADS,
-            "hash": self.ENGINE_HASH
+            "hash": self.ENGINE_HASH,
+            "pool_size": self.ENGINE_POOL_SIZE
         }
     
     def verify_stockfish(self) -> bool:
@@ -0,0 +1,55 @@
+# db.py
+import os
+import sqlite3
+import threading
+
+from config import config
+
+_local = threading.local()
+
+
+def _configure(conn: sqlite3.Connection):
+    # WAL lets readers run alongside the analysis writer; it is persistent,
+    # but setting it again on an already-WAL database is a no-op
+    conn.execute("PRAGMA journal_mode = WAL")
+    # NORMAL is durable across application crashes in WAL mode and avoids an
+    # fsync on every commit
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {int(config.DB_BUSY_TIMEOUT * 1000)}")
+    # Negative cache_size is in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size = -{config.DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {config.DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+
+def get_connection(db_path: str) -> sqlite3.Connection:
+    """Return this thread's long-lived, tuned connection to ``db_path``.
+
+    Use it as ``with get_connection(path) as conn:`` - the block commits or
+    rolls back like a fresh connection would, but the connection (and its
+    prepared statement cache) stays open for the next call on this thread.
+    """
+    connections = getattr(_local, "connections", None)
+    # A forked child must not reuse its parent's SQLite handles
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(
+            db_path,
+            timeout=config.DB_BUSY_TIMEOUT,
+            cached_statements=config.DB_STATEMENT_CACHE
+        )
+        _configure(conn)
+        connections[db_path] = conn
+    return conn
+
+
+def close_connections():
+    """Close every connection opened by the calling thread"""
+    connections = getattr(_local, "connections", None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
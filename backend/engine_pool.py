@@ -0,0 +1,222 @@
+# engine_pool.py
+import asyncio
+import atexit
+import contextlib
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import chess.engine
+
+from config import config
+from metrics import ENGINE_NODES, ENGINE_SEARCH_NODES, ENGINE_SEARCH_SECONDS
+
+
+def record_search(info, seconds: float):
+    """Observe one engine search in the engine metrics"""
+    ENGINE_SEARCH_SECONDS.observe(seconds)
+    # With multipv a list of lines comes back; nodes are per search
+    nodes = (info[0] if isinstance(info, list) else info).get("nodes")
+    if nodes is not None:
+        ENGINE_SEARCH_NODES.observe(nodes)
+        ENGINE_NODES.inc(nodes)
+
+
+class EngineLease:
+    """An engine checked out of the pool for the analysis of one game"""
+
+    def __init__(self, engine: chess.engine.SimpleEngine):
+        self.engine = engine
+        # python-chess sends ``ucinewgame`` whenever the game key changes,
+        # so a fresh key per checkout resets the engine between games.
+        self.game = object()
+
+    def analyse(self, board: chess.Board, limit: chess.engine.Limit, **kwargs):
+        kwargs.setdefault("game", self.game)
+        start = time.perf_counter()
+        info = self.engine.analyse(board, limit, **kwargs)
+        record_search(info, time.perf_counter() - start)
+        return info
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.engine, name)
+
+
+def _popen_daemon(engine_path: str) -> chess.engine.SimpleEngine:
+    """Start a SimpleEngine whose event loop thread is a daemon.
+
+    Threads inherit the daemon flag of the thread that starts them, and
+    SimpleEngine starts its loop thread from the calling thread. A non-daemon
+    loop thread would be joined at interpreter exit *before* atexit hooks run,
+    so exit would hang on pooled engines instead of closing them.
+    """
+    result: Dict[str, Any] = {}
+
+    def popen():
+        try:
+            result["engine"] = chess.engine.SimpleEngine.popen_uci(engine_path)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=popen, name="engine-popen", daemon=True)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["engine"]
+
+
+class EnginePool:
+    """Bounded pool of long-lived UCI engine processes"""
+
+    def __init__(self, engine_path: str, size: Optional[int] = None,
+                 options: Optional[Dict[str, Any]] = None):
+        self.engine_path = engine_path
+        self.size = size or config.ENGINE_POOL_SIZE
+        self.options = options if options is not None else {
+            "Threads": config.ENGINE_THREADS,
+            "Hash": config.ENGINE_HASH
+        }
+        # Used as a stack, so the most recently used (warmest) engine is handed out first
+        self._idle: List[chess.engine.SimpleEngine] = []
+        self._created = 0
+        # Notified whenever an engine is returned or a slot frees up
+        self._available = threading.Condition()
+        self._closed = False
+        # "id name" reported by the binary, known once an engine has started
+        self.engine_name: Optional[str] = None
+
+    def _spawn(self) -> chess.engine.SimpleEngine:
+        engine = _popen_daemon(self.engine_path)
+        self.engine_name = engine.id.get("name")
+        supported = {
+            name: value for name, value in self.options.items()
+            if name in engine.options
+        }
+        if supported:
+            engine.configure(supported)
+        return engine
+
+    def _free_slot(self):
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    def _spawn_into_slot(self) -> chess.engine.SimpleEngine:
+        try:
+            return self._spawn()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _discard(self, engine: chess.engine.SimpleEngine):
+        self._free_slot()
+        try:
+            engine.quit()
+        except Exception:
+            try:
+                engine.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_healthy(engine: chess.engine.SimpleEngine) -> bool:
+        try:
+            engine.ping()
+            return True
+        except (chess.engine.EngineError, asyncio.TimeoutError, TimeoutError):
+            return False
+
+    def acquire(self, timeout: Optional[float] = None) -> chess.engine.SimpleEngine:
+        """Check out an engine, spawning one if the pool is not yet full"""
+        if timeout is None:
+            timeout = config.ENGINE_ACQUIRE_TIMEOUT
+
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._available:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Engine pool is closed")
+                    if self._idle:
+                        engine = self._idle.pop()
+                        break
+                    if self._created < self.size:
+                        # Reserve the slot; the engine is spawned outside the lock
+                        self._created += 1
+                        engine = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No engine became available within {timeout}s")
+                    self._available.wait(remaining)
+
+            if engine is None:
+                return self._spawn_into_slot()
+
+            if self._is_healthy(engine):
+                return engine
+
+            # Crashed or hung engine: drop it and let the loop spawn a replacement
+            self._discard(engine)
+
+    def release(self, engine: chess.engine.SimpleEngine, healthy: bool = True):
+        """Return an engine to the pool, discarding it if it is unusable"""
+        with self._available:
+            if not self._closed and healthy:
+                self._idle.append(engine)
+                self._available.notify()
+                return
+        self._discard(engine)
+
+    @contextlib.contextmanager
+    def engine(self, timeout: Optional[float] = None) -> Iterator[EngineLease]:
+        engine = self.acquire(timeout)
+        healthy = True
+        try:
+            yield EngineLease(engine)
+        except chess.engine.EngineError:
+            healthy = False
+            raise
+        finally:
+            self.release(engine, healthy)
+
+    def identify(self) -> Optional[str]:
+        """Engine name and version, starting an engine if none has run yet"""
+        if self.engine_name is None:
+            with self.engine():
+                pass
+        return self.engine_name
+    
+    def close(self):
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            # Waiters fail fast instead of sitting out their timeout
+            self._available.notify_all()
+        for engine in idle:
+            self._discard(engine)
+
+
+_pools: Dict[str, EnginePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_engine_pool(engine_path: str) -> EnginePool:
+    """Return the shared pool for an engine binary, creating it on first use"""
+    with _pools_lock:
+        pool = _pools.get(engine_path)
+        if pool is None:
+            pool = _pools[engine_path] = EnginePool(engine_path)
+        return pool
+
+
+def close_engine_pools():
+    """Quit every pooled engine; runs at interpreter exit"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+atexit.register(close_engine_pools)
@@ -0,0 +1,193 @@
+# eval_cache.py
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import chess
+import chess.polyglot
+
+from config import config
+from db import get_connection
+
+# SQLite placeholders per IN (...) lookup, well below SQLITE_MAX_VARIABLE_NUMBER
+_LOOKUP_CHUNK = 500
+# How many stored positions between checks of the table size
+_EVICT_CHECK_INTERVAL = 1000
+
+
+def position_key(board: chess.Board) -> int:
+    """Zobrist hash of a position as a signed 64-bit SQLite integer.
+
+    The hash covers pieces, side to move, castling rights and en passant but
+    not the move counters, so transpositions share a key.
+    """
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def fen_position_key(fen: str) -> int:
+    """position_key of a FEN; positions equal up to the move counters match"""
+    return position_key(chess.Board(fen))
+
+
+def mainline_keys(board: chess.Board, moves: List[chess.Move]) -> List[int]:
+    """Cache keys of the len(moves) + 1 positions along a mainline"""
+    board = board.copy(stack=False)
+    keys = [position_key(board)]
+    for move in moves:
+        board.push(move)
+        keys.append(position_key(board))
+    return keys
+
+
+class EvalCache:
+    """Persistent evaluation cache in the ``position_evals`` table"""
+
+    def __init__(self, db_path: str, max_entries: Optional[int] = None):
+        self.db_path = db_path
+        self.max_entries = config.EVAL_CACHE_SIZE if max_entries is None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_check = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def lookup(self, keys: Iterable[int], depth: int) -> Dict[int, float]:
+        """Return cached scores for every key searched to at least ``depth``"""
+        keys = list(dict.fromkeys(keys))
+        found: Dict[int, float] = {}
+        if not self.enabled or not keys:
+            return found
+
+        with get_connection(self.db_path) as conn:
+            for i in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[i:i + _LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT position_hash, score FROM position_evals "
+                    f"WHERE depth >= ? AND position_hash IN ({placeholders})",
+                    (depth, *chunk)
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE position_evals SET last_used = ? WHERE position_hash = ?",
+                    [(now, key) for key in found]
+                )
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, entries: List[Tuple[int, int, float]]):
+        """Store ``(key, depth, score)`` entries, keeping the deepest search"""
+        if not self.enabled or not entries:
+            return
+
+        now = time.time()
+        with get_connection(self.db_path) as conn:
+            conn.executemany("""
+                INSERT INTO position_evals (position_hash, depth, score, last_used)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(position_hash) DO UPDATE SET
+                    depth = excluded.depth,
+                    score = excluded.score,
+                    last_used = excluded.last_used
+                WHERE excluded.depth >= position_evals.depth
+            """, [(key, depth, score, now) for key, depth, score in entries])
+
+            with self._lock:
+                self._writes_since_check += len(entries)
+                check = self._writes_since_check >= _EVICT_CHECK_INTERVAL
+                if check:
+                    self._writes_since_check = 0
+            if check:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Drop the least recently used entries once the table is over size"""
+        count = conn.execute("SELECT COUNT(*) FROM position_evals").fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        # Evict down to 90% so we do not run this on every subsequent write
+        excess = count - int(self.max_entries * 0.9)
+        conn.execute("""
+            DELETE FROM position_evals WHERE position_hash IN (
+                SELECT position_hash FROM position_evals
+                ORDER BY last_used LIMIT ?
+            )
+        """, (excess,))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "max_entries": self.max_entries
+        }
+
+
+class GameEvals:
+    """A game's stored per-position evals, layered over the shared cache.
+
+    Has the ``lookup``/``store`` interface of EvalCache, so the mainline eval
+    functions take it in place of the cache. Positions the previous analysis
+    searched deep enough are answered from it even when the shared cache has
+    evicted them, and the depth behind every position answered or stored is
+    kept in ``depths`` so the new analysis can persist it.
+    """
+
+    def __init__(self, keys: List[int], evals: Iterable[float], depths: Iterable[int],
+                 cache: Optional[EvalCache] = None):
+        self.known: Dict[int, Tuple[int, float]] = {
+            key: (depth, score) for key, score, depth in zip(keys, evals, depths) if depth
+        }
+        self.cache = cache
+        self.depths: Dict[int, int] = {}
+        # Positions answered from the previous analysis
+        self.reused: Set[int] = set()
+
+    def covers(self, keys: Iterable[int], depth: int) -> bool:
+        """Whether every position is already known at >= ``depth``"""
+        return all(self.known.get(key, (0,))[0] >= depth for key in keys)
+
+    def _searched(self, key: int, depth: int):
+        self.depths[key] = max(self.depths.get(key, 0), depth)
+
+    def lookup(self, keys: Iterable[int], depth: int) -> Dict[int, float]:
+        found: Dict[int, float] = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            known = self.known.get(key)
+            if known and known[0] >= depth:
+                found[key] = known[1]
+                self._searched(key, known[0])
+                self.reused.add(key)
+            else:
+                missing.append(key)
+
+        if self.cache and missing:
+            cached = self.cache.lookup(missing, depth)
+            for key in cached:
+                # The cache only promises at least this depth
+                self._searched(key, depth)
+            found.update(cached)
+        return found
+
+    def store(self, entries: List[Tuple[int, int, float]]):
+        for key, depth, score in entries:
+            self.known[key] = (depth, score)
+            self._searched(key, depth)
+        if self.cache:
+            self.cache.store(entries)
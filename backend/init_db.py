@@ -1,7 +1,49 @@
 # init_db.py
+import argparse
+
 from app import analyzer
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Initialize or migrate the chess games database")
+    parser.add_argument("--backfill-mistakes", action="store_true",
+                        help="fill the mistakes table from existing stored analyses")
+    parser.add_argument("--compress-analyses", action="store_true",
+                        help="convert analyses stored as JSON text to the binary format")
+    parser.add_argument("--fill-position-keys", action="store_true",
+                        help="key mistakes stored before common mistakes were grouped by position")
+    parser.add_argument("--encode-moves", action="store_true",
+                        help="store pre-parsed moves for games imported from raw PGN only")
+    parser.add_argument("--rebuild-player-stats", action="store_true",
+                        help="recompute the player_stats aggregates from all games")
+    args = parser.parse_args()
+    
     print("Initializing database...")
     analyzer._init_db()
-    print("Database initialized successfully!")
\ No newline at end of file
+    print("Database initialized successfully!")
+    
+    if args.backfill_mistakes:
+        print("Backfilling mistakes from stored analyses...")
+        result = analyzer.backfill_mistakes()
+        print(f"Inserted {result['mistakes']} mistakes for {result['games']} games")
+    
+    if args.fill_position_keys:
+        print("Keying stored mistakes by position...")
+        result = analyzer.fill_position_keys()
+        print(f"Keyed {result['mistakes']} mistakes")
+    
+    if args.encode_moves:
+        print("Encoding stored games...")
+        result = analyzer.encode_stored_games()
+        print(f"Encoded {result['games']} games ({result['failed']} unreadable)")
+    
+    if args.compress_analyses:
+        print("Compressing stored analyses...")
+        result = analyzer.compress_analyses()
+        print(f"Converted {result['games']} analyses: "
+              f"{result['json_bytes']} -> {result['encoded_bytes']} bytes")
+        print("Run VACUUM on the database to return the freed pages to the filesystem")
+    
+    if args.rebuild_player_stats:
+        print("Rebuilding player statistics...")
+        result = analyzer.rebuild_player_stats()
+        print(f"Aggregated {result['games']} games ({result['analyzed']} analyzed)")
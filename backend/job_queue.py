@@ -0,0 +1,492 @@
+# job_queue.py
+"""Durable analysis job queue in the ``analysis_jobs`` table.
+
+With ``JOB_QUEUE=db`` the web app only queues analyses, and any number of
+``worker.py`` processes claim and run them. A claim is a lease: the worker
+heartbeats while it analyzes, and a job whose lease lapses (its worker died
+or hung) goes to the next worker that asks, up to ``JOB_MAX_ATTEMPTS``
+claims in all. Claims run in a write-locked transaction and every other
+transition is a conditional UPDATE on the leasing worker, so two workers can
+never both hold a lease on the same job.
+
+Workers only see the queue through ``WorkerQueue``: claim a job, read its
+game, heartbeat, and complete it with the analysis, which the queue stores
+as the game's current one. ``JobQueue`` does that on the database directly,
+for workers on the database's host (SQLite's WAL does not work over a
+network filesystem). ``RemoteJobQueue`` does it over the web app's
+``/queue`` API (see queue_api.py), so workers can run on any machine that
+reaches the web app and capacity grows with the machines added.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import chess
+
+from analysis_engine import run_in_thread
+from analysis_format import decode_analysis, encode_analysis
+from config import config
+from db import get_connection
+from jobs import AnalysisJob, JobStatus
+from move_encoding import GameRecord
+
+logger = logging.getLogger(__name__)
+
+_JOB_COLUMNS = """
+    id, game_id, depth, adaptive, multipv, status, plies_done, plies_total,
+    mistakes_json, error, created_at, started_at, finished_at, version
+"""
+
+
+# Seconds a worker waits on one request to the web app
+_HTTP_TIMEOUT = 30.0
+
+
+class WorkerQueue:
+    """What a worker needs from the queue; see JobQueue and RemoteJobQueue"""
+
+    def claim(self, worker_id: str) -> Optional[AnalysisJob]:
+        raise NotImplementedError
+
+    def game(self, job: AnalysisJob) -> Tuple[GameRecord, Optional[Mapping[str, Any]]]:
+        """The job's game and its current analysis, to seed the new one"""
+        raise NotImplementedError
+
+    def heartbeat(self, job_id: str, worker_id: str, plies_done: int, plies_total: int,
+                  mistakes: List[Dict]) -> bool:
+        raise NotImplementedError
+
+    def complete(self, job_id: str, worker_id: str, plies_done: int, plies_total: int,
+                 mistakes: List[Dict], result: Dict[str, Any]):
+        raise NotImplementedError
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = True):
+        raise NotImplementedError
+
+    def release(self, job_id: str, worker_id: str):
+        raise NotImplementedError
+
+
+class JobQueue(WorkerQueue):
+    """Jobs in the database, with the interface of JobManager for the web
+    routes and the WorkerQueue one for workers"""
+
+    def __init__(self, analyzer, lease_seconds: Optional[float] = None,
+                 max_attempts: Optional[int] = None, history: Optional[int] = None):
+        self.analyzer = analyzer
+        self.db_path = analyzer.db_path
+        self.lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+        self.max_attempts = max_attempts or config.JOB_MAX_ATTEMPTS
+        self.history = history or config.JOB_HISTORY_SIZE
+
+    @staticmethod
+    def _to_job(row) -> AnalysisJob:
+        return AnalysisJob(
+            id=row[0], game_id=row[1], depth=row[2], adaptive=bool(row[3]),
+            multipv=bool(row[4]), status=JobStatus(row[5]), plies_done=row[6],
+            plies_total=row[7], mistakes=json.loads(row[8]), error=row[9],
+            created_at=row[10], started_at=row[11], finished_at=row[12], version=row[13]
+        )
+
+    # Web side
+
+    def submit(self, game_id: str, depth: int, adaptive: bool = False,
+               multipv: bool = False) -> AnalysisJob:
+        job = AnalysisJob(id=uuid.uuid4().hex, game_id=game_id, depth=depth,
+                          adaptive=adaptive, multipv=multipv)
+        with get_connection(self.db_path) as conn:
+            conn.execute("""
+                INSERT INTO analysis_jobs (id, game_id, depth, adaptive, multipv, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (job.id, game_id, depth, adaptive, multipv, job.status.value, job.created_at))
+            # Forget the oldest finished jobs once over the history limit
+            conn.execute("""
+                DELETE FROM analysis_jobs WHERE id IN (
+                    SELECT id FROM analysis_jobs WHERE status IN ('done', 'failed')
+                    ORDER BY finished_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.history,))
+        return job
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        with get_connection(self.db_path) as conn:
+            row = conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM analysis_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._to_job(row) if row else None
+
+    def snapshot(self, job: AnalysisJob, include_result: bool = True) -> Dict[str, Any]:
+        current = self.get(job.id) or job
+        if include_result and current.status is JobStatus.DONE:
+            # Only read for finished jobs; progress polls never load it
+            with get_connection(self.db_path) as conn:
+                row = conn.execute(
+                    "SELECT result FROM analysis_jobs WHERE id = ?", (current.id,)
+                ).fetchone()
+            if row and row[0] is not None:
+                current.result = decode_analysis(row[0]).to_dict()
+        return current.to_dict(include_result)
+
+    def wait_for_update(self, job: AnalysisJob, version: int,
+                        timeout: float = 15.0) -> int:
+        """Poll until the job changes past ``version`` (or timeout); return its version"""
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.get(job.id)
+            if current is None or current.version != version or current.finished:
+                return current.version if current else version
+            if time.monotonic() >= deadline:
+                return version
+            time.sleep(config.JOB_POLL_INTERVAL)
+
+    def counts(self) -> Dict[str, int]:
+        counts = {status.value: 0 for status in JobStatus}
+        with get_connection(self.db_path) as conn:
+            counts.update(conn.execute(
+                "SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status"
+            ).fetchall())
+        return counts
+
+    # Worker side
+
+    def claim(self, worker_id: str) -> Optional[AnalysisJob]:
+        """Lease the oldest queued job, or one whose worker stopped heartbeating"""
+        now = time.time()
+        with get_connection(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                UPDATE analysis_jobs
+                SET status = 'failed', error = 'Worker lost', finished_at = ?,
+                    lease_expires = NULL, version = version + 1
+                WHERE status = 'running' AND lease_expires < ? AND attempts >= ?
+            """, (now, now, self.max_attempts))
+            row = conn.execute("""
+                SELECT id FROM analysis_jobs
+                WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?)
+                ORDER BY created_at LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("""
+                UPDATE analysis_jobs
+                SET status = 'running', worker_id = ?, attempts = attempts + 1,
+                    lease_expires = ?, started_at = ?, plies_done = 0, mistakes_json = '[]',
+                    error = NULL, version = version + 1
+                WHERE id = ?
+            """, (worker_id, now + self.lease_seconds, now, row[0]))
+            row = conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM analysis_jobs WHERE id = ?", (row[0],)
+            ).fetchone()
+        return self._to_job(row) if row else None
+
+    def game(self, job: AnalysisJob) -> Tuple[GameRecord, Optional[Mapping[str, Any]]]:
+        return self.analyzer.read_game(job.game_id)
+
+    def heartbeat(self, job_id: str, worker_id: str, plies_done: int, plies_total: int,
+                  mistakes: List[Dict]) -> bool:
+        """Extend the lease and record progress; False if the lease was lost"""
+        with get_connection(self.db_path) as conn:
+            updated = conn.execute("""
+                UPDATE analysis_jobs
+                SET lease_expires = ?, plies_done = ?, plies_total = ?, mistakes_json = ?,
+                    version = version + 1
+                WHERE id = ? AND worker_id = ? AND status = 'running'
+            """, (time.time() + self.lease_seconds, plies_done, plies_total,
+                  json.dumps(mistakes), job_id, worker_id)).rowcount
+        return updated == 1
+
+    def complete(self, job_id: str, worker_id: str, plies_done: int, plies_total: int,
+                 mistakes: List[Dict], result: Dict[str, Any]):
+        """Store the analysis as the game's current one and finish the job
+        with its own copy, which later analyses of the game (e.g. at another
+        depth) do not replace"""
+        job = self.get(job_id)
+        if job is None:
+            # Dropped from the history meanwhile; the analysis still counts
+            return
+        # Stored even if the lease was lost: saving an analysis twice is harmless
+        self.analyzer.store_analysis(job.game_id, result)
+        with get_connection(self.db_path) as conn:
+            conn.execute("""
+                UPDATE analysis_jobs
+                SET status = 'done', finished_at = ?, lease_expires = NULL,
+                    plies_done = ?, plies_total = ?, mistakes_json = ?, result = ?,
+                    version = version + 1
+                WHERE id = ? AND worker_id = ? AND status = 'running'
+            """, (time.time(), plies_done, plies_total, json.dumps(mistakes),
+                  encode_analysis(result), job_id, worker_id))
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = True):
+        """Requeue a job whose analysis raised, or fail it for good when
+        ``retry`` is off or it has used up its attempts"""
+        with get_connection(self.db_path) as conn:
+            conn.execute("""
+                UPDATE analysis_jobs
+                SET status = CASE WHEN ? AND attempts < ? THEN 'queued' ELSE 'failed' END,
+                    finished_at = CASE WHEN ? AND attempts < ? THEN NULL ELSE ? END,
+                    error = ?, lease_expires = NULL, version = version + 1
+                WHERE id = ? AND worker_id = ? AND status = 'running'
+            """, (retry, self.max_attempts, retry, self.max_attempts, time.time(),
+                  error, job_id, worker_id))
+
+    def release(self, job_id: str, worker_id: str):
+        """Hand a job back unfinished (e.g. on shutdown) without using up an attempt"""
+        with get_connection(self.db_path) as conn:
+            conn.execute("""
+                UPDATE analysis_jobs
+                SET status = 'queued', attempts = attempts - 1, lease_expires = NULL,
+                    version = version + 1
+                WHERE id = ? AND worker_id = ? AND status = 'running'
+            """, (job_id, worker_id))
+
+
+class AsyncJobQueue:
+    """A JobQueue for the ASGI app, with its database calls run in threads so
+    they never block the event loop"""
+
+    def __init__(self, queue: JobQueue):
+        self.queue = queue
+
+    async def submit(self, game_id: str, depth: int, adaptive: bool = False,
+                     multipv: bool = False) -> AnalysisJob:
+        return await run_in_thread(self.queue.submit, game_id, depth, adaptive, multipv)
+
+    async def get(self, job_id: str) -> Optional[AnalysisJob]:
+        return await run_in_thread(self.queue.get, job_id)
+
+    async def snapshot(self, job: AnalysisJob, include_result: bool = True) -> Dict[str, Any]:
+        return await run_in_thread(self.queue.snapshot, job, include_result)
+
+    async def wait_for_update(self, job: AnalysisJob, version: int,
+                              timeout: float = 15.0) -> int:
+        """Poll until the job changes past ``version`` (or timeout); return its version"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            current = await run_in_thread(self.queue.get, job.id)
+            if current is None or current.version != version or current.finished:
+                return current.version if current else version
+            if loop.time() >= deadline:
+                return version
+            await asyncio.sleep(config.JOB_POLL_INTERVAL)
+
+    def counts(self) -> Dict[str, int]:
+        return self.queue.counts()
+
+    async def close(self):
+        # Jobs belong to the workers, so there is nothing to stop here
+        pass
+
+
+def game_to_wire(record: GameRecord, previous: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """A job's game as JSON for a remote worker, with only the parts of its
+    previous analysis that seed the new one (see ChessAnalyzer._game_evals)"""
+    return {
+        "headers": record.headers,
+        "moves": [move.uci() for move in record.moves],
+        "clocks": record.clocks,
+        "previous": None if previous is None else {
+            "engine": previous.get("engine"),
+            "evals": list(previous.get("evals", ())),
+            "depths": list(previous.get("depths", ()))
+        }
+    }
+
+
+def game_from_wire(data: Dict[str, Any]) -> Tuple[GameRecord, Optional[Dict[str, Any]]]:
+    moves = [chess.Move.from_uci(uci) for uci in data["moves"]]
+    return GameRecord(data["headers"], moves, data["clocks"]), data["previous"]
+
+
+class RemoteJobQueue(WorkerQueue):
+    """The web app's /queue API (queue_api.py), for workers on other machines.
+
+    Claims and heartbeats that cannot reach the server are retried on the
+    next poll; a lease that lapses meanwhile just hands the job on.
+    """
+
+    def __init__(self, server_url: str, token: Optional[str] = None,
+                 timeout: Optional[float] = None):
+        self.base_url = server_url.rstrip("/") + "/queue"
+        self.token = config.JOB_API_TOKEN if token is None else token
+        self.timeout = timeout or _HTTP_TIMEOUT
+
+    def _request(self, method: str, path: str, payload: Optional[Dict] = None) -> Any:
+        body = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        request.add_header("Content-Type", "application/json")
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = response.read()
+        return json.loads(data) if data else None
+
+    def claim(self, worker_id: str) -> Optional[AnalysisJob]:
+        try:
+            data = self._request("POST", "/claim", {"worker_id": worker_id})
+        except OSError as e:
+            logger.warning("Could not claim a job from %s: %s", self.base_url, e)
+            return None
+        if data is None:
+            return None
+        return AnalysisJob(id=data["job_id"], game_id=data["game_id"], depth=data["depth"],
+                           adaptive=data["adaptive"], multipv=data["multipv"],
+                           status=JobStatus.RUNNING)
+
+    def game(self, job: AnalysisJob) -> Tuple[GameRecord, Optional[Mapping[str, Any]]]:
+        try:
+            data = self._request("GET", f"/games/{urllib.parse.quote(job.game_id, safe='')}")
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise ValueError(f"Game {job.game_id} not found") from None
+            raise
+        return game_from_wire(data)
+
+    def heartbeat(self, job_id: str, worker_id: str, plies_done: int, plies_total: int,
+                  mistakes: List[Dict]) -> bool:
+        try:
+            data = self._request("POST", f"/jobs/{job_id}/heartbeat", {
+                "worker_id": worker_id, "plies_done": plies_done,
+                "plies_total": plies_total, "mistakes": mistakes
+            })
+        except OSError as e:
+            # Keep analyzing; the next heartbeat may get through in time
+            logger.warning("Could not heartbeat job %s: %s", job_id, e)
+            return True
+        return data["leased"]
+
+    def complete(self, job_id: str, worker_id: str, plies_done: int, plies_total: int,
+                 mistakes: List[Dict], result: Dict[str, Any]):
+        self._request("POST", f"/jobs/{job_id}/complete", {
+            "worker_id": worker_id, "plies_done": plies_done, "plies_total": plies_total,
+            "mistakes": mistakes, "result": result
+        })
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = True):
+        self._request("POST", f"/jobs/{job_id}/fail",
+                      {"worker_id": worker_id, "error": error, "retry": retry})
+
+    def release(self, job_id: str, worker_id: str):
+        self._request("POST", f"/jobs/{job_id}/release", {"worker_id": worker_id})
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class AnalysisWorker:
+    """Claims jobs from a WorkerQueue and analyzes them, ``concurrency`` at a time.
+
+    One heartbeat thread extends the leases of all running jobs and publishes
+    their progress, so a slow search never lets a lease lapse.
+    """
+
+    def __init__(self, analyzer, queue: WorkerQueue, worker_id: Optional[str] = None,
+                 concurrency: int = 1):
+        self.analyzer = analyzer
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id()
+        self.concurrency = concurrency
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # Progress of the running jobs: job id -> [plies_done, plies_total, mistakes]
+        self._running: Dict[str, List[Any]] = {}
+
+    def run(self, until_empty: bool = False):
+        """Process jobs until ``stop`` (or, with ``until_empty``, until none are left)"""
+        threads = [
+            threading.Thread(target=self._work, args=(until_empty,),
+                             name=f"analysis-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        heartbeat = threading.Thread(target=self._heartbeat, name="analysis-heartbeat",
+                                     daemon=True)
+        heartbeat.start()
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        finally:
+            self._stop.set()
+            # Interrupted mid-analysis: let other workers pick the jobs up now
+            # rather than after their leases lapse
+            with self._lock:
+                running = list(self._running)
+            for job_id in running:
+                try:
+                    self.queue.release(job_id, self.worker_id)
+                except OSError as e:
+                    logger.warning("Could not release job %s: %s", job_id, e)
+
+    def stop(self):
+        self._stop.set()
+
+    def _work(self, until_empty: bool):
+        while not self._stop.is_set():
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                if until_empty:
+                    return
+                self._stop.wait(config.JOB_POLL_INTERVAL)
+                continue
+            try:
+                self._run(job)
+            except OSError as e:
+                # The job server is unreachable; the lease lapses and the job
+                # goes to another worker
+                logger.warning("Could not report job %s: %s", job.id, e)
+
+    def _run(self, job: AnalysisJob):
+        state = [0, 0, []]
+        with self._lock:
+            self._running[job.id] = state
+
+        def progress(plies_done: int, plies_total: int, mistake: Optional[Dict]):
+            with self._lock:
+                state[0] = plies_done
+                state[1] = plies_total
+                if mistake:
+                    state[2].append(mistake)
+
+        logger.info("Analyzing game %s (job %s)", job.game_id, job.id)
+        try:
+            record, previous = self.queue.game(job)
+            result = self.analyzer.analyze_record(record, previous, job.depth, progress=progress,
+                                                  adaptive=job.adaptive, multipv=job.multipv)
+        except ValueError as e:
+            # The job itself is bad (e.g. the game does not exist); retrying won't help
+            self.queue.fail(job.id, self.worker_id, str(e), retry=False)
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            self.queue.fail(job.id, self.worker_id, str(e))
+        else:
+            with self._lock:
+                plies_done, plies_total, mistakes = state[0], state[1], list(state[2])
+            self.queue.complete(job.id, self.worker_id, plies_done, plies_total, mistakes,
+                                result)
+        finally:
+            with self._lock:
+                del self._running[job.id]
+
+    def _heartbeat(self):
+        while not self._stop.wait(config.JOB_HEARTBEAT_SECONDS):
+            with self._lock:
+                running = [(job_id, state[0], state[1], list(state[2]))
+                           for job_id, state in self._running.items()]
+            for job_id, plies_done, plies_total, mistakes in running:
+                if not self.queue.heartbeat(job_id, self.worker_id, plies_done,
+                                            plies_total, mistakes):
+                    # Our lease lapsed and another worker may have the job; the
+                    # analysis still finishes, and saving it twice is harmless
+                    logger.warning("Lost the lease on job %s", job_id)
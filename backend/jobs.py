@@ -0,0 +1,244 @@
+# jobs.py
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from config import config
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class AnalysisJob:
+    id: str
+    game_id: str
+    depth: int
+    adaptive: bool = False
+    multipv: bool = False
+    status: JobStatus = JobStatus.QUEUED
+    plies_done: int = 0
+    plies_total: int = 0
+    mistakes: List[Dict] = field(default_factory=list)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # Bumped on every change so streams can wait for the next update
+    version: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+    def eta_seconds(self) -> Optional[float]:
+        if self.status is not JobStatus.RUNNING or not self.plies_done:
+            return None
+        elapsed = time.time() - self.started_at
+        remaining = self.plies_total - self.plies_done
+        return elapsed / self.plies_done * remaining
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "game_id": self.game_id,
+            "depth": self.depth,
+            "adaptive": self.adaptive,
+            "multipv": self.multipv,
+            "status": self.status.value,
+            "plies_done": self.plies_done,
+            "plies_total": self.plies_total,
+            "eta_seconds": self.eta_seconds(),
+            "mistakes": self.mistakes,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class BaseJobManager:
+    """Tracks analysis jobs and their progress; subclasses decide where they run"""
+
+    def __init__(self, analyzer, history: Optional[int] = None):
+        self.analyzer = analyzer
+        self.history = history or config.JOB_HISTORY_SIZE
+        self._jobs: "OrderedDict[str, AnalysisJob]" = OrderedDict()
+        self._cond = threading.Condition()
+
+    def _register(self, game_id: str, depth: int, adaptive: bool,
+                  multipv: bool) -> AnalysisJob:
+        job = AnalysisJob(id=uuid.uuid4().hex, game_id=game_id, depth=depth,
+                          adaptive=adaptive, multipv=multipv)
+        with self._cond:
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def snapshot(self, job: AnalysisJob, include_result: bool = True) -> Dict[str, Any]:
+        with self._cond:
+            return job.to_dict(include_result)
+
+    def counts(self) -> Dict[str, int]:
+        with self._cond:
+            counts = {status.value: 0 for status in JobStatus}
+            for job in self._jobs.values():
+                counts[job.status.value] += 1
+            return counts
+
+    def _changed(self):
+        """Wake whoever waits for job updates; called with ``_cond`` held"""
+        self._cond.notify_all()
+
+    def _update(self, job: AnalysisJob, **changes):
+        with self._cond:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.version += 1
+            self._changed()
+
+    def _progress(self, job: AnalysisJob) -> Callable[[int, int, Optional[Dict]], None]:
+        def progress(plies_done: int, plies_total: int, mistake: Optional[Dict]):
+            with self._cond:
+                job.plies_done = plies_done
+                job.plies_total = plies_total
+                if mistake:
+                    job.mistakes.append(mistake)
+                job.version += 1
+                self._changed()
+        return progress
+
+    def _prune(self):
+        """Forget the oldest finished jobs once over the history limit"""
+        excess = len(self._jobs) - self.history
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.finished][:excess]:
+            del self._jobs[job_id]
+
+
+class JobManager(BaseJobManager):
+    """Runs analysis jobs on background threads and tracks their progress"""
+
+    def __init__(self, analyzer, workers: Optional[int] = None,
+                 history: Optional[int] = None):
+        super().__init__(analyzer, history)
+        # More threads than pooled engines would only wait on the pool
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or config.ENGINE_POOL_SIZE,
+            thread_name_prefix="analysis-job"
+        )
+
+    def submit(self, game_id: str, depth: int, adaptive: bool = False,
+               multipv: bool = False) -> AnalysisJob:
+        job = self._register(game_id, depth, adaptive, multipv)
+        self._executor.submit(self._run, job)
+        return job
+
+    def wait_for_update(self, job: AnalysisJob, version: int,
+                        timeout: float = 15.0) -> int:
+        """Block until the job changes past ``version`` (or timeout); return its version"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: job.version != version or job.finished, timeout
+            )
+            return job.version
+
+    def _run(self, job: AnalysisJob):
+        self._update(job, status=JobStatus.RUNNING, started_at=time.time())
+        try:
+            result = self.analyzer.analyze_game(
+                job.game_id, job.depth, progress=self._progress(job),
+                adaptive=job.adaptive, multipv=job.multipv
+            )
+        except Exception as e:
+            self._update(job, status=JobStatus.FAILED, error=str(e),
+                         finished_at=time.time())
+        else:
+            self._update(job, status=JobStatus.DONE, result=result,
+                         finished_at=time.time())
+
+
+class AsyncJobManager(BaseJobManager):
+    """Runs analysis jobs as tasks on the running event loop.
+
+    A queued or running job is a suspended task rather than a thread, so the
+    number of jobs in flight is bounded by memory, not by threads. Must be
+    created and used on the loop it runs jobs on.
+    """
+
+    def __init__(self, analyzer, workers: Optional[int] = None,
+                 history: Optional[int] = None):
+        super().__init__(analyzer, history)
+        # Jobs beyond the engine count queue here instead of timing out on the pool
+        self._slots = asyncio.Semaphore(workers or config.ENGINE_POOL_SIZE)
+        # Replaced on every update, so waiters only ever see a fresh one set
+        self._updated = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, game_id: str, depth: int, adaptive: bool = False,
+               multipv: bool = False) -> AnalysisJob:
+        job = self._register(game_id, depth, adaptive, multipv)
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def _changed(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def wait_for_update(self, job: AnalysisJob, version: int,
+                              timeout: float = 15.0) -> int:
+        """Wait until the job changes past ``version`` (or timeout); return its version"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while job.version == version and not job.finished:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._updated.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return job.version
+
+    async def _run(self, job: AnalysisJob):
+        async with self._slots:
+            self._update(job, status=JobStatus.RUNNING, started_at=time.time())
+            try:
+                result = await self.analyzer.analyze_game_async(
+                    job.game_id, job.depth, progress=self._progress(job),
+                    adaptive=job.adaptive, multipv=job.multipv
+                )
+            except Exception as e:
+                self._update(job, status=JobStatus.FAILED, error=str(e),
+                             finished_at=time.time())
+            else:
+                self._update(job, status=JobStatus.DONE, result=result,
+                             finished_at=time.time())
+
+    async def close(self):
+        """Cancel the jobs still queued or running"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,22 +1,83 @@
 # models.py
-import sqlite3
-from typing import List, Dict, Any
-import json
+import itertools
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from analysis_format import load_analysis
+from db import get_connection
+from metrics import DB_QUERY_SECONDS, timed
+from move_encoding import load_game_record
+
+# Rows per query when walking a keyset, which bounds memory however many
+# rows there are in total
+_KEYSET_BATCH = 500
+
+_GAME_COLUMNS = "id, white, black, date, result, analyzed"
+# Missing dates sort as oldest; the games indexes are built on this expression
+_SORT_DATE = "IFNULL(date, '')"
+
+def _iter_game_rows(db_path: str, columns: str, username: Optional[str],
+                    after: Optional[List[Any]], batch_size: int, method: str,
+                    inclusive: bool = False) -> Iterator[Tuple]:
+    """``(sort_date, *columns)`` rows of games, newest first, in batches.
+    
+    Each batch is a separate query seeking past the last key, so no read
+    transaction stays open while callers (e.g. streaming responses) consume
+    rows. A player's games are merged from the white and black indexes.
+    """
+    comparison = "<=" if inclusive else "<"
+    while True:
+        # Spelled out rather than as a row value comparison, which SQLite
+        # does not use as a range on the sort date index expressions
+        seek = (
+            f"AND {_SORT_DATE} <= ? AND ({_SORT_DATE} < ? OR id {comparison} ?)"
+            if after else ""
+        )
+        key = (after[0], after[0], after[1]) if after else ()
+        if username:
+            query = f"""
+                SELECT {_SORT_DATE} AS sort_date, {columns} FROM games
+                WHERE white = ? {seek}
+                UNION ALL
+                SELECT {_SORT_DATE}, {columns} FROM games
+                WHERE black = ? AND white IS NOT ? {seek}
+                ORDER BY sort_date DESC, id DESC LIMIT ?
+            """
+            params = (username, *key, username, username, *key, batch_size)
+        else:
+            query = f"""
+                SELECT {_SORT_DATE} AS sort_date, {columns} FROM games
+                WHERE 1 {seek}
+                ORDER BY sort_date DESC, id DESC LIMIT ?
+            """
+            params = (*key, batch_size)
+        
+        with DB_QUERY_SECONDS.time(method=method):
+            with get_connection(db_path) as conn:
+                rows = conn.execute(query, params).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = [rows[-1][0], rows[-1][1]]
+        comparison = "<"
 
 class GameModel:
     def __init__(self, db_path: str):
         self.db_path = db_path
     
+    @timed(DB_QUERY_SECONDS, method="GameModel.get_game")
     def get_game(self, game_id: str) -> Dict[str, Any]:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT * FROM games WHERE id = ?", (game_id,)
-            )
+        with get_connection(self.db_path) as conn:
+            cursor = conn.execute("""
+                SELECT id, pgn, white, black, date, result, analyzed, analysis,
+                       analysis_json, headers_json, moves, clocks
+                FROM games WHERE id = ?
+            """, (game_id,))
             row = cursor.fetchone()
         
         if not row:
             return None
-            
+        
+        record = load_game_record(row[1], row[9], row[10], row[11])
         return {
             "id": row[0],
             "pgn": row[1],
@@ -25,42 +86,55 @@ class GameModel:
             "date": row[4],
             "result": row[5],
             "analyzed": bool(row[6]),
-            "analysis": json.loads(row[7]) if row[7] else None
+            # Sections are only decoded when the caller reads them
+            "analysis": load_analysis(row[7], row[8]),
+            "headers": record.headers,
+            "moves": record.moves,
+            "clocks": record.clocks
         }
     
-    def get_all_games(self, username: str = None) -> List[Dict[str, Any]]:
-        query = "SELECT * FROM games"
-        params = ()
-        
-        if username:
-            query += " WHERE white = ? OR black = ?"
-            params = (username, username)
-        
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(query, params)
-            rows = cursor.fetchall()
+    @timed(DB_QUERY_SECONDS, method="GameModel.get_version")
+    def get_version(self, game_id: str) -> Optional[Dict[str, Any]]:
+        """Whether a game is analyzed and the data version of its analysis"""
+        with get_connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT analyzed, version, updated_at FROM games WHERE id = ?", (game_id,)
+            ).fetchone()
         
-        return [{
-            "id": row[0],
-            "white": row[2],
-            "black": row[3],
-            "date": row[4],
-            "result": row[5],
-            "analyzed": bool(row[6])
-        } for row in rows]
+        if not row:
+            return None
+        return {"analyzed": bool(row[0]), "version": row[1], "updated_at": row[2]}
+    
+    @timed(DB_QUERY_SECONDS, method="GameModel.get_all_games")
+    def get_all_games(self, username: str = None) -> List[Dict[str, Any]]:
+        return list(self.iter_games(username))
+    
+    def iter_games(self, username: Optional[str] = None, after: Optional[List[Any]] = None,
+                   batch_size: int = _KEYSET_BATCH) -> Iterator[Dict[str, Any]]:
+        """Games newest first, resuming after the ``[date, id]`` key of a
+        previous row (see ``game_key``)"""
+        for row in _iter_game_rows(self.db_path, _GAME_COLUMNS, username, after,
+                                   batch_size, "GameModel.iter_games"):
+            yield {
+                "id": row[1],
+                "white": row[2],
+                "black": row[3],
+                "date": row[4],
+                "result": row[5],
+                "analyzed": bool(row[6])
+            }
+    
+    @staticmethod
+    def game_key(game: Dict[str, Any]) -> List[Any]:
+        return [game["date"] or "", game["id"]]
 
 class MistakeModel:
     def __init__(self, db_path: str):
         self.db_path = db_path
     
-    def get_mistakes_by_game(self, game_id: str) -> List[Dict[str, Any]]:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT * FROM mistakes WHERE game_id = ? ORDER BY move_number", (game_id,)
-            )
-            rows = cursor.fetchall()
-        
-        return [{
+    @staticmethod
+    def _to_dict(row) -> Dict[str, Any]:
+        return {
             "id": row[0],
             "game_id": row[1],
             "move_number": row[2],
@@ -71,29 +145,92 @@ class MistakeModel:
             "eval_after": row[7],
             "eval_diff": row[8],
             "mistake_type": row[9],
-            "clock_time": row[10]
-        } for row in rows]
+            "clock_time": row[10],
+            "best_move": row[11]
+        }
     
-    def get_mistakes_by_player(self, username: str) -> List[Dict[str, Any]]:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                SELECT m.* FROM mistakes m
-                JOIN games g ON m.game_id = g.id
-                WHERE g.white = ? OR g.black = ?
-                ORDER BY g.date DESC
-            """, (username, username))
+    @timed(DB_QUERY_SECONDS, method="MistakeModel.get_mistakes_by_game")
+    def get_mistakes_by_game(self, game_id: str) -> List[Dict[str, Any]]:
+        with get_connection(self.db_path) as conn:
+            cursor = conn.execute(
+                "SELECT * FROM mistakes WHERE game_id = ? ORDER BY move_number", (game_id,)
+            )
             rows = cursor.fetchall()
         
+        return [self._to_dict(row) for row in rows]
+    
+    @timed(DB_QUERY_SECONDS, method="MistakeModel.get_mistakes_by_player")
+    def get_mistakes_by_player(self, username: str) -> List[Dict[str, Any]]:
+        return list(self.iter_mistakes_by_player(username))
+    
+    def iter_mistakes_by_player(self, username: str, after: Optional[List[Any]] = None,
+                                batch_size: int = _KEYSET_BATCH) -> Iterator[Dict[str, Any]]:
+        """Mistakes in a player's games, newest game first and in move order
+        within a game, resuming after the key of a previous row (see
+        ``mistake_key``). Mistakes are fetched for ``batch_size`` games at a time.
+        """
+        games = _iter_game_rows(self.db_path, "id", username, after and after[:2],
+                                batch_size, "MistakeModel.iter_mistakes_by_player",
+                                inclusive=True)
+        min_id = after[2] if after else 0
+        while True:
+            batch = list(itertools.islice(games, batch_size))
+            if not batch:
+                return
+            placeholders = ",".join("?" * len(batch))
+            with DB_QUERY_SECONDS.time(method="MistakeModel.iter_mistakes_by_player"):
+                with get_connection(self.db_path) as conn:
+                    rows = conn.execute(
+                        f"SELECT * FROM mistakes WHERE game_id IN ({placeholders}) ORDER BY id",
+                        [game_id for _, game_id in batch]
+                    ).fetchall()
+            by_game: Dict[str, List[Tuple]] = {}
+            for row in rows:
+                by_game.setdefault(row[1], []).append(row)
+            
+            for sort_date, game_id in batch:
+                for row in by_game.get(game_id, ()):
+                    # The cursor's game is resumed part way through
+                    if after and game_id == after[1] and row[0] <= min_id:
+                        continue
+                    mistake = self._to_dict(row)
+                    mistake["game_date"] = sort_date
+                    yield mistake
+    
+    @staticmethod
+    def mistake_key(mistake: Dict[str, Any]) -> List[Any]:
+        return [mistake["game_date"], mistake["game_id"], mistake["id"]]
+    
+    @timed(DB_QUERY_SECONDS, method="MistakeModel.get_common_mistakes")
+    def get_common_mistakes(self, username: str, limit: int) -> List[Dict[str, Any]]:
+        """Positions that recur most among the mistakes in a player's games,
+        grouped on the indexed position key.
+        
+        Mistakes not yet keyed by ``ChessAnalyzer.fill_position_keys`` are
+        left out.
+        """
+        with get_connection(self.db_path) as conn:
+            groups = conn.execute("""
+                SELECT COUNT(*) AS occurrences, AVG(m.eval_diff), MIN(m.id)
+                FROM games g JOIN mistakes m ON m.game_id = g.id
+                WHERE (g.white = ? OR g.black = ?) AND m.position_key IS NOT NULL
+                GROUP BY m.position_key
+                ORDER BY occurrences DESC, MIN(m.id)
+                LIMIT ?
+            """, (username, username, limit)).fetchall()
+            
+            example_ids = [group[2] for group in groups]
+            placeholders = ",".join("?" * len(example_ids))
+            examples = {
+                row[0]: self._to_dict(row) for row in conn.execute(
+                    f"SELECT * FROM mistakes WHERE id IN ({placeholders})", example_ids
+                )
+            }
+        
         return [{
-            "id": row[0],
-            "game_id": row[1],
-            "move_number": row[2],
-            "fen_before": row[3],
-            "fen_after": row[4],
-            "player_color": row[5],
-            "eval_before": row[6],
-            "eval_after": row[7],
-            "eval_diff": row[8],
-            "mistake_type": row[9],
-            "clock_time": row[10]
-        } for row in rows]
\ No newline at end of file
+            # FEN without the move counters, as positions are grouped
+            "fen": " ".join(examples[example_id]["fen_before"].split(" ")[:4]),
+            "count": count,
+            "average_eval_diff": average,
+            "example_mistake": examples[example_id]
+        } for count, average, example_id in groups]
@@ -0,0 +1,134 @@
+# move_encoding.py
+import io
+import json
+import sys
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+import chess
+import chess.pgn
+
+# Each move is one 16-bit word: from | to << 6 | promotion piece type << 12.
+# Stored little-endian regardless of platform so databases stay portable.
+_SWAP = sys.byteorder != "little"
+
+
+def encode_moves(moves: List[chess.Move]) -> bytes:
+    words = array("H", (
+        move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+        for move in moves
+    ))
+    if _SWAP:
+        words.byteswap()
+    return words.tobytes()
+
+
+def decode_moves(blob: bytes) -> List[chess.Move]:
+    words = array("H")
+    words.frombytes(blob)
+    if _SWAP:
+        words.byteswap()
+    return [
+        chess.Move(word & 0x3F, word >> 6 & 0x3F, word >> 12 or None)
+        for word in words
+    ]
+
+
+def encode_clocks(clocks: List[Optional[float]]) -> Optional[bytes]:
+    """Pack remaining clock times as float32, NaN where a move has none"""
+    if all(clock is None for clock in clocks):
+        return None
+    values = array("f", (float("nan") if clock is None else clock for clock in clocks))
+    if _SWAP:
+        values.byteswap()
+    return values.tobytes()
+
+
+def decode_clocks(blob: Optional[bytes], count: int) -> List[Optional[float]]:
+    if blob is None:
+        return [None] * count
+    values = array("f")
+    values.frombytes(blob)
+    if _SWAP:
+        values.byteswap()
+    # NaN is the only value not equal to itself
+    return [value if value == value else None for value in values]
+
+
+@dataclass
+class GameRecord:
+    """A game's headers and mainline, as stored in the games table"""
+    headers: Dict[str, str]
+    moves: List[chess.Move] = field(default_factory=list)
+    clocks: List[Optional[float]] = field(default_factory=list)
+
+    def board(self) -> chess.Board:
+        """Starting position, honouring a FEN header"""
+        fen = self.headers.get("FEN")
+        return chess.Board(fen) if fen else chess.Board()
+
+    def replay(self) -> Iterator[Tuple[chess.Board, chess.Move]]:
+        """Yield ``(board_before, move)`` for each ply, pushing as it goes"""
+        board = self.board()
+        for move in self.moves:
+            yield board, move
+            board.push(move)
+
+    def encode(self) -> Tuple[str, bytes, Optional[bytes]]:
+        """``(headers_json, moves, clocks)`` column values"""
+        return json.dumps(self.headers), encode_moves(self.moves), encode_clocks(self.clocks)
+
+    @classmethod
+    def decode(cls, headers_json: str, moves: bytes,
+               clocks: Optional[bytes]) -> "GameRecord":
+        decoded = decode_moves(moves)
+        return cls(json.loads(headers_json), decoded, decode_clocks(clocks, len(decoded)))
+
+
+class _RecordBuilder(chess.pgn.BaseVisitor[GameRecord]):
+    """Collects headers, mainline moves and %clk times, skipping variations"""
+
+    def begin_game(self):
+        self.record = GameRecord({})
+
+    def visit_header(self, tagname: str, tagvalue: str):
+        self.record.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board: chess.Board, move: chess.Move):
+        self.record.moves.append(move)
+        self.record.clocks.append(None)
+
+    def visit_comment(self, comment: str):
+        if not self.record.moves or self.record.clocks[-1] is not None:
+            return
+        match = chess.pgn.CLOCK_REGEX.search(comment)
+        if match:
+            self.record.clocks[-1] = (
+                int(match.group("hours")) * 3600 + int(match.group("minutes")) * 60
+                + float(match.group("seconds"))
+            )
+
+    def handle_error(self, error: Exception):
+        # Keep the mainline up to the bad move, as chess.pgn.read_game does
+        pass
+
+    def result(self) -> GameRecord:
+        return self.record
+
+
+def read_game_record(handle: TextIO) -> Optional[GameRecord]:
+    """Parse the next game of a PGN stream into a GameRecord (None at the end)"""
+    return chess.pgn.read_game(handle, Visitor=_RecordBuilder)
+
+
+def load_game_record(pgn: str, headers_json: Optional[str], moves: Optional[bytes],
+                     clocks: Optional[bytes]) -> Optional[GameRecord]:
+    """GameRecord from a games row, parsing the PGN only for rows imported
+    before moves were stored pre-parsed (see ``init_db.py --encode-moves``)"""
+    if moves is None or headers_json is None:
+        return read_game_record(io.StringIO(pgn))
+    return GameRecord.decode(headers_json, moves, clocks)
@@ -0,0 +1,81 @@
+# openings.py
+import csv
+import io
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+from config import config
+
+
+@dataclass(frozen=True)
+class Opening:
+    eco: str
+    name: str
+    ply: int
+
+
+class OpeningBook:
+    """ECO openings indexed by the Zobrist hash of the position each line reaches.
+
+    Keying on the position rather than the move order means transpositions
+    classify as the named line they reach, and classifying a game is one
+    dictionary lookup per ply of its opening.
+    """
+
+    def __init__(self, positions: Dict[int, Opening]):
+        self.positions = positions
+        # No line is longer than this, so classification can stop here
+        self.max_ply = max((opening.ply for opening in positions.values()), default=0)
+
+    @classmethod
+    def from_tsv(cls, paths: Iterable[Path]) -> "OpeningBook":
+        """Load tab-separated ``eco``/``name``/``pgn`` files (lichess chess-openings layout)"""
+        positions: Dict[int, Opening] = {}
+        for path in paths:
+            with open(path, encoding="utf-8", newline="") as f:
+                for row in csv.DictReader(f, delimiter="\t"):
+                    game = chess.pgn.read_game(io.StringIO(row["pgn"]))
+                    if game is None or game.errors:
+                        continue
+                    board = game.end().board()
+                    opening = Opening(row["eco"], row["name"], board.ply())
+                    key = chess.polyglot.zobrist_hash(board)
+                    # Where two lines transpose, keep the shorter (more common) name
+                    existing = positions.get(key)
+                    if existing is None or opening.ply < existing.ply:
+                        positions[key] = opening
+        return cls(positions)
+
+    def classify(self, board: chess.Board, moves: Iterable[chess.Move]) -> Optional[Opening]:
+        """Deepest named position reached by playing ``moves`` from ``board``"""
+        board = board.copy(stack=False)
+        found = self.positions.get(chess.polyglot.zobrist_hash(board))
+        for ply, move in enumerate(moves, 1):
+            if ply > self.max_ply:
+                break
+            board.push(move)
+            found = self.positions.get(chess.polyglot.zobrist_hash(board), found)
+        return found
+
+
+_book: Optional[OpeningBook] = None
+_book_lock = threading.Lock()
+
+
+def _eco_files(path: Path) -> List[Path]:
+    return sorted(path.glob("*.tsv")) if path.is_dir() else [path]
+
+
+def get_opening_book() -> OpeningBook:
+    """The process-wide opening book, loaded from ``config.ECO_PATH`` on first use"""
+    global _book
+    with _book_lock:
+        if _book is None:
+            _book = OpeningBook.from_tsv(_eco_files(config.ECO_PATH))
+        return _book
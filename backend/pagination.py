@@ -0,0 +1,71 @@
+# pagination.py
+"""Keyset pagination and NDJSON streaming for the list endpoints.
+
+A cursor is the sort key of the last row a client has seen, encoded as an
+opaque token, so fetching the next page is an index seek rather than an
+OFFSET scan. With ``?format=ndjson`` every row after the cursor is streamed
+as one JSON object per line while it is being fetched.
+"""
+import base64
+import binascii
+import json
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from flask import Response, jsonify, request
+
+from config import config
+
+STREAM_BATCH = 500
+
+
+def encode_cursor(key: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> List[Any]:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid cursor") from None
+    if not isinstance(key, list):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def page_args(key_length: int) -> Tuple[Optional[List[Any]], int, bool]:
+    """``(after, limit, ndjson)`` from the query string; ValueError if malformed"""
+    token = request.args.get("cursor")
+    after = decode_cursor(token) if token else None
+    if after is not None and len(after) != key_length:
+        raise ValueError("Invalid cursor")
+    limit = int(request.args.get("limit", config.PAGE_SIZE))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    ndjson = request.args.get("format") == "ndjson"
+    return after, min(limit, config.MAX_PAGE_SIZE), ndjson
+
+
+def fetch_size(limit: int, ndjson: bool) -> int:
+    """Rows per query: a page plus one look-ahead row, or bigger batches when streaming"""
+    return max(limit + 1, STREAM_BATCH) if ndjson else limit + 1
+
+
+def page_response(items: Iterator[Any], key: Callable[[Any], List[Any]], name: str,
+                  limit: int, ndjson: bool, extra: Optional[Dict[str, Any]] = None):
+    """One page of ``items`` as ``{name: [...], "next_cursor": ...}``, or all
+    of them as NDJSON; ``items`` must be lazy for either to stay flat"""
+    if ndjson:
+        def lines():
+            for item in items:
+                yield json.dumps(item) + "\n"
+        return Response(lines(), mimetype="application/x-ndjson")
+
+    page = []
+    next_cursor = None
+    for item in items:
+        if len(page) == limit:
+            # One row past the page tells us there is another page
+            next_cursor = encode_cursor(key(page[-1]))
+            break
+        page.append(item)
+    return jsonify({**(extra or {}), name: page, "count": len(page), "next_cursor": next_cursor})
@@ -0,0 +1,365 @@
+# player_stats.py
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import chess
+import numpy as np
+
+from advanced_analysis import (
+    EndgameAnalyzer,
+    OpeningAnalyzer,
+    RatingTrendAnalyzer,
+    TimePressureAnalyzer
+)
+from analysis_engine import GamePhase
+from db import get_connection
+from metrics import DB_QUERY_SECONDS, timed
+from move_encoding import GameRecord
+from utils import calculate_time_control
+
+# Rating regression uses day offsets from this ordinal instead of raw ordinals
+# (~740000), which keeps the running sums of squares numerically stable
+_RATING_EPOCH = datetime(2000, 1, 1).toordinal()
+
+
+def _empty_phases() -> Dict[str, int]:
+    return {phase.value: 0 for phase in GamePhase}
+
+
+def _empty_stats() -> Dict[str, Any]:
+    return {
+        "mistakes": {"blunder": 0, "mistake": 0, "inaccuracy": 0},
+        "time_bins": [0] * len(TimePressureAnalyzer.BIN_LABELS),
+        "time_moves": [0] * len(TimePressureAnalyzer.BIN_LABELS),
+        "time_controls": {},
+        "openings": {},
+        "endgames": {"won": 0, "lost": 0, "drawn": 0, "mistakes": 0, "total": 0},
+        "phases": _empty_phases(),
+        "rating": {
+            "n": 0, "sx": 0.0, "sy": 0.0, "sxx": 0.0, "sxy": 0.0, "syy": 0.0,
+            "last_date": None, "last_rating": None
+        }
+    }
+
+
+def game_facts(record: GameRecord, opening_analyzer: OpeningAnalyzer,
+               analysis: Optional[Dict] = None) -> Dict[str, Any]:
+    """Per-game facts the aggregates need, independent of the analysis itself.
+
+    The endgame start is read from ``analysis`` when its phase timeline was
+    stored; older analyses fall back to replaying the moves.
+    """
+    headers = record.headers
+    board = record.board()
+    summary = analysis["summary"] if analysis else {}
+    if "endgame_start" in summary:
+        endgame_start = summary["endgame_start"]
+    else:
+        endgame_start = EndgameAnalyzer.find_endgame_start(record.board(), record.moves)
+    return {
+        "white": headers.get("White"),
+        "black": headers.get("Black"),
+        "result": headers.get("Result"),
+        "opening": opening_analyzer.classify_moves(record.board(), record.moves),
+        "endgame_start": endgame_start,
+        "time_control": _time_control(headers),
+        "clocks": record.clocks,
+        "start_fullmove": board.fullmove_number,
+        "black_first": board.turn == chess.BLACK
+    }
+
+
+def import_facts(headers: Dict[str, str]) -> Dict[str, Any]:
+    """What ``PlayerStatsStore.record_imports`` counts of a game, from its headers"""
+    return {
+        "white": headers.get("White"), "black": headers.get("Black"),
+        "date": headers.get("Date"), "white_elo": headers.get("WhiteElo"),
+        "black_elo": headers.get("BlackElo")
+    }
+
+
+def _time_control(headers: Dict[str, str]) -> Optional[str]:
+    try:
+        return calculate_time_control(headers)
+    except ValueError:
+        return None
+
+
+class PlayerStatsStore:
+    """Materialized per-player statistics in the ``player_stats`` table.
+
+    Rows are updated incrementally as games are imported and analyzed, so
+    reading a player's stats is a single primary key lookup.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.opening_analyzer = OpeningAnalyzer()
+
+    @timed(DB_QUERY_SECONDS, method="PlayerStatsStore.get")
+    def get(self, username: str) -> Optional[Dict[str, Any]]:
+        with get_connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT total_games, analyzed_games, stats_json, updated_at "
+                "FROM player_stats WHERE username = ?", (username,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "total_games": row[0],
+            "analyzed_games": row[1],
+            "stats": json.loads(row[2]),
+            "updated_at": row[3]
+        }
+
+    @timed(DB_QUERY_SECONDS, method="PlayerStatsStore.get_version")
+    def get_version(self, username: str) -> Optional[Dict[str, Any]]:
+        """The data version of a player's row, without decoding the stats"""
+        with get_connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT analyzed_games, version, updated_at FROM player_stats WHERE username = ?",
+                (username,)
+            ).fetchone()
+        if not row:
+            return None
+        return {"analyzed_games": row[0], "version": row[1], "updated_at": row[2]}
+
+    def _load(self, conn: sqlite3.Connection, username: str) -> List[Any]:
+        row = conn.execute(
+            "SELECT total_games, analyzed_games, stats_json FROM player_stats WHERE username = ?",
+            (username,)
+        ).fetchone()
+        if not row:
+            return [0, 0, _empty_stats()]
+        return [row[0], row[1], json.loads(row[2])]
+
+    def _save(self, conn: sqlite3.Connection, username: str, entry: List[Any]):
+        # Every write bumps the row's version, the ETag of /stats/<username>
+        conn.execute("""
+            INSERT INTO player_stats (
+                username, total_games, analyzed_games, stats_json, updated_at, version
+            ) VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT(username) DO UPDATE SET
+                total_games = excluded.total_games,
+                analyzed_games = excluded.analyzed_games,
+                stats_json = excluded.stats_json,
+                updated_at = excluded.updated_at,
+                version = player_stats.version + 1
+        """, (username, entry[0], entry[1], json.dumps(entry[2]), datetime.now().isoformat()))
+
+    def reset(self, conn: sqlite3.Connection):
+        """Zero every player's aggregates ahead of a rebuild.
+
+        Rows are kept rather than deleted so their versions keep increasing
+        and responses cached for the old numbers go stale.
+        """
+        conn.execute(
+            "UPDATE player_stats SET total_games = 0, analyzed_games = 0, stats_json = ?",
+            (json.dumps(_empty_stats()),)
+        )
+
+    def record_imports(self, conn: sqlite3.Connection, games: Iterable[Dict[str, Any]]):
+        """Count newly imported games and their ratings.
+
+        ``games`` are dicts with white, black, date and the WhiteElo/BlackElo
+        headers. Must run inside the transaction that inserted the games.
+        """
+        entries: Dict[str, List[Any]] = {}
+        for game in games:
+            for color in ("white", "black"):
+                username = game[color]
+                if not username:
+                    continue
+                if username not in entries:
+                    entries[username] = self._load(conn, username)
+                entry = entries[username]
+                entry[0] += 1
+                self._add_rating(entry[2]["rating"], game["date"], game[f"{color}_elo"])
+
+        for username, entry in entries.items():
+            self._save(conn, username, entry)
+
+    @staticmethod
+    def _add_rating(sums: Dict[str, Any], date: Optional[str], elo: Optional[str]):
+        try:
+            rating = int(elo)
+            day = datetime.strptime(date, "%Y.%m.%d").toordinal() - _RATING_EPOCH
+        except (TypeError, ValueError):
+            return
+
+        sums["n"] += 1
+        sums["sx"] += day
+        sums["sy"] += rating
+        sums["sxx"] += day * day
+        sums["sxy"] += day * rating
+        sums["syy"] += rating * rating
+        if sums["last_date"] is None or day >= sums["last_date"]:
+            sums["last_date"] = day
+            sums["last_rating"] = rating
+
+    def apply_analysis(self, conn: sqlite3.Connection, facts: Dict[str, Any],
+                       old_analysis: Optional[Dict], new_analysis: Dict):
+        """Fold a game's (re-)analysis into both players' aggregates.
+
+        A previous analysis of the same game is subtracted first so that
+        re-analysis does not double count. Must run inside the transaction
+        that stores the analysis, after it has taken the write lock.
+        """
+        for color in ("white", "black"):
+            username = facts[color]
+            if not username:
+                continue
+            entry = self._load(conn, username)
+            if old_analysis is not None:
+                self._add_game(entry, facts, color, old_analysis, -1)
+            self._add_game(entry, facts, color, new_analysis, 1)
+            self._save(conn, username, entry)
+
+    @staticmethod
+    def _add_game(entry: List[Any], facts: Dict[str, Any], color: str,
+                  analysis: Dict, sign: int):
+        stats = entry[2]
+        entry[1] += sign
+
+        own_mistakes = [m for m in analysis["mistakes"] if m["player"] == color]
+        PlayerStatsStore._add_clocks(stats, facts, color, own_mistakes, sign)
+        for mistake in own_mistakes:
+            stats["mistakes"][mistake["mistake_type"]] += sign
+            # Analyses from before the phase timeline have no phase per mistake
+            if "phase" in mistake:
+                phases = stats.setdefault("phases", _empty_phases())
+                phases[mistake["phase"]] += sign
+
+        opening = stats["openings"].setdefault(facts["opening"], {"count": 0, "mistakes": 0})
+        opening["count"] += sign
+        opening["mistakes"] += sign * len(own_mistakes)
+        if opening["count"] <= 0:
+            del stats["openings"][facts["opening"]]
+
+        endgame_start = facts["endgame_start"]
+        if endgame_start is not None:
+            endgames = stats["endgames"]
+            endgames["total"] += sign
+            result = facts["result"]
+            if (result == "1-0" and color == "white") or (result == "0-1" and color == "black"):
+                endgames["won"] += sign
+            elif result == "1/2-1/2":
+                endgames["drawn"] += sign
+            else:
+                endgames["lost"] += sign
+            endgames["mistakes"] += sign * sum(
+                1 for m in own_mistakes if m["move_number"] >= endgame_start
+            )
+
+    @staticmethod
+    def _add_clocks(stats: Dict[str, Any], facts: Dict[str, Any], color: str,
+                    own_mistakes: List[Dict], sign: int):
+        """Add the player's moves and mistakes to the remaining-time bins, both
+        overall and with the bins of the game's time control"""
+        clocks = facts["clocks"]
+        if not any(clock is not None for clock in clocks):
+            return
+        
+        black_first = facts["black_first"]
+        first_ply = int(black_first) if color == "white" else int(not black_first)
+        mistake_plies = [
+            2 * (m["move_number"] - facts["start_fullmove"])
+            + (m["player"] == "black") - black_first
+            for m in own_mistakes
+        ]
+        own_clocks, flags = TimePressureAnalyzer.player_plies(clocks, mistake_plies, first_ply)
+        
+        mistakes, moves = TimePressureAnalyzer.bin_counts(
+            own_clocks, flags, TimePressureAnalyzer.TIME_BINS
+        )
+        stats["time_bins"] = (np.asarray(stats["time_bins"]) + sign * mistakes).tolist()
+        stats["time_moves"] = (
+            np.asarray(stats.get("time_moves", 0)) + sign * moves
+        ).tolist()
+        
+        time_control = facts["time_control"] or "Unknown"
+        controls = stats.setdefault("time_controls", {})
+        if time_control not in controls:
+            edges = TimePressureAnalyzer.bins_for(facts["time_control"])
+            controls[time_control] = {
+                "edges": edges[:-1], "mistakes": [0] * (len(edges) - 1),
+                "moves": [0] * (len(edges) - 1)
+            }
+        entry = controls[time_control]
+        edges = PlayerStatsStore._entry_edges(entry, time_control)
+        if edges is None:
+            return
+        mistakes, moves = TimePressureAnalyzer.bin_counts(own_clocks, flags, edges)
+        entry["mistakes"] = (np.asarray(entry["mistakes"]) + sign * mistakes).tolist()
+        entry["moves"] = (np.asarray(entry["moves"]) + sign * moves).tolist()
+        if not any(entry["moves"]):
+            del stats["time_controls"][time_control]
+    
+    @staticmethod
+    def _entry_edges(entry: Dict[str, Any], time_control: str) -> Optional[List[float]]:
+        """Bin edges a time control's counts were aggregated with.
+        
+        Entries keep the edges they were created with, so changing
+        TIME_PRESSURE_BINS only applies after ``init_db.py
+        --rebuild-player-stats``. Entries from before edges were stored are
+        assumed to use the current ones; None if those no longer fit.
+        """
+        if "edges" in entry:
+            return entry["edges"] + [float('inf')]
+        edges = TimePressureAnalyzer.bins_for(None if time_control == "Unknown" else time_control)
+        return edges if len(edges) - 1 == len(entry["moves"]) else None
+    
+    @staticmethod
+    def _time_response(edges: List[float], mistakes: List[int],
+                       moves: List[int]) -> Dict[str, Any]:
+        return {
+            "time_bins": TimePressureAnalyzer.bin_labels(edges),
+            "mistake_counts": mistakes,
+            "move_counts": moves,
+            "mistake_rates": [
+                count / total * 100 if total else 0
+                for count, total in zip(mistakes, moves)
+            ]
+        }
+    
+    @staticmethod
+    def to_response(username: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape a stored row like the /stats/<username> payload"""
+        stats = row["stats"]
+        opening_stats = {
+            name: {
+                "count": data["count"],
+                "mistakes": data["mistakes"],
+                "avg_rating_diff": 0,
+                "avg_mistakes": data["mistakes"] / data["count"]
+            }
+            for name, data in stats["openings"].items()
+        }
+        time_stats = {}
+        if any(stats["time_bins"]) or any(stats.get("time_moves", [])):
+            # Rows written before move totals were tracked need a rebuild
+            moves = stats.get("time_moves", [0] * len(stats["time_bins"]))
+            time_stats = PlayerStatsStore._time_response(
+                TimePressureAnalyzer.TIME_BINS, stats["time_bins"], moves
+            )
+            time_stats["by_time_control"] = {}
+            for time_control, data in stats.get("time_controls", {}).items():
+                edges = PlayerStatsStore._entry_edges(data, time_control)
+                if edges is not None:
+                    time_stats["by_time_control"][time_control] = PlayerStatsStore._time_response(
+                        edges, data["mistakes"], data["moves"]
+                    )
+        return {
+            "username": username,
+            "total_games": row["total_games"],
+            "analyzed_games": row["analyzed_games"],
+            "mistakeDistribution": stats["mistakes"],
+            "timePressureStats": time_stats,
+            "openingStats": opening_stats,
+            "ratingTrend": RatingTrendAnalyzer.trend_from_sums(stats["rating"]),
+            "endgamePerformance": stats["endgames"],
+            "phaseMistakes": stats.get("phases", _empty_phases()),
+            "lastUpdated": row["updated_at"]
+        }
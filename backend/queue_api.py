@@ -0,0 +1,70 @@
+# queue_api.py
+"""HTTP API through which ``worker.py --server`` workers use the job queue.
+
+Each route is one ``WorkerQueue`` call on the web app's JobQueue, so remote
+workers never open the database: they fetch the game of a claimed job, and
+the analysis they complete with is stored here. With ``JOB_API_TOKEN`` set,
+requests must carry it as ``Authorization: Bearer <token>``.
+"""
+import hmac
+
+from flask import Blueprint, jsonify, request
+
+from config import config
+from job_queue import JobQueue, game_to_wire
+
+
+def queue_blueprint(queue: JobQueue) -> Blueprint:
+    api = Blueprint('queue', __name__, url_prefix='/queue')
+
+    @api.before_request
+    def check_token():
+        token = config.JOB_API_TOKEN
+        if token and not hmac.compare_digest(
+                request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return jsonify({"error": "Invalid job API token"}), 401
+
+    @api.route('/claim', methods=['POST'])
+    def claim():
+        job = queue.claim(request.json['worker_id'])
+        if job is None:
+            return "", 204
+        return jsonify({
+            "job_id": job.id, "game_id": job.game_id, "depth": job.depth,
+            "adaptive": job.adaptive, "multipv": job.multipv
+        })
+
+    @api.route('/games/<game_id>', methods=['GET'])
+    def game(game_id: str):
+        try:
+            record, previous = queue.analyzer.read_game(game_id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 404
+        return jsonify(game_to_wire(record, previous))
+
+    @api.route('/jobs/<job_id>/heartbeat', methods=['POST'])
+    def heartbeat(job_id: str):
+        data = request.json
+        leased = queue.heartbeat(job_id, data['worker_id'], data['plies_done'],
+                                 data['plies_total'], data['mistakes'])
+        return jsonify({"leased": leased})
+
+    @api.route('/jobs/<job_id>/complete', methods=['POST'])
+    def complete(job_id: str):
+        data = request.json
+        queue.complete(job_id, data['worker_id'], data['plies_done'], data['plies_total'],
+                       data['mistakes'], data['result'])
+        return jsonify({"status": "done"})
+
+    @api.route('/jobs/<job_id>/fail', methods=['POST'])
+    def fail(job_id: str):
+        data = request.json
+        queue.fail(job_id, data['worker_id'], data['error'], data.get('retry', True))
+        return jsonify({"status": "failed"})
+
+    @api.route('/jobs/<job_id>/release', methods=['POST'])
+    def release(job_id: str):
+        queue.release(job_id, request.json['worker_id'])
+        return jsonify({"status": "released"})
+
+    return api
@@ -0,0 +1,127 @@
+# response_cache.py
+"""Conditional GET and an in-process cache for derived JSON responses.
+
+Responses such as a player's stats or a game's review are pure functions of
+stored data that only changes on import or analysis. Those writes bump a data
+version (``player_stats.version``, ``games.version``), which becomes the
+response's ETag. A request then costs a version lookup: a 304 if the client
+already holds that version, otherwise the cached body if one was rendered for
+it, and only failing both is the response recomputed.
+
+Entries are keyed by scope (e.g. ``("stats", username)``) and hold the body of
+one version, so a write makes the old entry unreachable even when it happens
+in another process (batch analysis workers); writers in this process also
+invalidate their scopes to free the memory straight away.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import Response, json, request
+from werkzeug.http import is_resource_modified
+
+from config import config
+
+Scope = Tuple[str, str]
+
+
+class ResponseCache:
+    """LRU of rendered response bodies, bounded by entries and total bytes"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Scope, Tuple[int, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scope: Scope, version: int) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(scope)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, scope: Scope, version: int, body: bytes):
+        if len(body) > self.max_bytes or not self.max_entries:
+            return
+        with self._lock:
+            self._discard(scope)
+            self._entries[scope] = (version, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def invalidate(self, *scopes: Scope):
+        with self._lock:
+            for scope in scopes:
+                self._discard(scope)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _discard(self, scope: Scope):
+        entry = self._entries.pop(scope, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            entries, size = len(self._entries), self._bytes
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries,
+            "bytes": size
+        }
+
+
+response_cache = ResponseCache(config.RESPONSE_CACHE_SIZE, config.RESPONSE_CACHE_BYTES)
+
+
+def _http_date(updated_at: Optional[str]) -> Optional[datetime]:
+    # updated_at columns hold local-time isoformat strings
+    if not updated_at:
+        return None
+    return datetime.fromisoformat(updated_at).astimezone(timezone.utc)
+
+
+def versioned_json(scope: Scope, version: int, updated_at: Optional[str],
+                   build: Callable[[], Any]) -> Response:
+    """JSON response for ``version`` of the data behind ``scope``.
+
+    ``build`` is only called when the client does not hold this version and
+    no body for it is cached.
+    """
+    # Versions are per row, so the ETag also has to name the row
+    key = hashlib.sha1("\0".join(scope).encode()).hexdigest()[:16]
+    etag = f"{scope[0]}-{key}-{version}"
+    last_modified = _http_date(updated_at)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        body = response_cache.get(scope, version)
+        if body is None:
+            body = json.dumps(build()).encode()
+            response_cache.put(scope, version, body)
+        response = Response(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Clients may keep the body but must check the version before reusing it
+    response.cache_control.no_cache = True
+    return response
@@ -1,60 +1,143 @@
 # utils.py
 import hashlib
+import io
 import json
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, Mapping, TextIO
 import chess.pgn
 from datetime import datetime
 
+from analysis_format import decode_analysis, encode_analysis
+from move_encoding import GameRecord, encode_moves, read_game_record
+
 def generate_game_id(game: chess.pgn.Game) -> str:
     """Generate unique ID for a game"""
-    headers = game.headers
+    return game_id_from_headers(game.headers, encode_moves(list(game.mainline_moves())))
+
+def legacy_game_id(headers: Mapping[str, str]) -> str:
+    """ID games were stored under before their moves were part of it"""
     unique_str = f"{headers.get('White','')}-{headers.get('Black','')}-{headers.get('Date','')}-{headers.get('Result','')}"
     return hashlib.md5(unique_str.encode()).hexdigest()
 
-def save_analysis_to_file(game_id: str, analysis: Dict[str, Any], output_dir: str = "./analysis"):
-    """Save analysis JSON to file"""
-    Path(output_dir).mkdir(exist_ok=True)
-    file_path = Path(output_dir) / f"{game_id}.json"
+def game_id_from_headers(headers: Mapping[str, str], moves: bytes) -> str:
+    """Generate unique ID for a game from its PGN headers and encoded mainline.
     
-    with open(file_path, 'w') as f:
-        json.dump(analysis, f, indent=2)
+    Players, date and result alone collide for same-day rematches with the
+    same result, so the moves are hashed in as well.
+    """
+    unique_str = f"{headers.get('White','')}-{headers.get('Black','')}-{headers.get('Date','')}-{headers.get('Result','')}"
+    return hashlib.md5(unique_str.encode() + b"\0" + moves).hexdigest()
+
+def save_analysis_to_file(game_id: str, analysis: Mapping[str, Any], output_dir: str = "./analysis"):
+    """Save an analysis to file in the binary analysis format"""
+    Path(output_dir).mkdir(exist_ok=True)
+    file_path = Path(output_dir) / f"{game_id}.analysis"
+    file_path.write_bytes(encode_analysis(analysis))
     
     return file_path
 
-def load_analysis_from_file(game_id: str, input_dir: str = "./analysis") -> Optional[Dict[str, Any]]:
-    """Load analysis JSON from file"""
-    file_path = Path(input_dir) / f"{game_id}.json"
+def load_analysis_from_file(game_id: str, input_dir: str = "./analysis") -> Optional[Mapping[str, Any]]:
+    """Load an analysis file, falling back to the JSON files written by older versions"""
+    file_path = Path(input_dir) / f"{game_id}.analysis"
+    if file_path.exists():
+        return decode_analysis(file_path.read_bytes())
     
+    file_path = file_path.with_suffix(".json")
     if not file_path.exists():
         return None
     
     with open(file_path, 'r') as f:
         return json.load(f)
 
+def _ends_in_comment(line: str, in_comment: bool) -> bool:
+    """Whether a ``{`` comment is still open at the end of a movetext line.
+    
+    Brace comments do not nest, and a ``;`` outside one comments out the
+    rest of the line, braces included.
+    """
+    pos = 0
+    while True:
+        if in_comment:
+            pos = line.find("}", pos)
+            if pos < 0:
+                return True
+            in_comment = False
+        else:
+            brace = line.find("{", pos)
+            semicolon = line.find(";", pos)
+            if brace < 0 or 0 <= semicolon < brace:
+                return False
+            pos = brace
+            in_comment = True
+        pos += 1
+
+def iter_pgn_chunks(handle: TextIO) -> Iterator[str]:
+    """Split a multi-game PGN stream into the raw text of each game.
+    
+    Only tracks header lines and comment braces, so it runs in constant
+    memory and is much cheaper than parsing the movetext.
+    """
+    lines = []
+    in_movetext = False
+    in_comment = False
+    
+    for line in handle:
+        if not lines and not in_movetext:
+            line = line.lstrip("\ufeff")
+        stripped = line.strip()
+        
+        if not in_comment and stripped.startswith("["):
+            # A header after movetext starts the next game
+            if in_movetext:
+                yield "".join(lines)
+                lines = []
+                in_movetext = False
+        elif stripped and not stripped.startswith("%"):
+            in_movetext = True
+            in_comment = _ends_in_comment(stripped, in_comment)
+        
+        lines.append(line)
+    
+    if any(line.strip() for line in lines):
+        yield "".join(lines)
+
 def pgn_to_json(pgn_text: str) -> Dict[str, Any]:
     """Convert PGN to JSON structure"""
-    game = chess.pgn.read_game(pgn_text)
-    if not game:
+    record = read_game_record(io.StringIO(pgn_text))
+    if not record:
         return None
-    
+    return record_to_json(record)
+
+def record_to_json(record: GameRecord) -> Dict[str, Any]:
+    """JSON structure of a stored game, without going through PGN"""
     result = {
-        "headers": dict(game.headers),
+        "headers": dict(record.headers),
         "moves": []
     }
     
-    board = game.board()
-    for node in game.mainline():
-        move = node.move
+    for (board, move), clock in zip(record.replay(), record.clocks):
         result["moves"].append({
             "move": board.san(move),
             "fen": board.fen(),
-            "clock": node.clock() if hasattr(node, "clock") else None
+            "clock": clock
         })
-        board.push(move)
     
     return result
 
+def json_flag(data: Mapping[str, Any], name: str, default: bool) -> bool:
+    """Boolean option from a JSON body; ValueError unless it is a boolean
+    (or "true"/"false"/1/0, which some clients send instead)"""
+    value = data.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "1", "false", "0"):
+        return value.strip().lower() in ("true", "1")
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    raise ValueError(f"{name} must be true or false")
+
 def format_timestamp(timestamp: float) -> str:
     """Format timestamp to readable date"""
     return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
@@ -75,31 +158,3 @@ def calculate_time_control(headers: Dict[str, str]) -> Optional[str]:
     if increment > 0:
         return f"{initial}+{increment}"
     return f"{initial} min"
-
-# config.py
-import os
-from pathlib import Path
-
-class Config:
-    def __init__(self):
-        self.DATA_DIR = Path(os.getenv("CHESS_DATA_DIR", "./data"))
-        self.ANALYSIS_DIR = self.DATA_DIR / "analysis"
-        self.PGN_DIR = self.DATA_DIR / "pgn"
-        self.ENGINE_PATH = os.getenv("STOCKFISH_PATH", "./stockfish")
-        self.ENGINE_DEPTH = int(os.getenv("ANALYSIS_DEPTH", 18))
-        self.ENGINE_THREADS = int(os.getenv("ENGINE_THREADS", 2))
-        self.ENGINE_HASH = int(os.getenv("ENGINE_HASH", 2048))
-        
-        # Create directories if they don't exist
-        self.DATA_DIR.mkdir(exist_ok=True)
-        self.ANALYSIS_DIR.mkdir(exist_ok=True)
-        self.PGN_DIR.mkdir(exist_ok=True)
-    
-    def get_engine_config(self) -> Dict[str, Any]:
-        return {
-            "depth": self.ENGINE_DEPTH,
-            "threads": self.ENGINE_THREADS,
-            "hash": self.ENGINE_HASH
-        }
-
-config = Config()
\ No newline at end of file
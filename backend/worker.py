@@ -0,0 +1,36 @@
+# worker.py
+import argparse
+import logging
+
+from chess_analyzer import ChessAnalyzer
+from config import config
+from job_queue import AnalysisWorker, JobQueue, RemoteJobQueue, default_worker_id
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run queued analysis jobs (start the web app with JOB_QUEUE=db)"
+    )
+    parser.add_argument("--server",
+                        help="web app URL (e.g. http://host:5000) to take jobs from over "
+                             "HTTP; without it the worker uses the local database directly")
+    parser.add_argument("--concurrency", type=int, default=config.ENGINE_POOL_SIZE,
+                        help="games analyzed at once, one engine each")
+    parser.add_argument("--worker-id", default=default_worker_id(),
+                        help="name recorded on claimed jobs (default: host:pid)")
+    parser.add_argument("--until-empty", action="store_true",
+                        help="exit once the queue is empty instead of waiting for jobs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    # With --server the local database only holds this machine's eval cache
+    analyzer = ChessAnalyzer()
+    analyzer.engine_pool.size = args.concurrency
+    queue = RemoteJobQueue(args.server) if args.server else JobQueue(analyzer)
+    worker = AnalysisWorker(analyzer, queue, args.worker_id, args.concurrency)
+
+    print(f"Worker {args.worker_id} processing jobs ({args.concurrency} at a time)...")
+    try:
+        worker.run(until_empty=args.until_empty)
+    except KeyboardInterrupt:
+        print("Stopping; unfinished jobs were returned to the queue")
@@ -10,15 +10,29 @@ const API_CONFIG = {
 const API_BASE = 'http://localhost:5000/api';
 
 
-export const getPlayerNames = async () => {
-  const response = await fetch(`${API_BASE}/players`);
+export const getPlayerNames = async (cursor = null) => {
+  const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+  const response = await fetch(`${API_BASE}/players${query}`);
   if (!response.ok) {
     throw new Error('Failed to fetch player names');
   }
   return response.json();
 };
 
-export const analyzeGame = async (gameId) => {
+export const getAnalysisJob = async (jobId) => {
+  const response = await fetch(`${API_BASE}/jobs/${jobId}`);
+  
+  if (!response.ok) {
+    throw new Error('Failed to get analysis job');
+  }
+  
+  return response.json();
+};
+
+// Analysis runs as a background job: submit it, then poll until it finishes.
+// onProgress receives each job snapshot (plies_done, plies_total, eta_seconds,
+// partial mistakes) while the analysis is running.
+export const analyzeGame = async (gameId, { onProgress, pollInterval = 1000 } = {}) => {
   const response = await fetch(`${API_BASE}/analyze`, {
     method: 'POST',
     headers: {
@@ -31,7 +45,18 @@ export const analyzeGame = async (gameId) => {
     throw new Error('Analysis failed');
   }
   
-  return response.json();
+  let job = await response.json();
+  while (job.status === 'queued' || job.status === 'running') {
+    if (onProgress) onProgress(job);
+    await new Promise((resolve) => setTimeout(resolve, pollInterval));
+    job = await getAnalysisJob(job.job_id);
+  }
+  
+  if (job.status === 'failed') {
+    throw new Error(job.error || 'Analysis failed');
+  }
+  
+  return job.result;
 };
 
 export const importPgn = async (pgnText) => {
@@ -18,7 +18,7 @@ const App = () => {
   const fetchPlayerGames = useCallback(async () => {
     const response = await fetch(`/api/games?username=${username}`);
     const data = await response.json();
-    setGames(data);
+    setGames(data.games);
   }, [username]); // Now stable unless username changes
   
   useEffect(() => {
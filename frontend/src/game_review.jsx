@@ -92,6 +92,9 @@ const GameReview = ({ gameId }) => {
                     }`}>
                       {review.key_moments[currentMistake].mistake_type} ({review.key_moments[currentMistake].eval_diff})
                     </p>
+                    {review.key_moments[currentMistake].best_move && (
+                      <p>Best was {review.key_moments[currentMistake].best_move}</p>
+                    )}
                   </div>
                   
                   <button
@@ -10,8 +10,15 @@ export const fetchPlayerNames = async (forceRefresh = false) => {
   }
 
   try {
-    const data = await getPlayerNames();
-    cachedPlayers = data.players;
+    // The list is paginated; follow next_cursor to the end
+    const players = [];
+    let cursor = null;
+    do {
+      const data = await getPlayerNames(cursor);
+      players.push(...data.players);
+      cursor = data.next_cursor;
+    } while (cursor);
+    cachedPlayers = players;
     lastFetchTime = Date.now();
     return cachedPlayers;
   } catch (error) {